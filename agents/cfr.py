@@ -0,0 +1,91 @@
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Optional
+
+import numpy as np
+
+from agents.player import Player
+from events import ActionEvent, GameEvent, HandStartEvent
+from mccfr import ACTIONS, FORMAT_VERSION, META_FILE, POSITIONS, STRATEGY_FILE, Abstraction, equity_buckets, get_tree, preflop_buckets
+from util import PlayerAction
+
+if TYPE_CHECKING:
+    from poker import PokerGame
+
+log = logging.getLogger(__name__)
+log.propagate = True
+
+
+class CFRPlayer(Player):
+    """
+    Heads-up agent playing the average strategy of an `MCCFRSolver` (see `mccfr.py`), loaded from an exported policy directory.
+
+    The player follows each hand through the betting tree by listening to the game's events, and samples its action from the
+    strategy of its information set. The strategy is trained for both players starting the hand with the policy's bankroll (as in
+    duplicate mode); with other stacks it keeps following the tree by action, and checks/calls once the hand leaves it.
+    """
+
+    def __init__(self, policy_path: str):
+        super().__init__("CFR Agent", True)
+        with open(os.path.join(policy_path, META_FILE)) as f:
+            meta: dict = json.load(f)
+        if meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Policy {policy_path} has format version {meta.get('version')}, expected {FORMAT_VERSION}")
+        self.abstraction: Abstraction = Abstraction(**{field: int(meta[field]) for field in Abstraction._fields})
+        self.strategy: np.ndarray = np.load(os.path.join(policy_path, STRATEGY_FILE), mmap_mode='r')
+        self.tree = get_tree(self.abstraction)
+        if self.strategy.shape != (self.tree.num_infosets, len(ACTIONS)):
+            raise ValueError(f"Policy {policy_path} has shape {self.strategy.shape}, expected {(self.tree.num_infosets, len(ACTIONS))}")
+        self.game: Optional["PokerGame"] = None
+        # Current betting tree node, or None outside of the tree
+        self.node: Optional[int] = None
+        self.position: int = 0
+        # This hand's bucket on each street, computed on the first decision of the street
+        self.buckets: dict[int, int] = {}
+
+    def join(self, game: "PokerGame") -> None:
+        if (game.small_blind, game.big_blind) != (self.abstraction.small_blind, self.abstraction.big_blind):
+            log.warning(f"CFR policy was trained with blinds {self.abstraction.small_blind}/{self.abstraction.big_blind}, the game uses {game.small_blind}/{game.big_blind}")
+        self.game = game
+        game.events.subscribe(self._follow)
+
+    def _follow(self, event: GameEvent) -> None:
+        if isinstance(event, HandStartEvent):
+            self.node = 0 if len(event.bankrolls) == POSITIONS else None
+            self.position = (self.seat - event.dealer) % POSITIONS
+            self.buckets.clear()
+        elif isinstance(event, ActionEvent) and self.node is not None:
+            child = int(self.tree.children[self.node, ACTIONS.index(event.action)])
+            self.node = child if 0 <= child < self.tree.num_nodes else None
+
+    def bucket(self, street: int) -> int:
+        bucket = self.buckets.get(street)
+        if bucket is None:
+            assert self.game is not None
+            hole_cards = np.array([self.cards], dtype=np.int8)
+            if street == 0:
+                bucket = int(preflop_buckets(hole_cards)[0])
+            else:
+                board = np.array([self.game.community_cards], dtype=np.int8)
+                bucket = int(equity_buckets(hole_cards, board, self.abstraction.postflop_buckets, self.abstraction.equity_samples, self.rng)[0])
+            self.buckets[street] = bucket
+        return bucket
+
+    def action(self, action_space: list[PlayerAction], observation, info) -> PlayerAction:
+        node = self.node
+        if node is None or self.game is None or self.tree.streets[node] != self.game.round.value or self.tree.players[node] != self.position:
+            return PlayerAction.CHECK_CALL if PlayerAction.CHECK_CALL in action_space else PlayerAction.FOLD
+        street = int(self.tree.streets[node])
+        probabilities = self.strategy[self.tree.offsets[node] + self.bucket(street)]
+        legal = [index for index, move in enumerate(ACTIONS) if move in action_space]
+        weights = [float(probabilities[index]) for index in legal]
+        total = sum(weights)
+        if total <= 0.0:
+            return ACTIONS[legal[self.rng.integers(len(legal))]]
+        draw = self.rng.random() * total
+        for index, weight in zip(legal, weights):
+            draw -= weight
+            if draw < 0.0:
+                return ACTIONS[index]
+        return ACTIONS[legal[-1]]
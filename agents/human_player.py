@@ -13,7 +13,7 @@ class HumanPlayer(Player):
         super().__init__("Human Agent", True)
 
     def action(self, action_space: list[PlayerAction], observation, info) -> PlayerAction:
-        log.info(f"Action space: {action_space}")
+        log.info("Action space: %s", action_space)
         print(f"Current possible actions: {action_space}")
         action: Optional[int] = None
         while action is None:
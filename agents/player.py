@@ -1,20 +1,63 @@
 import logging
+from typing import TYPE_CHECKING, Any, Optional, Sequence, Union
+
+import numpy as np
+
 from util import PlayerAction
 
+if TYPE_CHECKING:
+    from poker import PokerGame
+
 log = logging.getLogger(__name__)
 log.propagate = True
 
 
 class Player:
+    # Whether the player looks at the env's observation when acting on its own (autoplay players that don't get cheaper observations)
+    observes: bool = False
+
     def __init__(self, name: str, autoplay: bool):
         self.bankroll: int = 0
         self.name: str = name
         self.seat: int = 0
         self.actions: list[PlayerAction] = []  # Records the player's historical actions
-        self.cards: list[str] = []
+        self.cards: list[int] = []
         self.round_contribution: int = 0
         self.autoplay: bool = autoplay
+        # Built on first use (see `rng`) - seeding a generator costs more than the rest of a Player's construction
+        self._rng: Optional[np.random.Generator] = None
+        self._rng_seed: Union[None, int, Sequence[int]] = None
         log.debug(f"New Player {self.name} initialized")
 
+    @property
+    def rng(self) -> np.random.Generator:
+        """The stream the player's own random choices draw from: the one given to `set_rng()`, or one built from `seed_rng()`'s seed."""
+        if self._rng is None:
+            self._rng = np.random.default_rng(self._rng_seed)
+        return self._rng
+
+    def set_rng(self, gen: np.random.Generator) -> None:
+        """Use `gen` for the player's random choices (see `rng_streams.EpisodeSeeds`, which gives each seat its own stream)."""
+        self._rng = gen
+
+    def seed_rng(self, seed: Union[None, int, Sequence[int]]) -> None:
+        """Use a stream seeded with `seed` (anything `np.random.default_rng()` takes) for the player's random choices, built only if the player draws from it."""
+        self._rng, self._rng_seed = None, seed
+
+    def rng_state(self) -> Any:
+        """The position of the player's stream (None if it hasn't been built yet), kept in `PokerGame.snapshot()`."""
+        return None if self._rng is None else self._rng.bit_generator.state
+
+    def restore_rng_state(self, state: Any) -> None:
+        """Return the player's stream to a position from `rng_state()` (None drops the stream, to be built from its seed again)."""
+        if state is None:
+            self._rng = None
+        else:
+            self.rng.bit_generator.state = state
+
+    def join(self, game: "PokerGame") -> None:
+        """Called when the player is seated at a game (players that follow hands through the game's events subscribe here)."""
+        pass
+
     def action(self, action_space: list[PlayerAction], observation, info) -> PlayerAction:
         return PlayerAction.CHECK_CALL
@@ -1,11 +1,88 @@
 import logging
+from typing import TYPE_CHECKING, Optional
 
 from agents.player import Player
+from equity import estimate_equity
+from events import GameEvent, HandStartEvent
+from gym_env.encoder import ObservationEncoder, ObservationLayout
+from policy import FrozenPolicy
+from preflop import preflop_equity
+from qnetwork import QNetwork
+from qtable import legal_mask
+from util import PlayerAction
+
+if TYPE_CHECKING:
+    from poker import PokerGame
 
 log = logging.getLogger(__name__)
 log.propagate = True
 
 
 class QPlayer(Player):
-    def __init__(self):
-        super().__init__("Q-Learning Agent", False)
+    """
+    Q-learning agent.
+
+    Without a policy it is the learner, whose actions are passed to the env by the training loop. Given the path of a frozen policy
+    (see `QTable.export_policy()`) it plays on its own, looking its actions up in the memory-mapped policy.
+    """
+
+    # Needs its own observation (including equity, if the env computes it) when playing on its own
+    observes: bool = True
+
+    def __init__(self, policy_path: Optional[str] = None):
+        super().__init__("Q-Learning Agent", policy_path is not None)
+        self.policy: Optional[FrozenPolicy] = FrozenPolicy(policy_path) if policy_path is not None else None
+
+    def action(self, action_space: list[PlayerAction], observation, info) -> PlayerAction:
+        if self.policy is None:
+            raise RuntimeError("QPlayer without a policy can't pick actions - load one with QPlayer(policy_path)")
+        return self.policy.action(observation, action_space, self.rng)
+
+
+class DeepQPlayer(Player):
+    """
+    Agent playing the greedy policy of a `QNetwork` (see `qnetwork.py`), loaded from saved weights.
+
+    The player encodes its own flat observation from the game, following the game's events like the env's encoder does, so it
+    plays in any env whatever its observation mode. If the network was trained with the equity feature, the player estimates its
+    equity itself, like `TexasHoldemEnv` does.
+    """
+
+    def __init__(self, weights_path: str):
+        super().__init__("Deep Q-Learning Agent", True)
+        self.network: QNetwork = QNetwork.load(weights_path)
+        self.equity_samples: int = int(self.network.metadata.get('equity_samples', 0))
+        self.game: Optional["PokerGame"] = None
+        # Created on the first hand, once every player is seated
+        self.encoder: Optional[ObservationEncoder] = None
+
+    def join(self, game: "PokerGame") -> None:
+        self.game = game
+        game.events.subscribe(self._follow)
+
+    def _follow(self, event: GameEvent) -> None:
+        if not isinstance(event, HandStartEvent):
+            return
+        if self.encoder is None:
+            assert self.game is not None
+            layout = ObservationLayout(len(event.bankrolls), self.game.initial_bankroll, equity=self.equity_samples > 0)
+            if layout.size != self.network.num_features:
+                raise ValueError(f"Q-network takes {self.network.num_features} features, a {len(event.bankrolls)}-player game has {layout.size}"
+                                 f" (the network was trained with {self.network.metadata})")
+            self.encoder = ObservationEncoder(layout)
+            # Subscribed during this event's delivery - it only clears the stage fields, which are still zero
+            self.encoder.attach(self.game)
+
+    def _equity(self) -> float:
+        assert self.game is not None
+        opponents: int = max(self.game.active_players.count(True) - 1, 1)
+        if not self.game.community_cards:
+            return preflop_equity(self.cards, opponents + 1)
+        return estimate_equity(self.cards, self.game.community_cards, opponents, num_samples=self.equity_samples, batch_size=self.equity_samples, rng=self.rng).equity
+
+    def action(self, action_space: list[PlayerAction], observation, info) -> PlayerAction:
+        if self.game is None or self.encoder is None:
+            raise RuntimeError("DeepQPlayer has to be seated at a game (see Player.join()) before it can act")
+        features = self.encoder.encode(self.game, self._equity() if self.equity_samples > 0 else None)
+        legal = legal_mask(action_space, self.network.sizes[-1])
+        return PlayerAction(int(self.network.greedy(features[None], legal[None])[0]))
@@ -1,5 +1,7 @@
 import logging
-import random
+from typing import Any, Sequence, Union
+
+import numpy as np
 
 from agents.player import Player
 from util import PlayerAction
@@ -7,11 +9,38 @@ from util import PlayerAction
 log = logging.getLogger(__name__)
 log.propagate = True
 
+# Uniform draws are taken from the player's stream this many at a time: one `Generator.random()` call per action costs
+# several times more than the choice itself
+DRAW_BUFFER_SIZE: int = 256
+
 
 class RandomPlayer(Player):
     def __init__(self):
         super().__init__("Random Agent", True)
+        # Replaced on every refill, never modified, so snapshots can share it
+        self._draws: list[float] = []
+        self._next_draw: int = 0
+
+    def set_rng(self, gen: np.random.Generator) -> None:
+        super().set_rng(gen)
+        self._draws, self._next_draw = [], 0  # Draws buffered from the old stream must not leak into the new one
+
+    def seed_rng(self, seed: Union[None, int, Sequence[int]]) -> None:
+        super().seed_rng(seed)
+        self._draws, self._next_draw = [], 0
+
+    def rng_state(self) -> Any:
+        # The stream's position alone would skip the draws still waiting in the buffer
+        return (super().rng_state(), self._draws, self._next_draw)
+
+    def restore_rng_state(self, state: Any) -> None:
+        stream_state, self._draws, self._next_draw = state
+        super().restore_rng_state(stream_state)
 
     def action(self, action_space: list[PlayerAction], observation, info) -> PlayerAction:
-        log.info(f"Action space: {action_space}")
-        return random.choice(action_space)
+        log.info("Action space: %s", action_space)
+        if self._next_draw == len(self._draws):
+            self._draws, self._next_draw = self.rng.random(DRAW_BUFFER_SIZE).tolist(), 0
+        draw = self._draws[self._next_draw]
+        self._next_draw += 1
+        return action_space[int(draw * len(action_space))]
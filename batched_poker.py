@@ -0,0 +1,395 @@
+import argparse
+import logging
+import time
+from typing import Optional
+
+import numpy as np
+
+from agents.player import Player
+from equity import evaluate_batch, CATEGORY_SHIFT, STRAIGHT_FLUSH
+from poker import PokerGame, FRESH_DECK
+from util import ColoredFormatter, PlayerAction, Round
+
+log = logging.getLogger(__name__)
+
+# Indices into the legal move mask returned by BatchedPokerGame.determine_legal_moves()
+NUM_DECISIONS: int = 3
+# Betting rounds (pre-flop to river) that per-round stage data is kept for
+NUM_STAGES: int = 4
+
+
+class BatchedPokerGame:
+    """
+    Runs many independent tables of the `PokerGame` rules in lockstep.
+
+    All game state is held in NumPy arrays with a leading table dimension (struct-of-arrays), and every rule is applied to a
+    boolean mask of tables at once. The rules (including the order cards are dealt in and who starts betting) follow `PokerGame`
+    exactly, so a table seeded the same way as a `PokerGame` plays out identically given the same actions.
+
+    Every table has the same number of seats. Each table draws its deck from its own generator, set with `set_rngs()`.
+    """
+
+    def __init__(self, num_tables: int, num_players: int, initial_bankroll: int, small_blind: int, big_blind: int, parity_check: bool = False):
+        if num_players < 2 or num_players > 8:
+            raise RuntimeError(f"Cannot start a hand with {num_players} players - must be between 2 and 8.")
+        self.num_tables: int = num_tables
+        self.num_players: int = num_players
+        self.initial_bankroll: int = initial_bankroll
+        self.small_blind: int = small_blind
+        self.big_blind: int = big_blind
+        self.rngs: list[np.random.Generator] = [np.random.Generator(np.random.PCG64(None)) for _ in range(num_tables)]
+        self.tables: np.ndarray = np.arange(num_tables)
+
+        n, p = num_tables, num_players
+        self.done: np.ndarray = np.zeros(n, dtype=bool)
+        self.winner: np.ndarray = np.full(n, -1, dtype=np.int8)  # -1 = no winner
+        self.bankrolls: np.ndarray = np.zeros((n, p), dtype=np.int64)
+        self.player_pots: np.ndarray = np.zeros((n, p), dtype=np.int64)
+        self.active_players: np.ndarray = np.zeros((n, p), dtype=bool)
+        self.hole_cards: np.ndarray = np.full((n, p, 2), -1, dtype=np.int8)  # -1 = no card dealt
+        self.community_cards: np.ndarray = np.full((n, 5), -1, dtype=np.int8)
+        self.num_community_cards: np.ndarray = np.zeros(n, dtype=np.int8)
+        self.deck: np.ndarray = np.tile(FRESH_DECK, (n, 1))
+        self.deck_idx: np.ndarray = np.zeros(n, dtype=np.int8)
+
+        self.current_player_idx: np.ndarray = np.zeros(n, dtype=np.int8)
+        self.dealer_idx: np.ndarray = np.zeros(n, dtype=np.int8)
+        self.small_blind_idx: np.ndarray = np.zeros(n, dtype=np.int8)
+        self.big_blind_idx: np.ndarray = np.zeros(n, dtype=np.int8)
+
+        self.round: np.ndarray = np.full(n, Round.PREFLOP.value, dtype=np.int8)
+        self.community_pot: np.ndarray = np.zeros(n, dtype=np.int64)
+        self.round_pot: np.ndarray = np.zeros(n, dtype=np.int64)
+        self.checkers: np.ndarray = np.zeros(n, dtype=np.int8)
+        self.min_call: np.ndarray = np.zeros(n, dtype=np.int64)
+
+        # What each seat did in each betting round of the current hand (blinds count as contributions, not calls or raises)
+        self.stage_calls: np.ndarray = np.zeros((n, NUM_STAGES, p), dtype=bool)
+        self.stage_raises: np.ndarray = np.zeros((n, NUM_STAGES, p), dtype=bool)
+        self.stage_contributions: np.ndarray = np.zeros((n, NUM_STAGES, p), dtype=np.int64)
+
+        # In parity check mode, every table is mirrored by a scalar PokerGame and compared after each change
+        self.shadow_games: Optional[list[PokerGame]] = None
+        if parity_check:
+            self.shadow_games = []
+            for _ in range(num_tables):
+                game = PokerGame(initial_bankroll, small_blind, big_blind)
+                for seat in range(num_players):
+                    player = Player(f"Shadow {seat}", False)
+                    player.seat = seat
+                    game.players.append(player)
+                self.shadow_games.append(game)
+
+    def set_rngs(self, gens: list[np.random.Generator], tables: Optional[np.ndarray] = None) -> None:
+        """
+        Replace the random number generators of the given tables (default: all) with external ones.
+
+        In parity check mode, each shadow game gets a generator with an identical state so both draw the same decks.
+        """
+        tables = self.tables if tables is None else tables
+        for table, gen in zip(tables, gens):
+            self.rngs[table] = gen
+            if self.shadow_games is not None:
+                shadow_gen = np.random.Generator(type(gen.bit_generator)())
+                shadow_gen.bit_generator.state = gen.bit_generator.state
+                self.shadow_games[table].set_rng(shadow_gen)
+
+    def reset(self, mask: np.ndarray) -> None:
+        """Reset the masked tables to a new game (see `PokerGame.reset()`)."""
+        mask = mask.copy()  # The mask is often `self.done`, which is cleared below
+        self.bankrolls[mask] = self.initial_bankroll
+        self.player_pots[mask] = 0
+        self.hole_cards[mask] = -1
+        self.done[mask] = False
+        self.winner[mask] = -1
+        self.dealer_idx[mask] = 0
+        self.start_new_hand(mask)
+        if self.shadow_games is not None:
+            for table in np.flatnonzero(mask):
+                self.shadow_games[table].reset()
+            self.check_parity(mask)
+
+    def start_new_hand(self, mask: np.ndarray) -> None:
+        """Start a new hand on the masked tables, or end the game on tables where only one player has chips left."""
+        over = mask & ((self.bankrolls == 0).sum(axis=1) == self.num_players - 1)
+        if over.any():
+            self.done[over] = True
+            self.winner[over] = np.argmax(self.bankrolls[over] != 0, axis=1)
+            log.info(f"Game over on {over.sum()} table(s)")
+        mask = mask & ~over
+        if not mask.any():
+            return
+
+        self.round[mask] = Round.PREFLOP.value
+        self.community_cards[mask] = -1
+        self.num_community_cards[mask] = 0
+        self.community_pot[mask] = 0
+        self.round_pot[mask] = 0
+        self.current_player_idx[mask] = self.dealer_idx[mask]
+        self.active_players[mask] = self.bankrolls[mask] > 0
+        self.player_pots[mask] = 0
+        self.stage_calls[mask] = False
+        self.stage_raises[mask] = False
+        self.stage_contributions[mask] = 0
+
+        for table in np.flatnonzero(mask):
+            self.deck[table] = self.rngs[table].permutation(FRESH_DECK)
+        # Active players draw two cards each in seat order, so a player's cards sit at twice their position among active players
+        order = np.cumsum(self.active_players[mask], axis=1) - 1
+        decks = self.deck[mask]
+        rows = np.arange(decks.shape[0])[:, None]
+        dealt = np.stack((decks[rows, 2 * order], decks[rows, 2 * order + 1]), axis=2).astype(np.int8)
+        self.hole_cards[mask] = np.where(self.active_players[mask][:, :, None], dealt, -1)
+        self.deck_idx[mask] = 2 * self.active_players[mask].sum(axis=1)
+
+        self.start_round(mask)
+
+    def end_hand(self, mask: np.ndarray) -> None:
+        """End the current hand on the masked tables: pay out the pot and move the dealer to the next player with chips."""
+        self.close_pots(mask)
+        self.showdown(mask)
+        with_chips = self._seats_after(self.dealer_idx, self.bankrolls > 0)
+        self.dealer_idx[mask] = with_chips[mask]
+
+    def start_round(self, mask: np.ndarray) -> None:
+        """Start the current betting round on the masked tables, posting blinds (pre-flop) or dealing table cards (other rounds)."""
+        self.checkers[mask] = 0
+        self.min_call[mask] = 0
+
+        preflop = mask & (self.round == Round.PREFLOP.value)
+        if preflop.any():
+            if self.num_players != 2:
+                self.next_player(preflop)
+            self.process_decision(np.full(self.num_tables, PlayerAction.SMALL_BLIND.value), preflop)
+            self.small_blind_idx[preflop] = self.current_player_idx[preflop]
+            self.next_player(preflop)
+            self.process_decision(np.full(self.num_tables, PlayerAction.BIG_BLIND.value), preflop)
+            self.big_blind_idx[preflop] = self.current_player_idx[preflop]
+            self.current_player_idx[preflop] = self.dealer_idx[preflop]
+
+        betting = mask & (self.round >= Round.FLOP.value) & (self.round <= Round.RIVER.value)
+        if betting.any():
+            num_cards = np.where(self.round == Round.FLOP.value, 3, 1)
+            for offset in range(3):
+                deal = betting & (offset < num_cards)
+                tables = self.tables[deal]
+                self.community_cards[tables, self.num_community_cards[deal] + offset] = self.deck[tables, self.deck_idx[deal] + offset]
+            self.num_community_cards[betting] += num_cards[betting]
+            self.deck_idx[betting] += num_cards[betting]
+            self.current_player_idx[betting] = self.dealer_idx[betting]
+            self.next_player(betting)
+
+    def end_round(self, mask: np.ndarray) -> None:
+        self.close_pots(mask)
+        self.round[mask] += 1
+
+    def close_pots(self, mask: np.ndarray) -> None:
+        """Move the round pot into the community pot and reset the round and player pots on the masked tables."""
+        self.community_pot[mask] += self.round_pot[mask]
+        self.round_pot[mask] = 0
+        self.player_pots[mask] = 0
+
+    def next_player(self, mask: np.ndarray) -> None:
+        """Advance the masked tables to their next active player, or to the next round when betting is settled (see `PokerGame.next_player()`)."""
+        alive = self.active_players.sum(axis=1)
+        one_left = mask & (alive < 2)
+        self.round[one_left] = Round.SHOWDOWN.value
+        mask = mask & ~one_left
+
+        all_checked = mask & (self.checkers == alive)
+        max_pots = self.player_pots.max(axis=1, keepdims=True)
+        all_called = mask & ~all_checked & np.all(~self.active_players | ((self.player_pots == max_pots) & (self.player_pots != 0)), axis=1)
+        settled = all_checked | all_called
+        if settled.any():
+            self.end_round(settled)
+            self.start_round(settled)
+
+        advance = mask & ~settled
+        self.current_player_idx[advance] = self._seats_after(self.current_player_idx, self.active_players)[advance]
+
+    def _seats_after(self, seats: np.ndarray, eligible: np.ndarray) -> np.ndarray:
+        """For each table, find the first eligible seat clockwise after `seats` (wrapping around to the seat itself)."""
+        candidates = (seats[:, None].astype(np.int64) + np.arange(1, self.num_players + 1)) % self.num_players
+        first = np.argmax(eligible[self.tables[:, None], candidates], axis=1)
+        return candidates[self.tables, first]
+
+    def determine_legal_moves(self) -> np.ndarray:
+        """Get a (num_tables, 3) mask of legal FOLD / CHECK_CALL / RAISE decisions for each table's current player."""
+        current_pot = self.player_pots[self.tables, self.current_player_idx]
+        bankroll = self.bankrolls[self.tables, self.current_player_idx]
+        legal = np.empty((self.num_tables, NUM_DECISIONS), dtype=bool)
+        legal[:, PlayerAction.FOLD.value] = True
+        legal[:, PlayerAction.CHECK_CALL.value] = (current_pot == self.player_pots.max(axis=1)) | (bankroll >= self.min_call - current_pot)
+        legal[:, PlayerAction.RAISE.value] = bankroll > 0
+        return legal
+
+    def process_decision(self, actions: np.ndarray, mask: np.ndarray) -> None:
+        """Apply each masked table's action (a `PlayerAction` value) for its current player (see `PokerGame.process_decision()`)."""
+        seats = self.current_player_idx
+        current_pot = self.player_pots[self.tables, seats]
+        bankroll = self.bankrolls[self.tables, seats]
+
+        fold = mask & (actions == PlayerAction.FOLD.value)
+        self.active_players[self.tables[fold], seats[fold]] = False
+        check_call = mask & (actions == PlayerAction.CHECK_CALL.value)
+        check = check_call & (current_pot == self.player_pots.max(axis=1))
+        self.checkers[check] += 1
+        call = check_call & ~check & (bankroll >= self.min_call - current_pot)
+        raised = mask & (actions == PlayerAction.RAISE.value)
+
+        contribution = np.select(
+            [
+                mask & (actions == PlayerAction.SMALL_BLIND.value),
+                mask & (actions == PlayerAction.BIG_BLIND.value),
+                call,
+                raised,
+            ],
+            [
+                np.minimum(self.small_blind, bankroll),
+                np.minimum(self.big_blind, bankroll),
+                np.minimum(self.min_call - current_pot, bankroll),
+                np.minimum(3 * self.big_blind + self.min_call, bankroll),
+            ],
+            default=0,
+        )
+        self.stage_calls[self.tables[call], self.round[call], seats[call]] = True
+        self.stage_raises[self.tables[raised], self.round[raised], seats[raised]] = True
+        self.stage_contributions[self.tables[mask], self.round[mask], seats[mask]] += contribution[mask]
+        self.bankrolls[self.tables, seats] -= contribution
+        self.player_pots[self.tables, seats] += contribution
+        self.round_pot += contribution
+        new_pot = self.player_pots[self.tables, seats]
+        raised_to = mask & (new_pot == self.player_pots.max(axis=1))
+        self.min_call[raised_to] = new_pot[raised_to]
+
+    def do_step(self, actions: np.ndarray, mask: np.ndarray) -> None:
+        """Apply one decision on every masked table, advancing to the next player, round or hand as needed."""
+        if self.shadow_games is not None:
+            for table in np.flatnonzero(mask):
+                self.shadow_games[table].determine_legal_moves()
+                self.shadow_games[table].do_step(PlayerAction(int(actions[table])))
+        self.process_decision(actions, mask)
+        self.next_player(mask)
+        showdown = mask & (self.round == Round.SHOWDOWN.value)
+        if showdown.any():
+            self.end_hand(showdown)
+            self.start_new_hand(showdown)
+        if self.shadow_games is not None:
+            self.check_parity(mask)
+
+    def showdown(self, mask: np.ndarray) -> None:
+        """Split each masked table's community pot between the players with the best hand."""
+        winners = np.zeros((self.num_tables, self.num_players), dtype=bool)
+        # Before the flop the hand can only be over because everyone else folded
+        early = mask & (self.num_community_cards < 3)
+        if np.any(self.active_players[early].sum(axis=1) != 1):
+            raise RuntimeError("Cannot determine a winner from preflop with more than 1 active player!")
+        winners[early] = self.active_players[early]
+
+        for num_cards in range(3, 6):
+            tables = self.tables[mask & (self.num_community_cards == num_cards)]
+            if tables.shape[0] == 0:
+                continue
+            board = self.community_cards[tables, :num_cards]
+            hands = np.concatenate((self.hole_cards[tables], np.broadcast_to(board[:, None, :], (tables.shape[0], self.num_players, num_cards))), axis=2)
+            scores = evaluate_batch(np.maximum(hands, 0).reshape(-1, num_cards + 2)).reshape(tables.shape[0], self.num_players)
+            scores = np.where(self.active_players[tables], scores, -1)
+            winners[tables] = scores == scores.max(axis=1, keepdims=True)
+
+        shares = self.community_pot // np.maximum(winners.sum(axis=1), 1)
+        self.bankrolls[mask] += (winners * shares[:, None])[mask]
+
+    def hand_rank_index(self) -> np.ndarray:
+        """Get `rank_hand()`'s hand rank index (1 = high card ... 10 = royal flush) for each table's current player, or 0 before the flop."""
+        ranks = np.zeros(self.num_tables, dtype=np.int64)
+        for num_cards in range(3, 6):
+            tables = self.tables[self.num_community_cards == num_cards]
+            if tables.shape[0] == 0:
+                continue
+            hands = np.concatenate((self.hole_cards[tables, self.current_player_idx[tables]], self.community_cards[tables, :num_cards]), axis=1)
+            scores = evaluate_batch(np.maximum(hands, 0))
+            categories = scores >> CATEGORY_SHIFT
+            royal = (categories == STRAIGHT_FLUSH) & ((scores & 0xF) == 12)
+            ranks[tables] = np.where(royal, 10, categories + 1)
+        return ranks
+
+    def check_parity(self, mask: np.ndarray) -> None:
+        """Compare the masked tables against their shadow `PokerGame`s, raising an `AssertionError` on the first difference."""
+        if self.shadow_games is None:
+            return
+        for table in np.flatnonzero(mask):
+            game = self.shadow_games[table]
+            expected = {
+                "done": game.done,
+                "winner": -1 if game.winner is None else game.winner,
+                "bankrolls": [player.bankroll for player in game.players],
+                "player_pots": game.player_pots,
+                "active_players": game.active_players,
+                "hole_cards": [player.cards for player in game.players],
+                "community_cards": game.community_cards,
+                "current_player_idx": game.current_player_idx,
+                "dealer_idx": game.dealer_idx,
+                "round": game.round.value,
+                "community_pot": game.community_pot,
+                "round_pot": game.round_pot,
+                "checkers": game.checkers,
+                "min_call": game.min_call,
+            }
+            if game.done:
+                # A finished PokerGame keeps the last hand's betting state around, so only the result is compared
+                expected = {key: expected[key] for key in ("done", "winner", "bankrolls")}
+            actual = {
+                "done": bool(self.done[table]),
+                "winner": int(self.winner[table]),
+                "bankrolls": self.bankrolls[table].tolist(),
+                "player_pots": self.player_pots[table].tolist(),
+                "active_players": self.active_players[table].tolist(),
+                "hole_cards": [[int(card) for card in cards if card >= 0] for cards in self.hole_cards[table]],
+                "community_cards": self.community_cards[table, :self.num_community_cards[table]].tolist(),
+                "current_player_idx": int(self.current_player_idx[table]),
+                "dealer_idx": int(self.dealer_idx[table]),
+                "round": int(self.round[table]),
+                "community_pot": int(self.community_pot[table]),
+                "round_pot": int(self.round_pot[table]),
+                "checkers": int(self.checkers[table]),
+                "min_call": int(self.min_call[table]),
+            }
+            for key, value in expected.items():
+                if value != actual[key]:
+                    raise AssertionError(f"Table {table} diverged from PokerGame on {key}: expected {value}, got {actual[key]}")
+
+
+def run_parity_check(num_tables: int, num_players: int, num_steps: int, seed: int = 0) -> None:
+    """Play `num_steps` random legal decisions on every table of a parity-checked `BatchedPokerGame`, raising on the first mismatch."""
+    game = BatchedPokerGame(num_tables, num_players, 100, 2, 5, parity_check=True)
+    game.set_rngs([np.random.default_rng(seed + table) for table in range(num_tables)])
+    action_rng = np.random.default_rng(seed + num_tables)
+    game.reset(np.ones(num_tables, dtype=bool))
+    for _ in range(num_steps):
+        # Reset finished tables first, so every table acts on its own current legal moves
+        if game.done.any():
+            game.reset(game.done)
+        legal = game.determine_legal_moves()
+        actions = np.argmax(action_rng.random(legal.shape) * legal, axis=1)
+        game.do_step(actions, ~game.done)
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.ERROR)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.ERROR)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Check BatchedPokerGame against PokerGame on identical seeds and actions.")
+    parser.add_argument("--tables", type=int, default=32)
+    parser.add_argument("--players", type=int, nargs="+", default=[2, 3, 4, 6, 8])
+    parser.add_argument("--steps", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for num_players in args.players:
+        start = time.perf_counter()
+        run_parity_check(args.tables, num_players, args.steps, args.seed)
+        log.error(f"{num_players} players: {args.tables} tables x {args.steps} steps match PokerGame ({time.perf_counter() - start:.1f}s)")
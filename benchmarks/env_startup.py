@@ -0,0 +1,43 @@
+import argparse
+import logging
+import sys
+import time
+
+from agents.player import Player
+from agents.random_player import RandomPlayer
+from gym_env.env import TexasHoldemEnv
+from util import ColoredFormatter
+
+log = logging.getLogger(__name__)
+
+
+def time_construction(num_envs: int, num_players: int, render_mode=None) -> float:
+    """Construct and reset `num_envs` envs, returning the mean time per env in seconds."""
+    start = time.perf_counter()
+    for _ in range(num_envs):
+        env = TexasHoldemEnv(100, 2, 5, [Player("Learner", False)] + [RandomPlayer() for _ in range(num_players - 1)], render_mode=render_mode)
+        env.reset(seed=0)
+        if render_mode is not None:
+            env.render()
+    return (time.perf_counter() - start) / num_envs
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.ERROR)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.ERROR)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Measure TexasHoldemEnv construction time.")
+    parser.add_argument("--envs", type=int, default=200)
+    parser.add_argument("--players", type=int, nargs="+", default=[2, 4, 8])
+    args = parser.parse_args()
+
+    for num_players in args.players:
+        print(f"headless, {num_players} players: {time_construction(args.envs, num_players) * 1e6:.0f} us/env")
+    print(f"pygame imported by headless envs: {'pygame' in sys.modules}")
+    # The first rendering env pays for pygame and the sprites, later ones reuse the shared cache
+    print(f"first rgb_array env: {time_construction(1, 4, 'rgb_array') * 1e3:.1f} ms")
+    print(f"later rgb_array envs: {time_construction(20, 4, 'rgb_array') * 1e3:.1f} ms/env")
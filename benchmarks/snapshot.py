@@ -0,0 +1,129 @@
+import argparse
+import copy
+import logging
+import time
+
+import numpy as np
+
+from agents.player import Player
+from agents.random_player import RandomPlayer
+from poker import PokerGame
+from util import ColoredFormatter
+
+log = logging.getLogger(__name__)
+
+
+def make_game(num_players: int, seed: int, random_players: bool = False) -> PokerGame:
+    """Build a headless game (of `RandomPlayer`s with seeded streams, if `random_players`) and start its first hand."""
+    game = PokerGame(100, 2, 5)
+    game.set_rng(np.random.default_rng(seed))
+    for seat in range(num_players):
+        player = RandomPlayer() if random_players else Player(f"Player {seat}", True)
+        player.seat = seat
+        if random_players:
+            player.set_rng(np.random.default_rng([seed, seat]))
+        game.players.append(player)
+    game.reset()
+    return game
+
+
+def random_step(game: PokerGame, rng: np.random.Generator) -> None:
+    """Play one uniformly random legal move, starting a new game if the last one finished."""
+    if game.done:
+        game.reset()
+    game.determine_legal_moves()
+    game.do_step(game.legal_moves[rng.integers(len(game.legal_moves))])
+
+
+def player_step(game: PokerGame) -> None:
+    """Play the move the current player chooses from its own stream, starting a new game if the last one finished."""
+    if game.done:
+        game.reset()
+    game.determine_legal_moves()
+    game.do_step(game.current_player.action(game.legal_moves, None, None))  # type: ignore
+
+
+def time_per_node(fn, repeats: int) -> float:
+    """Mean seconds per call of `fn`."""
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def check_determinism(num_players: int, steps: int, seed: int) -> bool:
+    """Restore a snapshot and replay the same moves, checking that the continuation (including newly shuffled hands) matches."""
+    game = make_game(num_players, seed)
+    rng = np.random.default_rng(seed)
+    for _ in range(10):
+        random_step(game, rng)
+    start = game.snapshot()
+    move_state = rng.bit_generator.state
+    first = []
+    for _ in range(steps):
+        random_step(game, rng)
+        first.append(game.snapshot())
+    game.restore(start)
+    rng.bit_generator.state = move_state
+    for expected in first:
+        random_step(game, rng)
+        if repr(game.snapshot()) != repr(expected):
+            return False
+    return True
+
+
+def check_player_streams(num_players: int, steps: int, seed: int) -> bool:
+    """Like `check_determinism()`, but with the players choosing their own moves, so the snapshot must carry their streams too."""
+    game = make_game(num_players, seed, random_players=True)
+    for _ in range(10):
+        player_step(game)
+    start = game.snapshot()
+    first = []
+    for _ in range(steps):
+        player_step(game)
+        first.append(game.snapshot())
+    game.restore(start)
+    for expected in first:
+        player_step(game)
+        if repr(game.snapshot()) != repr(expected):
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.ERROR)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.ERROR)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Measure PokerGame snapshot/restore and undo cost per search node.")
+    parser.add_argument("--players", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--repeats", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for num_players in args.players:
+        game = make_game(num_players, args.seed)
+        rng = np.random.default_rng(args.seed)
+        for _ in range(5):
+            random_step(game, rng)
+        state = game.snapshot()
+        snapshot_us = time_per_node(game.snapshot, args.repeats) * 1e6
+        restore_us = time_per_node(lambda: game.restore(state), args.repeats) * 1e6
+        deepcopy_us = time_per_node(lambda: copy.deepcopy(game), args.repeats // 20) * 1e6
+
+        # A step and its undo, against the step alone
+        game.set_undo_depth(1)
+
+        def step_and_undo():
+            random_step(game, rng)
+            game.undo()
+        undo_us = time_per_node(step_and_undo, args.repeats) * 1e6
+        game.set_undo_depth(0)
+        step_us = time_per_node(lambda: random_step(game, rng), args.repeats) * 1e6
+
+        print(f"{num_players} players: snapshot {snapshot_us:.1f} us | restore {restore_us:.1f} us | deepcopy {deepcopy_us:.1f} us | "
+              f"step {step_us:.1f} us | step + undo {undo_us:.1f} us | deterministic: {check_determinism(num_players, 500, args.seed)} | "
+              f"player streams restored: {check_player_streams(num_players, 500, args.seed)}")
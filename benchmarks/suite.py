@@ -0,0 +1,207 @@
+import argparse
+import json
+import logging
+import os
+import time
+from typing import Callable, NamedTuple
+
+import numpy as np
+
+from agents.player import Player
+from agents.random_player import RandomPlayer
+from benchmarks.env_startup import time_construction
+from benchmarks.snapshot import make_game
+from gym_env.env import TexasHoldemEnv
+from poker import PokerGame
+from rng_streams import EpisodeSeeds
+from util import ColoredFormatter, DECK_SIZE, PlayerAction, hand_rank_cache, rank_hand, rank_hand_uncached
+
+log = logging.getLogger(__name__)
+
+# Baselines are only meaningful on the machine they were measured on - re-save them (--save) before comparing on a new machine
+BASELINE_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+PLAYER_COUNTS: tuple[int, ...] = (2, 4, 8)
+
+
+class Metric(NamedTuple):
+    name: str
+    unit: str
+    higher_is_better: bool
+    measure: Callable[[int, float], float]  # (num players, time budget in seconds) -> value
+    per_player_count: bool = True
+
+
+def run_for(budget: float, step: Callable[[], int]) -> float:
+    """Call `step` (which returns how many units of work it did) until `budget` seconds have passed, returning units per second."""
+    done: int = 0
+    start = time.perf_counter()
+    while True:
+        done += step()
+        elapsed = time.perf_counter() - start
+        if elapsed >= budget:
+            return done / elapsed
+
+
+def game_hands_per_second(num_players: int, budget: float) -> float:
+    """Raw `PokerGame` self-play with uniformly random legal moves, without an env."""
+    game: PokerGame = make_game(num_players, 0)
+    rng = np.random.default_rng(0)
+    moves = rng.integers(0, 1 << 30, size=4096).tolist()
+
+    def play() -> int:
+        hands: int = 0
+        deck = game.deck
+        for move in moves:
+            if game.done:
+                game.reset()
+            game.determine_legal_moves()
+            game.do_step(game.legal_moves[move % len(game.legal_moves)])
+            # Every new hand shuffles a new deck
+            if game.deck is not deck:
+                deck = game.deck
+                hands += 1
+        return hands
+    return run_for(budget, play)
+
+
+def env_steps_per_second(num_players: int, budget: float, autoplay: bool) -> float:
+    """`TexasHoldemEnv.step` calls against `RandomPlayer` opponents, or with every seat driven through `step` (no autoplay)."""
+    opponents: list[Player] = [RandomPlayer() if autoplay else Player(f"Player {seat}", False) for seat in range(1, num_players)]
+    env = TexasHoldemEnv(100, 2, 5, [Player("Learner", False)] + opponents)
+    rng = np.random.default_rng(0)
+    seed: list[int] = [0]
+    state, info = EpisodeSeeds(0, 0, 0).reset(env)
+    legal: list[list[PlayerAction]] = [info['legal_moves']]
+
+    def steps() -> int:
+        for _ in range(256):
+            state, reward, done, truncated, info = env.step(legal[0][rng.integers(len(legal[0]))])
+            if done:
+                seed[0] += 1
+                state, info = env.reset(seed=seed[0])
+            legal[0] = info['legal_moves']
+        return 256
+    return run_for(budget, steps)
+
+
+def random_hands(count: int, seed: int = 0) -> list[list[int]]:
+    rng = np.random.default_rng(seed)
+    return [rng.permutation(DECK_SIZE)[:7].tolist() for _ in range(count)]
+
+
+def rank_hand_per_second(num_players: int, budget: float) -> float:
+    """Uncached `rank_hand` evaluations of random 7-card hands."""
+    hands = random_hands(4096)
+
+    def rank() -> int:
+        for hand in hands:
+            rank_hand_uncached(hand)
+        return len(hands)
+    return run_for(budget, rank)
+
+
+def cached_rank_hand_per_second(num_players: int, budget: float) -> float:
+    """`rank_hand` through the shared LRU cache, on a working set that fits in it (every call after the first pass hits)."""
+    hands = random_hands(4096)
+    hand_rank_cache.clear()
+
+    def rank() -> int:
+        for hand in hands:
+            rank_hand(hand)
+        return len(hands)
+    return run_for(budget, rank)
+
+
+def env_construction_us(num_players: int, budget: float) -> float:
+    """Microseconds to construct and reset a headless env."""
+    count: int = max(int(budget / 300e-6), 10)
+    return time_construction(count, num_players) * 1e6
+
+
+METRICS: list[Metric] = [
+    Metric("game_hands_per_s", "hands/s", True, game_hands_per_second),
+    Metric("env_steps_per_s", "steps/s", True, lambda players, budget: env_steps_per_second(players, budget, autoplay=False)),
+    Metric("env_autoplay_steps_per_s", "steps/s", True, lambda players, budget: env_steps_per_second(players, budget, autoplay=True)),
+    Metric("env_construct_us", "us", False, env_construction_us),
+    # Ranking doesn't depend on the table size, so it is only measured once
+    Metric("rank_hand_per_s", "evals/s", True, rank_hand_per_second, per_player_count=False),
+    Metric("rank_hand_cached_per_s", "evals/s", True, cached_rank_hand_per_second, per_player_count=False),
+]
+
+
+def metric_key(metric: Metric, num_players: int) -> str:
+    return f"{metric.name}[{num_players}]" if metric.per_player_count else metric.name
+
+
+def run_suite(player_counts: tuple[int, ...] = PLAYER_COUNTS, budget: float = 0.3, repeats: int = 5, only: tuple[str, ...] = ()) -> dict[str, float]:
+    """Measure every metric (or those named in `only`), keeping the best of `repeats` runs to filter out noise."""
+    results: dict[str, float] = {}
+    for metric in METRICS:
+        if only and metric.name not in only:
+            continue
+        for num_players in (player_counts if metric.per_player_count else player_counts[:1]):
+            runs = [metric.measure(num_players, budget) for _ in range(repeats)]
+            results[metric_key(metric, num_players)] = max(runs) if metric.higher_is_better else min(runs)
+    return results
+
+
+def find_regressions(results: dict[str, float], baselines: dict[str, float], threshold: float) -> list[str]:
+    """List the metrics that are more than `threshold` (a fraction) worse than their baseline."""
+    directions = {metric_key(metric, players): metric.higher_is_better for metric in METRICS for players in range(2, 9)}
+    regressions: list[str] = []
+    for key, value in results.items():
+        if key not in baselines:
+            continue
+        baseline = baselines[key]
+        if directions[key]:
+            worse = value < baseline * (1.0 - threshold)
+        else:
+            worse = value > baseline * (1.0 + threshold)
+        if worse:
+            regressions.append(f"{key}: {value:,.1f} vs baseline {baseline:,.1f}")
+    return regressions
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.ERROR)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.ERROR)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Measure engine, evaluator and env throughput, and compare it against stored baselines.")
+    parser.add_argument("--players", type=int, nargs="+", default=list(PLAYER_COUNTS))
+    parser.add_argument("--budget", type=float, default=0.3, help="seconds per measurement")
+    parser.add_argument("--repeats", type=int, default=5, help="measurements per metric (the best is kept)")
+    parser.add_argument("--only", nargs="+", default=[], help="metric names to run (default: all)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=0.3, help="fail if a metric is this fraction worse than its baseline")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines instead of comparing")
+    parser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = run_suite(tuple(args.players), args.budget, args.repeats, tuple(args.only))
+    units = {metric_key(metric, players): metric.unit for metric in METRICS for players in range(2, 9)}
+    baselines: dict[str, float] = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baselines = json.load(f)
+    for key, value in results.items():
+        change = f" ({(value / baselines[key] - 1.0) * 100:+.1f}% vs baseline)" if baselines.get(key) else ""
+        print(f"{key:32} {value:14,.1f} {units[key]}{change}")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"Saved baselines to {args.baseline}")
+    else:
+        regressions = find_regressions(results, baselines, args.threshold)
+        if regressions:
+            for regression in regressions:
+                log.error(f"Regression past {args.threshold:.0%}: {regression}")
+            raise SystemExit(1)
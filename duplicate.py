@@ -0,0 +1,131 @@
+import argparse
+import logging
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Optional
+
+import multiprocessing as mp
+import numpy as np
+
+from events import GameEvent, HandStartEvent, ShowdownEvent
+from gym_env.env import TexasHoldemEnv
+from league import AgentFactory, parse_agent
+from poker import PokerGame
+from rng_streams import EpisodeSeeds
+from util import ColoredFormatter
+
+log = logging.getLogger(__name__)
+
+
+class DuplicateTracker:
+    """Event subscriber collecting each seat's chip result for every hand of a duplicate-mode game."""
+
+    def __init__(self, game: PokerGame):
+        self.game: PokerGame = game
+        self.bankrolls: Optional[tuple[int, ...]] = None
+        self.results: list[tuple[int, ...]] = []
+
+    def __call__(self, event: GameEvent) -> None:
+        if isinstance(event, HandStartEvent):
+            self.bankrolls = event.bankrolls
+        elif isinstance(event, ShowdownEvent) and self.bankrolls is not None:
+            # Bankrolls are reset at the start of every duplicate hand, so the result has to be taken before the next one starts
+            self.results.append(tuple(player.bankroll - start for player, start in zip(self.game.players, self.bankrolls)))
+            self.bankrolls = None
+
+
+def play_duplicate(factories: list[AgentFactory], game_index: int, seed: int, num_hands: int, initial_bankroll: int = 100, small_blind: int = 2, big_blind: int = 5) -> np.ndarray:
+    """
+    Play `num_hands` duplicate hands of game `game_index` once per rotation of the seats (runs in a worker process).
+
+    In rotation r, agent i sits in seat (i + r) % seats, so over all rotations every agent is dealt every seat's cards. Every
+    rotation is keyed (seed, 0, game_index) (see `rng_streams.EpisodeSeeds`), so they share the deck. Returns the chip results as a
+    (rotations, hands, agents) array, indexed by agent rather than seat.
+    """
+    logging.getLogger().setLevel(logging.ERROR)
+    num_seats = len(factories)
+    results = np.zeros((num_seats, num_hands, num_seats), dtype=np.int64)
+    for rotation in range(num_seats):
+        env = TexasHoldemEnv(initial_bankroll, small_blind, big_blind, [factories[(seat - rotation) % num_seats]() for seat in range(num_seats)], duplicate=True)
+        if not all(player.autoplay for player in env.game.players):
+            raise ValueError("Duplicate agents must play on their own (autoplay) - a QPlayer needs a policy path")
+        game = env.game
+        tracker = DuplicateTracker(game)
+        game.events.subscribe(tracker)
+        EpisodeSeeds(seed, 0, game_index).reset(env)
+        while len(tracker.results) < num_hands:
+            env.play_turn()
+        seat_results = np.array(tracker.results[:num_hands], dtype=np.int64)
+        results[rotation] = seat_results[:, (np.arange(num_seats) + rotation) % num_seats]
+        env.close()
+    return results
+
+
+class DuplicateStats:
+    """Scores of agents from duplicate games, combining the mirrored hands of every rotation into one result per deal."""
+
+    def __init__(self, names: tuple[str, ...], results: np.ndarray, big_blind: int):
+        self.names: tuple[str, ...] = names
+        self.big_blind: int = big_blind
+        # (rotations, deals, agents)
+        self.results: np.ndarray = results
+
+    @property
+    def deals(self) -> int:
+        return self.results.shape[1]
+
+    def bb_per_100(self, agent: int, z: float = 1.96) -> tuple[float, float]:
+        """Big blinds won per 100 hands by an agent, averaged over the mirrored hands of each deal, with the half-width of its confidence interval."""
+        combined = self.results[:, :, agent].mean(axis=0)
+        return _mean_interval(combined, self.big_blind, z)
+
+    def plain_bb_per_100(self, agent: int, z: float = 1.96) -> tuple[float, float]:
+        """The same score with every hand treated as independent (what a non-duplicate match of as many hands would give)."""
+        return _mean_interval(self.results[:, :, agent].reshape(-1), self.big_blind, z)
+
+
+def _mean_interval(samples: np.ndarray, big_blind: int, z: float) -> tuple[float, float]:
+    n = len(samples)
+    if n < 2:
+        return (0.0, math.inf)
+    return (100.0 * samples.mean() / big_blind, 100.0 * z * samples.std(ddof=1) / math.sqrt(n) / big_blind)
+
+
+def run_duplicate(agents: dict[str, AgentFactory], seed: int, num_games: int, num_hands: int, workers: Optional[int] = None,
+                  initial_bankroll: int = 100, small_blind: int = 2, big_blind: int = 5) -> DuplicateStats:
+    """Play `num_games` duplicate games across a process pool, with the agents seated in order in the first rotation."""
+    factories = list(agents.values())
+    play = partial(play_duplicate, factories, seed=seed, num_hands=num_hands, initial_bankroll=initial_bankroll, small_blind=small_blind, big_blind=big_blind)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+        results = list(pool.map(play, range(num_games)))
+    return DuplicateStats(tuple(agents), np.concatenate(results, axis=1), big_blind)
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Score agents with duplicate poker: the same deals are replayed with the seats rotated, so luck of the cards cancels out.")
+    parser.add_argument("--agent", dest="agents", action="append", required=True, help='agent as "name=module:Class[:argument]" (repeatable, 2-8 agents)')
+    parser.add_argument("--hands", type=int, default=200, help="duplicate hands per game")
+    parser.add_argument("--games", type=int, default=8, help="number of duplicate games (one task each)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    agents = dict(parse_agent(spec) for spec in args.agents)
+    if not 2 <= len(agents) <= 8:
+        parser.error("Duplicate games need 2-8 agents")
+    start = time.perf_counter()
+    stats = run_duplicate(agents, args.seed, args.games, args.hands, args.workers)
+    log.info(f"Played {stats.deals} deals x {len(agents)} rotations in {time.perf_counter() - start:.1f}s")
+    for agent, name in enumerate(stats.names):
+        bb, half = stats.bb_per_100(agent)
+        plain_bb, plain_half = stats.plain_bb_per_100(agent)
+        print(f"{name:>12}: {bb:+8.1f} +/- {half:.1f} bb/100 duplicate ({plain_bb:+.1f} +/- {plain_half:.1f} without combining mirrored hands)")
@@ -0,0 +1,224 @@
+import logging
+import time
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from util import DECK_SIZE
+
+log = logging.getLogger(__name__)
+
+# Hand categories used by evaluate_batch(), weakest to strongest
+HIGH_CARD, ONE_PAIR, TWO_PAIR, THREE_OF_A_KIND, STRAIGHT, FLUSH, FULL_HOUSE, FOUR_OF_A_KIND, STRAIGHT_FLUSH = range(9)
+CATEGORY_SHIFT: int = 20  # Tie-break ranks are packed as 4-bit nibbles below the category
+
+_NUM_MASKS: int = 1 << 13
+_RANK_WEIGHTS: np.ndarray = (1 << np.arange(13)).astype(np.int32)
+
+
+def _build_tables() -> tuple[np.ndarray, np.ndarray, np.ndarray, list[np.ndarray]]:
+    """
+    Build lookup tables indexed by 13-bit rank masks (bit i set = rank i present).
+
+    Returns the number of ranks in each mask, the highest set rank of each mask (-1 if empty), the high rank of the best straight
+    in each mask (-1 if none), and a list where entry k holds the top k ranks of each mask packed into nibbles.
+    """
+    masks = np.arange(_NUM_MASKS, dtype=np.int32)
+    count = np.zeros(_NUM_MASKS, dtype=np.int32)
+    high = np.full(_NUM_MASKS, -1, dtype=np.int32)
+    for rank in range(13):
+        present = (masks >> rank) & 1 == 1
+        count += present
+        high[present] = rank
+
+    straight = np.full(_NUM_MASKS, -1, dtype=np.int32)
+    # Check from the highest straight down so the best one is kept; rank 3 (5-high) is the ace-low wheel
+    for top in range(12, 2, -1):
+        pattern = 0b11111 << (top - 4) if top >= 4 else (1 << 12) | 0b1111
+        found = (straight == -1) & ((masks & pattern) == pattern)
+        straight[found] = top
+
+    top_k: list[np.ndarray] = [np.zeros(_NUM_MASKS, dtype=np.int32)]
+    remaining = masks.copy()
+    packed = np.zeros(_NUM_MASKS, dtype=np.int32)
+    for _ in range(5):
+        h = high[remaining]
+        packed = (packed << 4) | np.maximum(h, 0)
+        remaining = np.where(h >= 0, remaining & ~(1 << np.maximum(h, 0)), remaining)
+        top_k.append(packed.copy())
+    return count, high, straight, top_k
+
+
+RANK_COUNT, HIGH_RANK, STRAIGHT_HIGH, TOP_RANKS = _build_tables()
+
+
+def evaluate_batch(cards: np.ndarray) -> np.ndarray:
+    """
+    Score a batch of 5-7 card hands at once. `cards` has shape (n, k) and holds card ints (see `util.card_to_int`).
+
+    Returns an int array of shape (n,) where a higher score is a stronger hand and equal scores tie.
+    The scale differs from `rank_hand` (where lower is stronger), so scores should only be compared with each other.
+    """
+    cards = np.asarray(cards)
+    n: int = cards.shape[0]
+    # One row of 52 flags per hand, viewed as (rank, suit) so rank and suit masks are plain reductions
+    present = np.zeros((n, DECK_SIZE), dtype=np.int32)
+    present[np.arange(n)[:, None], cards] = 1
+    by_rank = present.reshape(n, 13, 4)
+
+    counts = by_rank[:, :, 0] + by_rank[:, :, 1] + by_rank[:, :, 2] + by_rank[:, :, 3]
+    any_mask = (counts > 0).astype(np.int32) @ _RANK_WEIGHTS
+    pairs_mask = (counts == 2).astype(np.int32) @ _RANK_WEIGHTS
+    trips_mask = (counts == 3).astype(np.int32) @ _RANK_WEIGHTS
+    quads_mask = (counts == 4).astype(np.int32) @ _RANK_WEIGHTS
+
+    # At most one suit can hold 5+ of 7 cards, so the flush masks can be summed
+    suit_masks = by_rank.transpose(0, 2, 1) @ _RANK_WEIGHTS
+    flush_masks = np.where(RANK_COUNT[suit_masks] >= 5, suit_masks, 0)
+    flush_mask = flush_masks[:, 0] + flush_masks[:, 1] + flush_masks[:, 2] + flush_masks[:, 3]
+    has_flush = flush_mask != 0
+
+    straight_flush_high = STRAIGHT_HIGH[flush_mask]
+    straight_high = STRAIGHT_HIGH[any_mask]
+
+    quad_rank = np.maximum(HIGH_RANK[quads_mask], 0)
+    trip_rank = np.maximum(HIGH_RANK[trips_mask], 0)
+    # Full house pair may come from a second set of trips
+    full_house_pairs = (trips_mask & ~(1 << trip_rank)) | pairs_mask
+    pair_rank = np.maximum(HIGH_RANK[pairs_mask], 0)
+    second_pair_rank = np.maximum(HIGH_RANK[pairs_mask & ~(1 << pair_rank)], 0)
+
+    conditions = [
+        straight_flush_high >= 0,
+        quads_mask != 0,
+        (trips_mask != 0) & (full_house_pairs != 0),
+        has_flush,
+        straight_high >= 0,
+        trips_mask != 0,
+        (pairs_mask & (pairs_mask - 1)) != 0,
+        pairs_mask != 0,
+    ]
+    tie_breaks = [
+        straight_flush_high,
+        (quad_rank << 4) | HIGH_RANK[any_mask & ~(1 << quad_rank)],
+        (trip_rank << 4) | HIGH_RANK[full_house_pairs],
+        TOP_RANKS[5][flush_mask],
+        straight_high,
+        (trip_rank << 8) | TOP_RANKS[2][any_mask & ~(1 << trip_rank)],
+        (pair_rank << 8) | (second_pair_rank << 4) | HIGH_RANK[any_mask & ~(1 << pair_rank) & ~(1 << second_pair_rank)],
+        (pair_rank << 12) | TOP_RANKS[3][any_mask & ~(1 << pair_rank)],
+    ]
+    categories = [STRAIGHT_FLUSH, FOUR_OF_A_KIND, FULL_HOUSE, FLUSH, STRAIGHT, THREE_OF_A_KIND, TWO_PAIR, ONE_PAIR]
+    category = np.select(conditions, categories, default=HIGH_CARD)
+    tie_break = np.select(conditions, tie_breaks, default=TOP_RANKS[5][any_mask])
+    return (category << CATEGORY_SHIFT) | tie_break
+
+
+class EquityResult(NamedTuple):
+    equity: float  # Expected share of the pot at showdown (ties split)
+    std_error: float  # Standard error of the equity estimate
+    samples: int  # Number of runouts simulated
+
+
+def sample_runouts(rng: np.random.Generator, remaining: np.ndarray, num_samples: int, num_cards: int) -> np.ndarray:
+    """Draw `num_cards` distinct cards from `remaining` for each of `num_samples` runouts, returning an array of shape (num_samples, num_cards)."""
+    keys = rng.random((num_samples, remaining.shape[0]))
+    picks = np.argpartition(keys, num_cards - 1, axis=1)[:, :num_cards] if num_cards < remaining.shape[0] else np.argsort(keys, axis=1)
+    return remaining[picks]
+
+
+def simulate_equity(hole_cards: Sequence[int], board: Sequence[int], num_opponents: int, num_samples: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Simulate `num_samples` random runouts against `num_opponents` random hands, all in one batch.
+
+    Returns the hero's pot share for each runout (1 for a win, 1/k for a k-way tie, 0 for a loss).
+    """
+    dead = np.zeros(DECK_SIZE, dtype=bool)
+    dead[list(hole_cards)] = True
+    dead[list(board)] = True
+    remaining = np.flatnonzero(~dead).astype(np.int8)
+    board_needed: int = 5 - len(board)
+    drawn = sample_runouts(rng, remaining, num_samples, board_needed + 2 * num_opponents)
+
+    full_board = np.empty((num_samples, 5), dtype=np.int8)
+    full_board[:, :len(board)] = board
+    full_board[:, len(board):] = drawn[:, :board_needed]
+
+    # Evaluate the hero and every opponent in a single (num_opponents + 1) * num_samples batch
+    hands = np.empty((num_opponents + 1, num_samples, 7), dtype=np.int8)
+    hands[:, :, 2:] = full_board
+    hands[0, :, :2] = hole_cards
+    hands[1:, :, :2] = drawn[:, board_needed:].reshape(num_samples, num_opponents, 2).transpose(1, 0, 2)
+    scores = evaluate_batch(hands.reshape(-1, 7)).reshape(num_opponents + 1, num_samples)
+
+    best = scores.max(axis=0)
+    winners = (scores == best).sum(axis=0)
+    return np.where(scores[0] == best, 1.0 / winners, 0.0)
+
+
+def simulate_equity_batch(hole_cards: np.ndarray, boards: np.ndarray, num_opponents: int, num_samples: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Estimate the equity of n hands at once: (n, 2) hole cards on (n, k) boards (0 <= k <= 5), each against `num_opponents`
+    random hands.
+
+    All n * num_samples runouts are evaluated in one batch. Returns the mean pot share of each hand, shape (n,).
+    """
+    n, known = boards.shape
+    board_needed: int = 5 - known
+    needed: int = board_needed + 2 * num_opponents
+    rows = np.arange(n)[:, None]
+    dead = np.zeros((n, DECK_SIZE), dtype=bool)
+    dead[rows, hole_cards] = True
+    dead[rows, boards] = True
+    # Random keys with the dead cards sorted last, so the smallest `needed` keys of each runout are distinct live cards
+    keys = rng.random((n, num_samples, DECK_SIZE))
+    keys[np.broadcast_to(dead[:, None, :], keys.shape)] = 2.0
+    drawn = np.argpartition(keys, needed - 1, axis=2)[:, :, :needed].astype(np.int8)
+
+    hands = np.empty((num_opponents + 1, n, num_samples, 7), dtype=np.int8)
+    hands[:, :, :, 2:2 + known] = boards[None, :, None, :]
+    hands[:, :, :, 2 + known:] = drawn[None, :, :, :board_needed]
+    hands[0, :, :, :2] = hole_cards[:, None, :]
+    hands[1:, :, :, :2] = drawn[:, :, board_needed:].reshape(n, num_samples, num_opponents, 2).transpose(2, 0, 1, 3)
+    scores = evaluate_batch(hands.reshape(-1, 7)).reshape(num_opponents + 1, n, num_samples)
+
+    best = scores.max(axis=0)
+    winners = (scores == best).sum(axis=0)
+    return np.where(scores[0] == best, 1.0 / winners, 0.0).mean(axis=1)
+
+
+def estimate_equity(hole_cards: Sequence[int], board: Sequence[int] = (), num_opponents: int = 1, num_samples: int = 2000,
+                    time_budget: Optional[float] = None, batch_size: int = 1000, rng: Optional[np.random.Generator] = None) -> EquityResult:
+    """
+    Estimate the hero's equity to the river with Monte-Carlo simulation.
+
+    `hole_cards` holds the hero's two card ints, `board` holds the 0-5 known community cards, and the hero is assumed to play against
+    `num_opponents` random hands that stay in until showdown. Runouts are simulated in batches of `batch_size` until `num_samples`
+    runouts have been done or `time_budget` (seconds) has run out, whichever comes first. At least one batch is always simulated.
+    """
+    if len(hole_cards) != 2:
+        raise ValueError(f"Expected 2 hole cards, got {len(hole_cards)}")
+    if len(board) > 5:
+        raise ValueError(f"Expected at most 5 board cards, got {len(board)}")
+    if num_opponents < 1:
+        raise ValueError(f"Need at least 1 opponent to estimate equity, got {num_opponents}")
+    if rng is None:
+        rng = np.random.default_rng()
+
+    deadline: Optional[float] = time.perf_counter() + time_budget if time_budget is not None else None
+    total: float = 0.0
+    total_sq: float = 0.0
+    samples: int = 0
+    while samples < num_samples:
+        shares = simulate_equity(hole_cards, board, num_opponents, min(batch_size, num_samples - samples), rng)
+        total += float(shares.sum())
+        total_sq += float(np.square(shares).sum())
+        samples += shares.shape[0]
+        if deadline is not None and time.perf_counter() >= deadline:
+            break
+
+    equity: float = total / samples
+    variance: float = max(total_sq / samples - equity * equity, 0.0)
+    std_error: float = float(np.sqrt(variance / samples))
+    log.debug(f"Equity after {samples} samples: {equity:.4f} +/- {std_error:.4f}")
+    return EquityResult(equity, std_error, samples)
@@ -0,0 +1,119 @@
+import logging
+from typing import Callable, NamedTuple, Optional, Union
+
+from util import PlayerAction, Round, cards_to_str
+
+log = logging.getLogger(__name__)
+
+
+class HandStartEvent(NamedTuple):
+    dealer: int
+    bankrolls: tuple[int, ...]
+
+
+class DealEvent(NamedTuple):
+    seat: Optional[int]  # None for community cards
+    cards: tuple[int, ...]
+
+
+class BlindEvent(NamedTuple):
+    seat: int
+    action: PlayerAction  # SMALL_BLIND or BIG_BLIND
+    amount: int
+    bankroll: int  # After posting the blind
+
+
+class ActionEvent(NamedTuple):
+    seat: int
+    action: PlayerAction
+    amount: int  # Chips put into the pot by the action
+    bankroll: int  # After the action
+
+
+class RoundStartEvent(NamedTuple):
+    round: Round
+    first_player: int
+
+
+class RoundEndEvent(NamedTuple):
+    round: Round
+    community_pot: int
+
+
+class ShowdownEvent(NamedTuple):
+    winners: tuple[int, ...]
+    share: int  # Chips won by each winner
+    community_cards: tuple[int, ...]
+    hands: tuple[tuple[int, tuple[int, ...]], ...]  # (seat, hole cards) of every player still in the hand
+
+
+class GameOverEvent(NamedTuple):
+    winner: Optional[int]
+
+
+GameEvent = Union[HandStartEvent, DealEvent, BlindEvent, ActionEvent, RoundStartEvent, RoundEndEvent, ShowdownEvent, GameOverEvent]
+
+
+class EventBus:
+    """
+    Delivers typed game events to any number of subscribers.
+
+    Emitters should check `subscribers` before building an event, so a bus nobody listens to costs one truthiness check per event.
+
+    Subscribers that build state up from events (and would go stale when the game jumps to another state without emitting any) can
+    define `snapshot_state()` and `restore_state(state)`: `PokerGame.snapshot()` keeps what the first returns, and `restore()` hands it back.
+    """
+
+    def __init__(self):
+        self.subscribers: list[Callable[[GameEvent], None]] = []
+
+    def subscribe(self, callback: Callable[[GameEvent], None]) -> None:
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[GameEvent], None]) -> None:
+        self.subscribers.remove(callback)
+
+    def emit(self, event: GameEvent) -> None:
+        for callback in self.subscribers:
+            callback(event)
+
+    def snapshot_states(self) -> tuple:
+        """The (subscriber, state) pairs of the subscribers that keep state of their own (see the class docstring)."""
+        return tuple((callback, callback.snapshot_state()) for callback in self.subscribers if hasattr(callback, "snapshot_state"))  # type: ignore
+
+
+def describe_event(event: GameEvent) -> str:
+    """Build a human-readable description of a game event."""
+    if isinstance(event, HandStartEvent):
+        return f"Starting new hand with player {event.dealer} as dealer (bankrolls: {list(event.bankrolls)})"
+    if isinstance(event, DealEvent):
+        if event.seat is None:
+            return f"Dealer drew {len(event.cards)} card{'s' if len(event.cards) > 1 else ''} to table: {cards_to_str(event.cards)}"
+        return f"Player {event.seat} drew {cards_to_str(event.cards)}"
+    if isinstance(event, BlindEvent):
+        blind = "small" if event.action == PlayerAction.SMALL_BLIND else "big"
+        return f"Player {event.seat} bet {blind} blind: contribution = {event.amount}, bankroll is now {event.bankroll}"
+    if isinstance(event, ActionEvent):
+        if event.action == PlayerAction.FOLD:
+            return f"Player {event.seat} folds and is now inactive"
+        if event.action == PlayerAction.CHECK_CALL:
+            verb = "checks" if event.amount == 0 else "calls"
+        else:
+            verb = "raises"
+        return f"Player {event.seat} {verb}: contribution = {event.amount}, bankroll is now {event.bankroll}"
+    if isinstance(event, RoundStartEvent):
+        return f"Starting round: {event.round.name.capitalize()} - player {event.first_player} will start betting"
+    if isinstance(event, RoundEndEvent):
+        return f"{event.round.name.capitalize()} round over! Community pot is now {event.community_pot}"
+    if isinstance(event, ShowdownEvent):
+        hands = ", ".join(f"player {seat}: {cards_to_str(cards)}" for seat, cards in event.hands)
+        return f"Showdown on {cards_to_str(event.community_cards)} ({hands}) - player(s) {list(event.winners)} win(s) {event.share} each"
+    if isinstance(event, GameOverEvent):
+        return f"Game over! Player {event.winner} won"
+    return repr(event)
+
+
+def log_event(event: GameEvent) -> None:
+    """Event subscriber that logs every event at info level (through whatever handlers, e.g. `ColoredFormatter`, are set up)."""
+    if log.isEnabledFor(logging.INFO):
+        log.info(describe_event(event))
@@ -1,3 +1,3 @@
 from gymnasium.envs.registration import register
 
-register(id="TexasHoldem-v0", entry_point='gym_env.env:TexasHoldemEnv')
+register(id="TexasHoldem-v0", entry_point='gym_env.env:TexasHoldemEnv', vector_entry_point='gym_env.vector_env:TexasHoldemVectorEnv')
@@ -0,0 +1,322 @@
+import argparse
+import logging
+import time
+from typing import Optional
+
+import numpy as np
+from gymnasium import spaces
+
+from agents.player import Player
+from batched_poker import BatchedPokerGame, NUM_DECISIONS, NUM_STAGES
+from events import ActionEvent, BlindEvent, GameEvent, HandStartEvent
+from poker import PokerGame
+from util import ColoredFormatter, DECK_SIZE, PlayerAction, Round
+
+log = logging.getLogger(__name__)
+
+# Observation modes of TexasHoldemEnv/TexasHoldemVectorEnv: the original tuple of Discrete buckets, or the flat float32 feature
+# vector written by the encoders below
+OBS_TUPLE: str = "tuple"
+OBS_FLAT: str = "flat"
+
+NUM_HAND_RANKS: int = 11  # 0 before the flop, then 1 = high card ... 10 = royal flush
+
+
+class ObservationLayout:
+    """
+    Layout of the flat observation vector: named fields at fixed offsets, all scaled to [0, 1].
+
+    Chip amounts are divided by the total chips in play. Per-seat fields are indexed by absolute seat, and per-round ("stage")
+    fields hold one row of seats for each betting round from pre-flop to the river.
+    """
+
+    def __init__(self, num_players: int, initial_bankroll: int, equity: bool = False):
+        p = num_players
+        self.num_players: int = num_players
+        self.chip_scale: float = 1.0 / (num_players * initial_bankroll)
+        fields: list[tuple[str, int]] = [
+            ("current_player", p),  # one-hot seat
+            ("round", len(Round)),  # one-hot
+            ("pots", 2),  # community pot, round pot
+            ("blinds", 2),  # small blind, big blind
+            ("legal_moves", NUM_DECISIONS),  # FOLD / CHECK_CALL / RAISE mask
+            ("active_players", p),
+            ("stacks", p),  # bankrolls
+            ("contributions", p),  # chips put in during the current round
+            ("position", p),  # one-hot seats after the dealer
+            ("hole_cards", DECK_SIZE),  # the current player's cards
+            ("board", DECK_SIZE),
+            ("hand_rank", NUM_HAND_RANKS),  # one-hot
+            ("stage_calls", NUM_STAGES * p),
+            ("stage_raises", NUM_STAGES * p),
+            ("stage_contributions", NUM_STAGES * p),
+        ]
+        if equity:
+            fields.append(("equity", 1))  # the current player's equity to the river against the remaining players
+        self.slices: dict[str, slice] = {}
+        offset: int = 0
+        for name, size in fields:
+            self.slices[name] = slice(offset, offset + size)
+            offset += size
+        self.size: int = offset
+
+        self.space: spaces.Box = spaces.Box(0.0, 1.0, (self.size,), dtype=np.float32)
+        # The same fields as a Dict space, matching unflatten()
+        self.schema: spaces.Dict = spaces.Dict({name: spaces.Box(0.0, 1.0, (size,), dtype=np.float32) for name, size in fields})
+
+    def unflatten(self, observation: np.ndarray) -> dict[str, np.ndarray]:
+        """Split a flat observation (or a batch of them along the last axis) into views of its named fields."""
+        return {name: observation[..., field] for name, field in self.slices.items()}
+
+
+class ObservationEncoder:
+    """
+    Writes a `PokerGame`'s state into one preallocated float32 vector laid out by an `ObservationLayout`.
+
+    The same buffer is overwritten by every `encode()`, so copy observations that have to outlive the next step. Stage data is
+    collected from the game's events as they happen, so the encoder has to be attached (see `attach()`) before the game is reset.
+    It is also kept in the game's snapshots, so `PokerGame.restore()` and `undo()` bring it back along with the game.
+    """
+
+    def __init__(self, layout: ObservationLayout):
+        self.layout: ObservationLayout = layout
+        self.buffer: np.ndarray = np.zeros(layout.size, dtype=np.float32)
+        self.game: Optional[PokerGame] = None
+        slices = layout.slices
+        # Everything before the stage fields is rewritten on each encode(), the stage fields only change on game events
+        self._stage_start: int = slices["stage_calls"].start
+        self._stage_end: int = slices["stage_contributions"].stop
+        self._stage_calls: np.ndarray = self.buffer[slices["stage_calls"]].reshape(NUM_STAGES, layout.num_players)
+        self._stage_raises: np.ndarray = self.buffer[slices["stage_raises"]].reshape(NUM_STAGES, layout.num_players)
+        self._stage_contributions: np.ndarray = self.buffer[slices["stage_contributions"]].reshape(NUM_STAGES, layout.num_players)
+        self._offsets: dict[str, int] = {name: field.start for name, field in slices.items()}
+
+    def attach(self, game: PokerGame) -> None:
+        self.game = game
+        game.events.subscribe(self)
+
+    def detach(self) -> None:
+        if self.game is not None:
+            self.game.events.unsubscribe(self)
+            self.game = None
+
+    def snapshot_state(self) -> np.ndarray:
+        return self.buffer[self._stage_start:self._stage_end].copy()
+
+    def restore_state(self, state: np.ndarray) -> None:
+        self.buffer[self._stage_start:self._stage_end] = state
+
+    def __call__(self, event: GameEvent) -> None:
+        if isinstance(event, HandStartEvent):
+            self.buffer[self._stage_start:] = 0.0
+        elif isinstance(event, (ActionEvent, BlindEvent)) and self.game is not None:
+            stage = self.game.round.value
+            if event.action == PlayerAction.RAISE:
+                self._stage_raises[stage, event.seat] = 1.0
+            elif event.action == PlayerAction.CHECK_CALL and event.amount > 0:
+                self._stage_calls[stage, event.seat] = 1.0
+            self._stage_contributions[stage, event.seat] += event.amount * self.layout.chip_scale
+
+    def encode(self, game: PokerGame, equity: Optional[float] = None) -> np.ndarray:
+        """Fill the buffer from the game's current state (call `game.determine_legal_moves()` first) and return it."""
+        buffer = self.buffer
+        offsets = self._offsets
+        scale: float = self.layout.chip_scale
+        num_players: int = self.layout.num_players
+        current: int = game.current_player_idx
+        buffer[:self._stage_start] = 0.0
+
+        buffer[offsets["current_player"] + current] = 1.0
+        buffer[offsets["round"] + game.round.value] = 1.0
+        pots: int = offsets["pots"]
+        buffer[pots] = game.community_pot * scale
+        buffer[pots + 1] = game.round_pot * scale
+        blinds: int = offsets["blinds"]
+        buffer[blinds] = game.small_blind * scale
+        buffer[blinds + 1] = game.big_blind * scale
+        legal: int = offsets["legal_moves"]
+        for move in game.legal_moves:
+            buffer[legal + move.value] = 1.0
+        active: int = offsets["active_players"]
+        stacks: int = offsets["stacks"]
+        contributions: int = offsets["contributions"]
+        for seat, player in enumerate(game.players):
+            if game.active_players[seat]:
+                buffer[active + seat] = 1.0
+            buffer[stacks + seat] = player.bankroll * scale
+            buffer[contributions + seat] = game.player_pots[seat] * scale
+        buffer[offsets["position"] + (current - game.dealer_idx) % num_players] = 1.0
+        hole_cards: int = offsets["hole_cards"]
+        for card in game.players[current].cards:
+            buffer[hole_cards + card] = 1.0
+        board: int = offsets["board"]
+        for card in game.community_cards:
+            buffer[board + card] = 1.0
+        hand_rank = game.player_hand_rank(current)
+        buffer[offsets["hand_rank"] + (hand_rank[2] if hand_rank else 0)] = 1.0
+        if equity is not None:
+            buffer[offsets["equity"]] = equity
+        return buffer
+
+
+class BatchObservationEncoder:
+    """
+    Writes every table of a `BatchedPokerGame` into one preallocated (num_tables, obs_dim) float32 array, with the same layout
+    and values as `ObservationEncoder` on a `PokerGame` in the same state. The array is overwritten by every `encode()`.
+    """
+
+    def __init__(self, layout: ObservationLayout, num_tables: int):
+        self.layout: ObservationLayout = layout
+        self.buffer: np.ndarray = np.zeros((num_tables, layout.size), dtype=np.float32)
+        self.tables: np.ndarray = np.arange(num_tables)
+        self.fields: dict[str, np.ndarray] = layout.unflatten(self.buffer)
+        self._offsets: dict[str, int] = {name: field.start for name, field in layout.slices.items()}
+
+    def _one_hot(self, field: str, tables: np.ndarray, index: np.ndarray) -> None:
+        self.buffer[tables, self._offsets[field] + index] = 1.0
+
+    def encode(self, game: BatchedPokerGame, legal_moves: Optional[np.ndarray] = None, equity: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Fill the array from every table's current state, reusing the (num_tables, 3) legal move mask if it was already computed.
+
+        `equity` holds the current player's equity on each table, for layouts with an equity field.
+        """
+        buffer, fields, tables = self.buffer, self.fields, self.tables
+        scale: float = self.layout.chip_scale
+        num_players: int = self.layout.num_players
+        current = game.current_player_idx.astype(np.int64)
+        buffer[:] = 0.0
+
+        self._one_hot("current_player", tables, current)
+        self._one_hot("round", tables, game.round.astype(np.int64))
+        fields["pots"][:, 0] = game.community_pot * scale
+        fields["pots"][:, 1] = game.round_pot * scale
+        fields["blinds"][:] = (game.small_blind * scale, game.big_blind * scale)
+        fields["legal_moves"][:] = game.determine_legal_moves() if legal_moves is None else legal_moves
+        fields["active_players"][:] = game.active_players
+        fields["stacks"][:] = game.bankrolls * scale
+        fields["contributions"][:] = game.player_pots * scale
+        self._one_hot("position", tables, (current - game.dealer_idx) % num_players)
+        for name, cards in (("hole_cards", game.hole_cards[tables, current]), ("board", game.community_cards)):
+            rows, columns = np.nonzero(cards >= 0)
+            self._one_hot(name, rows, cards[rows, columns].astype(np.int64))
+        self._one_hot("hand_rank", tables, game.hand_rank_index())
+        fields["stage_calls"][:] = game.stage_calls.reshape(len(tables), -1)
+        fields["stage_raises"][:] = game.stage_raises.reshape(len(tables), -1)
+        fields["stage_contributions"][:] = game.stage_contributions.reshape(len(tables), -1) * scale
+        if equity is not None:
+            fields["equity"][:, 0] = equity
+        return buffer
+
+
+def run_parity_check(num_tables: int, num_players: int, num_steps: int, seed: int = 0) -> tuple[float, float]:
+    """
+    Check `BatchObservationEncoder` against `ObservationEncoder` on the shadow `PokerGame`s of a parity-checked `BatchedPokerGame`,
+    raising on the first mismatch. Returns the time per observation of each encoder, in seconds.
+    """
+    game = BatchedPokerGame(num_tables, num_players, 100, 2, 5, parity_check=True)
+    assert game.shadow_games is not None
+    layout = ObservationLayout(num_players, 100)
+    batch_encoder = BatchObservationEncoder(layout, num_tables)
+    encoders = [ObservationEncoder(layout) for _ in range(num_tables)]
+    for encoder, shadow in zip(encoders, game.shadow_games):
+        encoder.attach(shadow)
+    game.set_rngs([np.random.default_rng(seed + table) for table in range(num_tables)])
+    action_rng = np.random.default_rng(seed + num_tables)
+    game.reset(np.ones(num_tables, dtype=bool))
+    scalar_time = batch_time = 0.0
+    scalar_count: int = 0
+    for _ in range(num_steps):
+        start = time.perf_counter()
+        batch = batch_encoder.encode(game)
+        batch_time += time.perf_counter() - start
+        for table in np.flatnonzero(~game.done):
+            shadow = game.shadow_games[table]
+            start = time.perf_counter()
+            shadow.determine_legal_moves()
+            observation = encoders[table].encode(shadow)
+            scalar_time += time.perf_counter() - start
+            scalar_count += 1
+            if not np.allclose(observation, batch[table], rtol=0, atol=1e-6):
+                fields = layout.unflatten(observation - batch[table])
+                different = [name for name, values in fields.items() if np.abs(values).max() > 1e-6]
+                raise AssertionError(f"Table {table} encodes differently from PokerGame in fields {different}")
+        # Reset finished tables first, so every table acts on its own current legal moves
+        if game.done.any():
+            game.reset(game.done)
+        legal = game.determine_legal_moves()
+        actions = np.argmax(action_rng.random(legal.shape) * legal, axis=1)
+        game.do_step(actions, ~game.done)
+    return scalar_time / max(scalar_count, 1), batch_time / (num_tables * num_steps)
+
+
+def run_restore_check(num_players: int, num_steps: int, seed: int = 0) -> None:
+    """
+    Check that an attached `ObservationEncoder` follows `PokerGame.restore()` and `undo()`: replaying the same moves from a
+    restored snapshot must encode the same observations, raising on the first mismatch.
+    """
+    game = PokerGame(100, 2, 5)
+    for seat in range(num_players):
+        player = Player(f"Player {seat}", True)
+        player.seat = seat
+        game.players.append(player)
+    encoder = ObservationEncoder(ObservationLayout(num_players, 100))
+    encoder.attach(game)
+    game.set_rng(np.random.default_rng(seed))
+    action_rng = np.random.default_rng(seed + 1)
+    game.set_undo_depth(1)
+
+    def step() -> np.ndarray:
+        if game.done:
+            game.reset()
+        game.determine_legal_moves()
+        game.do_step(game.legal_moves[action_rng.integers(len(game.legal_moves))])
+        game.determine_legal_moves()
+        return encoder.encode(game).copy()
+
+    game.reset()
+    for _ in range(10):
+        step()
+    start, action_state = game.snapshot(), action_rng.bit_generator.state
+    first = [step() for _ in range(num_steps)]
+    game.restore(start)
+    action_rng.bit_generator.state = action_state
+    for index, expected in enumerate(first):
+        if game.done:
+            game.reset()
+        game.determine_legal_moves()
+        before = encoder.encode(game).copy()
+        action_state = action_rng.bit_generator.state
+        step()
+        game.undo()
+        game.determine_legal_moves()
+        if not np.array_equal(encoder.encode(game), before):
+            raise AssertionError(f"Step {index} after restore() encodes differently once undone")
+        action_rng.bit_generator.state = action_state
+        if not np.array_equal(step(), expected):
+            raise AssertionError(f"Step {index} after restore() encodes differently from the original")
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+    # The checks play thousands of games - keep the games' own progress messages out of the report
+    logging.getLogger("batched_poker").setLevel(logging.WARNING)
+    logging.getLogger("poker").setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="Check the batched observation encoder against the scalar one and time both, and check the scalar one across restores.")
+    parser.add_argument("--tables", type=int, default=32)
+    parser.add_argument("--players", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for num_players in args.players:
+        scalar, batched = run_parity_check(args.tables, num_players, args.steps, args.seed)
+        run_restore_check(num_players, args.steps, args.seed)
+        log.info(f"{num_players} players: {ObservationLayout(num_players, 100).size} features, encoders match and follow restores | "
+                 f"scalar {scalar * 1e6:.2f} us, batched {batched * 1e6:.2f} us per observation ({args.tables} tables)")
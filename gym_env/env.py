@@ -1,99 +1,159 @@
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 import logging
 
 import numpy as np
-import pygame
 
 import gymnasium as gym
 from gymnasium import spaces
 
 from poker import PokerGame
-from util import PlayerAction, rank_hand, Round, suits, ranks
+from instrumentation import PhaseTimer, DEALING, BETTING, EVALUATION, OBSERVATION, AUTOPLAY, STEP
+from equity import estimate_equity
+from preflop import preflop_equity
+from util import PlayerAction, Round
 from agents.player import Player
+from gym_env.encoder import ObservationEncoder, ObservationLayout, OBS_FLAT, OBS_TUPLE
+from gym_env.renderer import TableRenderer
+from gym_env.sprites import get_sprites
 # from agents.human_player import HumanPlayer
 
+if TYPE_CHECKING:
+    import pygame
+
 log = logging.getLogger(__name__)
 
 
+# The env's own random streams besides the deck's (see `TexasHoldemEnv._stream_seed()`)
+EQUITY_STREAM: int = 0
+DUPLICATE_STREAM: int = 1
+PLAYER_STREAM: int = 2
+
+
 class TexasHoldemEnv(gym.Env):
     metadata = {"render_modes": ["human", "rgb_array"], "render_fps": 5}
 
-    def __init__(self, initial_bankroll: int, small_blind: int, big_blind: int, players: list[Player], render_mode: Optional[str] = None):
+    def __init__(self, initial_bankroll: int, small_blind: int, big_blind: int, players: list[Player], render_mode: Optional[str] = None, equity_samples: int = 0, collect_stats: bool = False, duplicate: bool = False,
+                 observation_mode: str = OBS_TUPLE):
         self.game = PokerGame(initial_bankroll, small_blind, big_blind)
+        # OBS_TUPLE: a tuple of Discrete buckets (what the tabular agents use), OBS_FLAT: a float32 feature vector from `encoder`
+        if observation_mode not in (OBS_TUPLE, OBS_FLAT):
+            raise ValueError(f"Unknown observation mode {observation_mode!r}")
+        self.observation_mode: str = observation_mode
+        self.encoder: Optional[ObservationEncoder] = None
+        # Duplicate mode (see PokerGame.set_duplicate()): reset(seed=...) fixes every hand's deck, whatever actions are taken
+        self.duplicate: bool = duplicate
+        # Number of Monte-Carlo runouts used for the equity observation (0 leaves equity out of the observation)
+        self.equity_samples: int = equity_samples
+        self.equity_rng: np.random.Generator = np.random.default_rng()
+        # The last reset seed and the resets since, which key the streams that must not draw from the deck's generator
+        self._reset_seed: Optional[int] = None
+        self._resets_since_seed: int = 0
         self.add_players(players)
-        self.master_deck = [rank + suit for suit in suits for rank in ranks]
         self.window_size = (768, 512)
         self.action_space = spaces.Discrete(len(PlayerAction) - 2)
-        self.observation_space = spaces.Tuple(
-            (
-                spaces.Discrete(1, start=len(self.game.players)),  # number of players
-                spaces.Discrete(len(self.game.players), start=0),  # current player
-                spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # current player bankroll
-                spaces.Discrete(10),  # current hand rank
-                spaces.Discrete(len(Round)),  # current round
-                # spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # current player pot
-                # spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # round pot
-                # spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # community pot
-            )
-        )
+        self.observation_space = self._build_observation_space()
         self.observation = {}
         self.reward = 0.0
 
         assert render_mode is None or render_mode in self.metadata["render_modes"]
         self.render_mode = render_mode
 
-        self.window: Optional[pygame.Surface] = None
+        self.window: Optional["pygame.Surface"] = None
         self.clock = None
-        self.table_image = pygame.image.load("sprites/png/table.png")
-        self.table_image = pygame.transform.scale_by(self.table_image, 5.0)
-        self.cards_spritesheet = pygame.image.load("sprites/png/Card_Sheet.png")
-        self.cards: list[pygame.Surface] = []
-        for y in range(0, 128, 32):
-            for x in range(0, 416, 32):
-                card_image = pygame.Surface((32, 32), pygame.SRCALPHA)
-                card_image.blit(self.cards_spritesheet, (0, 0), (x, y, x + 32, y + 32))
-                self.cards.append(card_image)
-        one_of_one_bottom = pygame.Rect(320, 384, 128, 128)
-        one_of_one_top = pygame.Rect(320, 0, 128, 128)
-        left = pygame.Rect(0, 192, 128, 128)
-        right = pygame.Rect(640, 192, 128, 128)
-        one_of_two_top = pygame.Rect(220, 0, 128, 128)
-        two_of_two_top = pygame.Rect(420, 0, 128, 128)
-        one_of_two_bottom = pygame.Rect(220, 384, 128, 128)
-        two_of_two_bottom = pygame.Rect(420, 384, 128, 128)
-        one_of_three_top = pygame.Rect(170, 0, 128, 128)
-        two_of_three_top = pygame.Rect(320, 0, 128, 128)
-        three_of_three_top = pygame.Rect(470, 0, 128, 128)
-        one_of_three_bottom = pygame.Rect(170, 384, 128, 128)
-        two_of_three_bottom = pygame.Rect(320, 384, 128, 128)
-        three_of_three_bottom = pygame.Rect(470, 384, 128, 128)
-
-        self.player_offsets = [
-            [pygame.Rect(0, 0, 0, 0)], [pygame.Rect(0, 0, 0, 0)],
-            [one_of_one_bottom, one_of_one_top],
-            [one_of_one_bottom, left, right],
-            [one_of_one_bottom, left, one_of_one_top, right],
-            [one_of_one_bottom, left, one_of_two_top, two_of_two_top, right],
-            [one_of_two_bottom, left, one_of_two_top, two_of_two_top, right, two_of_two_bottom],
-            [one_of_two_bottom, left, one_of_three_top, two_of_three_top, three_of_three_top, right, two_of_two_bottom],
-            [two_of_three_bottom, one_of_three_bottom, left, one_of_three_top, two_of_three_top, three_of_three_top, right, three_of_three_bottom]
+        # Created on first render, so headless envs never import pygame or touch the sprite files
+        self.renderer: Optional[TableRenderer] = None
+
+        # Per-phase timing (see get_stats()) - without it, no timing code runs at all
+        self.timer: Optional[PhaseTimer] = None
+        if collect_stats:
+            self._install_timer()
+
+    def _install_timer(self) -> None:
+        """Wrap the methods making up each phase of a step with timers."""
+        self.timer = PhaseTimer()
+        for name in ["start_new_hand", "generate_deck", "deal_new_cards", "deal_cards_to_table"]:
+            self.timer.install(self.game, name, DEALING)
+        for name in ["next_player", "determine_legal_moves", "process_decision"]:
+            self.timer.install(self.game, name, BETTING)
+        for name in ["player_hand_rank", "showdown"]:
+            self.timer.install(self.game, name, EVALUATION)
+        self.timer.install(self.game, "dump_state", OBSERVATION)
+        self.timer.install(self, "_get_obs", OBSERVATION)
+        self.timer.install(self, "_play_autoplay", AUTOPLAY)
+        self.timer.install(self, "_apply_action", STEP)
+
+    def get_stats(self) -> dict[str, dict[str, float]]:
+        """
+        Get the call count, total time and self time (excluding nested phases) of each phase since the last reset.
+
+        "autoplay" self time is mostly spent in the opponents' `action()` methods. Empty unless the env was created with `collect_stats=True`.
+        """
+        return self.timer.stats() if self.timer is not None else {}
+
+    def _build_observation_space(self) -> spaces.Space:
+        if self.observation_mode == OBS_FLAT:
+            # The layout depends on the number of players, so the encoder is rebuilt whenever one is added
+            if self.encoder is not None:
+                self.encoder.detach()
+            self.encoder = ObservationEncoder(ObservationLayout(len(self.game.players), self.game.initial_bankroll, equity=self.equity_samples > 0))
+            self.encoder.attach(self.game)
+            return self.encoder.layout.space
+        parts = [
+            spaces.Discrete(1, start=len(self.game.players)),  # number of players
+            spaces.Discrete(len(self.game.players), start=0),  # current player
+            spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # current player bankroll
+            spaces.Discrete(11),  # current hand rank (0 before the flop, then 1 = high card ... 10 = royal flush)
+            spaces.Discrete(len(Round)),  # current round
+            # spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # current player pot
+            # spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # round pot
+            # spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # community pot
         ]
+        if self.equity_samples > 0:
+            parts.append(spaces.Discrete(10))  # current player equity to river against the remaining players (in tenths)
+        return spaces.Tuple(parts)
+
+    def _get_equity(self) -> float:
+        """
+        Estimate the current player's equity against the other active players.
+
+        Only done for agents driving the env and autoplay players that act on observations - other autoplay opponents get 0 so the
+        autoplay loop doesn't pay for simulations.
+        """
+        player = self.game.current_player
+        if not player or (player.autoplay and not player.observes) or len(player.cards) != 2:
+            return 0.0
+        opponents: int = max(self.game.active_players.count(True) - 1, 1)
+        if not self.game.community_cards:
+            return preflop_equity(self.game.current_player.cards, opponents + 1)
+        return estimate_equity(self.game.current_player.cards, self.game.community_cards, opponents, num_samples=self.equity_samples, batch_size=self.equity_samples, rng=self.equity_rng).equity
+
+    def _get_equity_bucket(self) -> int:
+        """The current player's equity (see `_get_equity()`), bucketed into tenths."""
+        return min(int(self._get_equity() * 10), 9)
 
     def _get_obs(self) -> None:
         self.game.determine_legal_moves()
+        if self.encoder is not None:
+            # Reuses the encoder's buffer - copy the observation to keep it past the next step
+            self.observation = self.encoder.encode(self.game, self._get_equity() if self.equity_samples > 0 else None)
+            self.game.dump_state()
+            return
+        hand_rank = self.game.player_hand_rank(self.game.current_player_idx)
         self.observation = (
             len(self.game.players),  # number of players
             self.game.current_player_idx,  # current player
             self.game.current_player.bankroll // (len(self.game.players) * self.game.initial_bankroll // 10) if self.game.current_player else 0,  # current player bankroll
-            rank_hand((self.game.current_player.cards if self.game.current_player else []) + self.game.community_cards)[2] if len(self.game.community_cards) >= 3 else 0,  # current hand rank
+            hand_rank[2] if hand_rank else 0,  # current hand rank
             self.game.round.value,  # current round
             # self.game.player_pots[self.game.current_player_idx] // (len(self.game.players) * self.game.initial_bankroll // 10),  # current player pot
             # self.game.round_pot // (len(self.game.players) * self.game.initial_bankroll // 10),  # round pot
             # self.game.community_pot // (len(self.game.players) * self.game.initial_bankroll // 10)  # community pot
         )
+        if self.equity_samples > 0:
+            self.observation += (self._get_equity_bucket(),)
         # self.observation["table_cards"] = np.array((self.observation["table_cards"] + 5 * [-1])[:5])
         self.game.dump_state()
-        log.debug(f"Observation: {self.observation}")
+        log.debug("Observation: %s", self.observation)
         # self.render()
 
     def _get_info(self) -> dict:
@@ -115,118 +175,120 @@ class TexasHoldemEnv(gym.Env):
         player.cards = []
         player.seat = len(self.game.players)
         self.game.players.append(player)
+        player.join(self.game)
         log.debug(f"Player added: {player.name} at seat #{player.seat}, has {player.bankroll} chips in bankroll")
-        self.observation_space = spaces.Tuple(
-            (
-                spaces.Discrete(1, start=len(self.game.players)),  # number of players
-                spaces.Discrete(len(self.game.players), start=0),  # current player
-                spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # current player bankroll
-                spaces.Discrete(10),  # current hand rank
-                spaces.Discrete(len(Round)),  # current round
-                # spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # current player pot
-                # spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # round pot
-                # spaces.Discrete(len(self.game.players) * self.game.initial_bankroll // 10),  # community pot
-            )
-        )
+        self.observation_space = self._build_observation_space()
 
     def reset(self, seed: Optional[int] = None, options: Optional[dict] = None):  # type: ignore
         super().reset(seed=seed)
         self.game.set_rng(self.np_random)
+        if seed is not None:
+            self._reset_seed, self._resets_since_seed = seed, 0
+        else:
+            self._resets_since_seed += 1
+        if self.equity_samples > 0:
+            # Equity sampling gets its own stream so it doesn't shift the deck's random sequence
+            self.equity_rng = np.random.default_rng(self._stream_seed(EQUITY_STREAM))
+        if self.duplicate:
+            self.game.set_duplicate(int(np.random.default_rng(self._stream_seed(DUPLICATE_STREAM)).integers(2 ** 63)))
+        if seed is not None:
+            # A seeded reset replays the players' own random choices too, each from a stream of its own
+            for player in self.game.players:
+                player.seed_rng(self._stream_seed(PLAYER_STREAM, player.seat))
+        if self.timer is not None:
+            self.timer.reset()
         self.game.reset()
         self._get_obs()
         return (self.observation, self._get_info())
 
+    def _stream_seed(self, kind: int, *index: int) -> Optional[list[int]]:
+        """
+        Seed of one of the env's own streams, for `np.random.default_rng()`: keyed by the last reset seed, the resets since and the
+        stream's kind (and index), so it never draws from the deck's generator. None (OS entropy) if the env was never seeded.
+        """
+        if self._reset_seed is None:
+            return None
+        return [self._reset_seed, self._resets_since_seed, kind, *index]
+
     def step(self, action: Optional[PlayerAction] = None):
+        self._apply_action(action)
+        info = self._get_info()
+        if self.timer is not None and self.game.done:
+            info['stats'] = self.timer.stats()
+        # Observation, reward, terminated, truncated, info
+        return (self.observation, self.reward, self.game.done, False, info)
+
+    def _apply_action(self, action: Optional[PlayerAction]) -> None:
+        """Play the agent's action (or let autoplay players act, if it is None) and the autoplay turns after it, setting the reward."""
         self.reward = 0.0
         if action is None and self.game.current_player and self.game.current_player.autoplay:
-            while self.game.current_player.autoplay and not self.game.done:
-                action = self.game.action(self.observation, self._get_info())
-                if action not in self.game.legal_moves:
-                    self.reward = -10.0
-                    continue
-                if action == PlayerAction.FOLD:
-                    self.reward = -5.0
-                self.game.do_step(action)
-                self._get_obs()
+            self._play_autoplay(penalize=True)
         else:
             if action is not None and self.game.current_player:
                 if action not in self.game.legal_moves:
                     self.reward = -10.0
                     log.warning(f"Action {action} is not a legal move!")
-                    return (self.observation, self.reward, self.game.done, False, self._get_info())
+                    return
                 if action == PlayerAction.FOLD:
                     self.reward = -5.0
                 self.game.do_step(action)
                 self._get_obs()
-                while self.game.current_player.autoplay and not self.game.done:
-                    action = self.game.action(self.observation, self._get_info())
-                    self.game.do_step(action)
-                    self._get_obs()
+                self._play_autoplay()
             else:
                 raise RuntimeError("Cannot step game with action None when a non-autoplay agent is playing!")
         self._calc_reward()
-        # Observation, reward, terminated, truncated, info
-        return (self.observation, self.reward, self.game.done, False, self._get_info())
+
+    def play_turn(self) -> PlayerAction:
+        """
+        Let the current player choose and play its move, and update the observation. Returns the move.
+
+        Unlike `step()`, this plays exactly one turn and computes no reward, so callers running a table of autoplay players can
+        stop wherever they like (e.g. at a hand limit). The game must not be over.
+        """
+        action = self.game.action(self.observation, self._get_info())
+        self.game.do_step(action)
+        self._get_obs()
+        return action
+
+    def _play_autoplay(self, penalize: bool = False) -> None:
+        """Let autoplay players act until a non-autoplay player is up or the game is over, rewarding their illegal moves and folds if `penalize`."""
+        while self.game.current_player.autoplay and not self.game.done:  # type: ignore
+            action = self.game.action(self.observation, self._get_info())
+            if penalize:
+                if action not in self.game.legal_moves:
+                    self.reward = -10.0
+                    continue
+                if action == PlayerAction.FOLD:
+                    self.reward = -5.0
+            self.game.do_step(action)
+            self._get_obs()
 
     def render(self):
         if self.render_mode in ["human", "rgb_array"]:
             return self._render_frame()
 
     def _render_frame(self):
-        if self.window is None and self.render_mode == "human":
-            pygame.init()
-            pygame.display.init()
-            self.window = pygame.display.set_mode(self.window_size)
-        if self.clock is None and self.render_mode == "human":
-            self.clock = pygame.time.Clock()
-        canvas = pygame.Surface(self.window_size)
-        canvas.fill((255, 255, 255))
-
-        # Draw state using pygame.draw.*
-        canvas.blit(self.table_image, self.table_image.get_rect(center=canvas.get_rect().center).move(0, -7))
-
-        # Community card rect
-        # pygame.draw.rect(canvas, (0, 0, 0), (canvas.get_rect().centerx - 80, canvas.get_rect().centery - 16, 160, 32))
-        card_offset: int = 0
-        for card in self.game.community_cards:
-            self._draw_card(self.master_deck.index(card), canvas, pygame.Rect(canvas.get_rect().centerx - 80 + card_offset, canvas.get_rect().centery - 16, 0, 0))
-            card_offset += 32
-
-        font = pygame.font.Font(pygame.font.get_default_font(), 14)
-        for idx, player in enumerate(self.game.players):
-            name = font.render(player.name + " (" + str(player.seat) + ")", True, (0, 0, 0), None)
-            bankroll = font.render("BR: " + str(player.bankroll), True, (0, 0, 0), None)
-            bet = font.render("Bet: " + str(player.round_contribution), True, (0, 0, 0), None)
-            rank = font.render("Rank: " + (rank_hand(player.cards + self.game.community_cards)[0] if len(self.game.community_cards) + len(player.cards) >= 5 and self.game.active_players[idx] else "N/A"), True, (0, 0, 0), None)
-
-            canvas.blit(name, self.player_offsets[len(self.game.players)][idx])
-            canvas.blit(bankroll, self.player_offsets[len(self.game.players)][idx].move(0, 14))
-            canvas.blit(bet, self.player_offsets[len(self.game.players)][idx].move(0, 28))
-            canvas.blit(rank, self.player_offsets[len(self.game.players)][idx].move(0, 42))
-
-            card_offset: int = 0
-            for card in player.cards:
-                self._draw_card(self.master_deck.index(card), canvas, self.player_offsets[len(self.game.players)][idx].move(card_offset, 56))
-                card_offset += 32
-
-        round = font.render(self.game.round.name, True, (255, 255, 255), None)
-        canvas.blit(round, round.get_rect(center=canvas.get_rect().center).move(0, -30))
-        pots = font.render(str(self.game.round_pot) + " | " + str(self.game.community_pot), True, (255, 255, 255), None)
-        canvas.blit(pots, pots.get_rect(center=canvas.get_rect().center).move(0, 30))
+        import pygame
 
+        if self.renderer is None:
+            self.renderer = TableRenderer(get_sprites(), self.window_size)
+        dirty = self.renderer.draw(self.game)
         if self.render_mode == "human":
-            if self.window is not None:
-                self.window.blit(canvas, canvas.get_rect())
-                pygame.event.pump()
-                pygame.display.update()
-
-            if self.clock is not None:
-                self.clock.tick(self.metadata["render_fps"])
+            if self.window is None:
+                pygame.init()
+                pygame.display.init()
+                self.window = pygame.display.set_mode(self.window_size)
+                dirty = [self.renderer.bounds]
+            if self.clock is None:
+                self.clock = pygame.time.Clock()
+            for rect in dirty:
+                self.window.blit(self.renderer.canvas, rect, rect)
+            pygame.event.pump()
+            pygame.display.update(dirty)
+            self.clock.tick(self.metadata["render_fps"])
         else:
-            return np.transpose(np.array(pygame.surfarray.pixels3d(canvas)), axes=(1, 0, 2))
-
-    def _draw_card(self, card_index: int, canvas: pygame.Surface, position: pygame.Rect):
-        canvas.blit(self.cards[card_index], position)
+            # The renderer reuses its frame buffer, but callers of render() may keep every frame
+            return self.renderer.frame().copy()
 
     def _calc_reward(self):
         if self.game.done:
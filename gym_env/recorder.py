@@ -0,0 +1,167 @@
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+from gym_env.env import TexasHoldemEnv
+from gym_env.renderer import TableRenderer
+from gym_env.sprites import get_sprites
+from hand_history import HandHistory
+from league import parse_agent
+from rng_streams import EpisodeSeeds
+from util import ColoredFormatter
+
+log = logging.getLogger(__name__)
+
+# Outputs with these extensions are encoded as video by ffmpeg; anything else is a directory of numbered PNG frames
+VIDEO_EXTENSIONS: tuple[str, ...] = (".mp4", ".mkv", ".webm", ".avi", ".mov", ".gif")
+
+
+class ImageSequenceWriter:
+    """Writes RGB frames to a directory as numbered PNG files."""
+
+    def __init__(self, directory: str, prefix: str = "frame"):
+        os.makedirs(directory, exist_ok=True)
+        self.directory: str = directory
+        self.prefix: str = prefix
+        self.frames: int = 0
+
+    def write(self, frame: np.ndarray) -> None:
+        import pygame
+
+        height, width = frame.shape[:2]
+        # frombuffer wraps the array's memory instead of copying it into a new surface
+        image = pygame.image.frombuffer(np.ascontiguousarray(frame), (width, height), "RGB")
+        pygame.image.save(image, os.path.join(self.directory, f"{self.prefix}_{self.frames:06d}.png"))
+        self.frames += 1
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "ImageSequenceWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class VideoWriter:
+    """Streams raw RGB frames into an ffmpeg process encoding a video file (ffmpeg must be on the PATH)."""
+
+    def __init__(self, path: str, size: tuple[int, int], fps: int = 5, ffmpeg: str = "ffmpeg"):
+        executable = shutil.which(ffmpeg)
+        if executable is None:
+            raise RuntimeError(f"{ffmpeg} was not found - install it or record to an image sequence directory instead")
+        width, height = size
+        command = [executable, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps), "-i", "-"]
+        if not path.endswith(".gif"):
+            command += ["-pix_fmt", "yuv420p"]
+        self.process: subprocess.Popen = subprocess.Popen(command + [path], stdin=subprocess.PIPE)
+        self.path: str = path
+        self.frames: int = 0
+
+    def write(self, frame: np.ndarray) -> None:
+        assert self.process.stdin is not None
+        self.process.stdin.write(np.ascontiguousarray(frame).data)
+        self.frames += 1
+
+    def close(self) -> None:
+        if self.process.stdin is not None and not self.process.stdin.closed:
+            self.process.stdin.close()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed to encode {self.path} (exit code {self.process.returncode})")
+
+    def __enter__(self) -> "VideoWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+FrameSink = Union[ImageSequenceWriter, VideoWriter]
+
+
+def open_sink(path: str, size: tuple[int, int], fps: int = 5) -> FrameSink:
+    """Open a video writer for paths with a video extension (see `VIDEO_EXTENSIONS`), or an image sequence directory otherwise."""
+    if path.lower().endswith(VIDEO_EXTENSIONS):
+        return VideoWriter(path, size, fps)
+    return ImageSequenceWriter(path)
+
+
+def record_game(env: TexasHoldemEnv, sink: FrameSink, seed: Optional[int] = None, max_steps: int = 10000) -> int:
+    """
+    Play one game between autoplay players without a display, writing a frame of the table after every decision.
+
+    Returns the number of frames written.
+    """
+    if not all(player.autoplay for player in env.game.players):
+        raise ValueError("Recorded games must be played by autoplay players only")
+    renderer = TableRenderer(get_sprites(), env.window_size)
+    if seed is not None:
+        EpisodeSeeds(seed, 0, 0).reset(env)
+    else:
+        env.reset()
+    game = env.game
+    frames: int = 0
+    while True:
+        renderer.draw(game)
+        sink.write(renderer.frame())
+        frames += 1
+        if game.done or frames > max_steps:
+            return frames
+        env.play_turn()
+
+
+def record_history(history: HandHistory, sink: FrameSink, hands: Iterable[int], window_size: tuple[int, int] = (768, 512)) -> int:
+    """Replay recorded hands (see `hand_history.py`), writing a frame of the table before every decision and after the showdown."""
+    renderer = TableRenderer(get_sprites(), window_size)
+    frames: int = 0
+    for index in hands:
+        for game in history.replay(index):
+            renderer.draw(game)
+            sink.write(renderer.frame())
+            frames += 1
+    return frames
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+    # Agents log every decision at INFO
+    logging.getLogger("agents").setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="Render games without a display, to a video file or a directory of PNG frames.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    history_parser = subparsers.add_parser("history", help="replay hands from a hand history shard")
+    history_parser.add_argument("shard")
+    history_parser.add_argument("output", help=f"video file ({', '.join(VIDEO_EXTENSIONS)}) or frame directory")
+    history_parser.add_argument("--start", type=int, default=0, help="first hand to replay")
+    history_parser.add_argument("--count", type=int, default=10, help="number of hands to replay")
+    history_parser.add_argument("--fps", type=int, default=5)
+    game_parser = subparsers.add_parser("game", help="play and record one game between autoplay agents")
+    game_parser.add_argument("output", help=f"video file ({', '.join(VIDEO_EXTENSIONS)}) or frame directory")
+    game_parser.add_argument("--agent", dest="agents", action="append", default=None, help='agent as "module:Class[:argument]", once per seat (default: 4 RandomPlayers)')
+    game_parser.add_argument("--seed", type=int, default=0)
+    game_parser.add_argument("--fps", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "history":
+        history = HandHistory(args.shard)
+        hands = range(args.start, min(args.start + args.count, len(history)))
+        with open_sink(args.output, (768, 512), args.fps) as sink:
+            frames = record_history(history, sink, hands)
+        log.info(f"Wrote {frames} frames of {len(hands)} hands to {args.output}")
+    else:
+        specs = args.agents or ["agents.random_player:RandomPlayer"] * 4
+        env = TexasHoldemEnv(100, 2, 5, [parse_agent(f"seat{seat}={spec}")[1]() for seat, spec in enumerate(specs)])
+        with open_sink(args.output, env.window_size, args.fps) as sink:
+            frames = record_game(env, sink, args.seed)
+        log.info(f"Wrote {frames} frames to {args.output}")
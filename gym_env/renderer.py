@@ -0,0 +1,136 @@
+import logging
+from typing import TYPE_CHECKING, Callable, Hashable, Optional
+
+import numpy as np
+
+from gym_env.sprites import Sprites
+from poker import PokerGame
+from util import DECK_SIZE, card_rank, card_suit, card_suits, suits
+
+if TYPE_CHECKING:
+    import pygame
+
+log = logging.getLogger(__name__)
+
+BACKGROUND_COLOR: tuple[int, int, int] = (255, 255, 255)
+PLAYER_TEXT_COLOR: tuple[int, int, int] = (0, 0, 0)
+TABLE_TEXT_COLOR: tuple[int, int, int] = (255, 255, 255)
+# Rendered text is cached by (text, color); the cache is dropped when it grows past this many entries
+MAX_GLYPHS: int = 4096
+# Past this many pending dirty regions, the next frame() copies the whole canvas instead
+MAX_PENDING_REGIONS: int = 32
+
+
+class TableRenderer:
+    """
+    Draws a `PokerGame` onto a persistent canvas, redrawing only the regions whose contents changed since the last `draw()`.
+
+    The table background is drawn once into a static layer that changed regions are restored from, rendered text is cached, and
+    `frame()` copies only the changed regions into an RGB array that is reused between frames. Needs pygame (but not a display).
+    """
+
+    def __init__(self, sprites: Sprites, window_size: tuple[int, int]):
+        import pygame
+
+        self.sprites: Sprites = sprites
+        self.font: pygame.font.Font = pygame.font.Font(pygame.font.get_default_font(), 14)
+        # Maps a card int to its sprite index (the sprite sheet is laid out in rows of suits, ordered by `suits`)
+        self.sprite_index: list[int] = [suits.index(card_suits[card_suit(card)]) * 13 + card_rank(card) for card in range(DECK_SIZE)]
+
+        self.background: pygame.Surface = pygame.Surface(window_size)
+        self.background.fill(BACKGROUND_COLOR)
+        self.background.blit(sprites.table_image, sprites.table_image.get_rect(center=self.background.get_rect().center).move(0, -7))
+        self.canvas: pygame.Surface = self.background.copy()
+        self.bounds: pygame.Rect = self.canvas.get_rect()
+
+        self.glyphs: dict[tuple[str, tuple[int, int, int]], pygame.Surface] = {}
+        # Region name -> (contents key, area last drawn)
+        self.regions: dict[Hashable, tuple[Hashable, Optional[pygame.Rect]]] = {}
+        self.num_players: int = 0
+        # RGB frame (height, width, 3) reused by frame(), and the canvas areas it is missing
+        self.frame_buffer: np.ndarray = np.empty((window_size[1], window_size[0], 3), dtype=np.uint8)
+        self.pending: list["pygame.Rect"] = [self.bounds.copy()]
+
+    def text(self, text: str, color: tuple[int, int, int]) -> "pygame.Surface":
+        """Render a line of text, reusing the surface from the last time the same text was drawn."""
+        key = (text, color)
+        glyph = self.glyphs.get(key)
+        if glyph is None:
+            if len(self.glyphs) >= MAX_GLYPHS:
+                self.glyphs.clear()
+            glyph = self.font.render(text, True, color, None)
+            self.glyphs[key] = glyph
+        return glyph
+
+    def draw(self, game: PokerGame) -> list["pygame.Rect"]:
+        """Bring the canvas up to date with the game's state, returning the areas that changed."""
+        if len(game.players) != self.num_players:
+            # The seat layout depends on the number of players, so start again from an empty table
+            self.canvas.blit(self.background, (0, 0))
+            self.regions.clear()
+            self.num_players = len(game.players)
+            self.pending = [self.bounds.copy()]
+        dirty: list["pygame.Rect"] = []
+        center = self.bounds.center
+
+        def draw_board() -> list["pygame.Rect"]:
+            return [self._blit_card(card, (center[0] - 80 + 32 * index, center[1] - 16)) for index, card in enumerate(game.community_cards)]
+        self._update("board", tuple(game.community_cards), draw_board, dirty)
+
+        offsets = self.sprites.player_offsets[len(game.players)]
+        for idx, player in enumerate(game.players):
+            hand_rank = game.player_hand_rank(idx) if idx < len(game.active_players) and game.active_players[idx] else None
+            lines = (f"{player.name} ({player.seat})", f"BR: {player.bankroll}", f"Bet: {player.round_contribution}", f"Rank: {hand_rank[0] if hand_rank else 'N/A'}")
+            cards = tuple(player.cards)
+
+            def draw_player(offset=offsets[idx], lines=lines, cards=cards) -> list["pygame.Rect"]:
+                drawn = [self.canvas.blit(self.text(line, PLAYER_TEXT_COLOR), offset.move(0, 14 * row)) for row, line in enumerate(lines)]
+                drawn.extend(self._blit_card(card, offset.move(32 * index, 56).topleft) for index, card in enumerate(cards))
+                return drawn
+            self._update(("player", idx), (lines, cards), draw_player, dirty)
+
+        for region, label, dy in (("round", game.round.name, -30), ("pots", f"{game.round_pot} | {game.community_pot}", 30)):
+            def draw_label(label=label, dy=dy) -> list["pygame.Rect"]:
+                glyph = self.text(label, TABLE_TEXT_COLOR)
+                return [self.canvas.blit(glyph, glyph.get_rect(center=center).move(0, dy))]
+            self._update(region, label, draw_label, dirty)
+
+        self.pending.extend(dirty)
+        if len(self.pending) > MAX_PENDING_REGIONS:
+            self.pending = [self.bounds.copy()]
+        return dirty
+
+    def frame(self) -> np.ndarray:
+        """
+        Get the canvas as an RGB array of shape (height, width, 3).
+
+        Only the areas changed since the last call are copied, into an array that is reused (and overwritten) by every call.
+        """
+        import pygame
+
+        pixels = pygame.surfarray.pixels3d(self.canvas)  # (width, height, 3) view that locks the canvas while it exists
+        for rect in self.pending:
+            rect = rect.clip(self.bounds)
+            self.frame_buffer[rect.top:rect.bottom, rect.left:rect.right] = pixels[rect.left:rect.right, rect.top:rect.bottom].transpose(1, 0, 2)
+        del pixels
+        self.pending = []
+        return self.frame_buffer
+
+    def _blit_card(self, card: int, position: tuple[int, int]) -> "pygame.Rect":
+        return self.canvas.blit(self.sprites.cards[self.sprite_index[card]], position)
+
+    def _update(self, region: Hashable, key: Hashable, draw: Callable[[], list["pygame.Rect"]], dirty: list["pygame.Rect"]) -> None:
+        """Redraw a region if its contents key changed: restore the background where it was drawn last time, then draw it again."""
+        previous = self.regions.get(region)
+        if previous is not None and previous[0] == key:
+            return
+        previous_area = previous[1] if previous is not None else None
+        if previous_area is not None:
+            self.canvas.blit(self.background, previous_area, previous_area)
+        drawn = draw()
+        area = drawn[0].unionall(drawn[1:]) if drawn else None
+        self.regions[region] = (key, area)
+        if area is not None and previous_area is not None:
+            dirty.append(area.union(previous_area))
+        elif area is not None or previous_area is not None:
+            dirty.append(area or previous_area)  # type: ignore
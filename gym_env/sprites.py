@@ -0,0 +1,69 @@
+import logging
+import os
+from typing import Optional
+
+log = logging.getLogger(__name__)
+
+# Found relative to the package so envs can be created from any working directory
+SPRITE_DIR: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sprites", "png")
+
+
+class Sprites:
+    """
+    Images and table layout used to render `TexasHoldemEnv`.
+
+    Loading imports pygame, so this should only be built once rendering is actually requested (see `get_sprites()`).
+    """
+
+    def __init__(self):
+        import pygame
+
+        # Fonts are needed for rgb_array rendering too, which never opens a display
+        pygame.font.init()
+        self.table_image: pygame.Surface = pygame.transform.scale_by(pygame.image.load(os.path.join(SPRITE_DIR, "table.png")), 5.0)
+        cards_spritesheet = pygame.image.load(os.path.join(SPRITE_DIR, "Card_Sheet.png"))
+        self.cards: list[pygame.Surface] = []
+        for y in range(0, 128, 32):
+            for x in range(0, 416, 32):
+                card_image = pygame.Surface((32, 32), pygame.SRCALPHA)
+                card_image.blit(cards_spritesheet, (0, 0), (x, y, x + 32, y + 32))
+                self.cards.append(card_image)
+
+        one_of_one_bottom = pygame.Rect(320, 384, 128, 128)
+        one_of_one_top = pygame.Rect(320, 0, 128, 128)
+        left = pygame.Rect(0, 192, 128, 128)
+        right = pygame.Rect(640, 192, 128, 128)
+        one_of_two_top = pygame.Rect(220, 0, 128, 128)
+        two_of_two_top = pygame.Rect(420, 0, 128, 128)
+        one_of_two_bottom = pygame.Rect(220, 384, 128, 128)
+        two_of_two_bottom = pygame.Rect(420, 384, 128, 128)
+        one_of_three_top = pygame.Rect(170, 0, 128, 128)
+        two_of_three_top = pygame.Rect(320, 0, 128, 128)
+        three_of_three_top = pygame.Rect(470, 0, 128, 128)
+        one_of_three_bottom = pygame.Rect(170, 384, 128, 128)
+        two_of_three_bottom = pygame.Rect(320, 384, 128, 128)
+        three_of_three_bottom = pygame.Rect(470, 384, 128, 128)
+
+        self.player_offsets: list[list[pygame.Rect]] = [
+            [pygame.Rect(0, 0, 0, 0)], [pygame.Rect(0, 0, 0, 0)],
+            [one_of_one_bottom, one_of_one_top],
+            [one_of_one_bottom, left, right],
+            [one_of_one_bottom, left, one_of_one_top, right],
+            [one_of_one_bottom, left, one_of_two_top, two_of_two_top, right],
+            [one_of_two_bottom, left, one_of_two_top, two_of_two_top, right, two_of_two_bottom],
+            [one_of_two_bottom, left, one_of_three_top, two_of_three_top, three_of_three_top, right, two_of_two_bottom],
+            [two_of_three_bottom, one_of_three_bottom, left, one_of_three_top, two_of_three_top, three_of_three_top, right, three_of_three_bottom]
+        ]
+        log.debug(f"Loaded sprites from {SPRITE_DIR}")
+
+
+# Shared by every rendering env in the process
+_sprites: Optional[Sprites] = None
+
+
+def get_sprites() -> Sprites:
+    """Get the process-wide sprites, loading pygame and the sprite files on first use."""
+    global _sprites
+    if _sprites is None:
+        _sprites = Sprites()
+    return _sprites
@@ -0,0 +1,210 @@
+from typing import Optional
+import argparse
+import logging
+
+import numpy as np
+
+from gymnasium import spaces
+from gymnasium.utils import seeding
+from gymnasium.vector import VectorEnv, AutoresetMode
+from gymnasium.vector.utils import batch_space
+
+from batched_poker import BatchedPokerGame, NUM_DECISIONS
+from equity import simulate_equity_batch
+from agents.player import Player
+from agents.random_player import RandomPlayer
+from gym_env.encoder import BatchObservationEncoder, ObservationLayout, OBS_FLAT, OBS_TUPLE
+from preflop import preflop_equity_batch
+from util import ColoredFormatter, PlayerAction, Round
+
+log = logging.getLogger(__name__)
+
+
+class TexasHoldemVectorEnv(VectorEnv):
+    """
+    Runs `num_envs` independent Texas Hold'em tables in lockstep on top of a `BatchedPokerGame`.
+
+    Each table seats one learning agent at `learner_seat` and `num_players` - 1 autoplay opponents that pick uniformly random
+    legal moves (like `RandomPlayer`). Observations and rewards follow `TexasHoldemEnv`, batched over tables, and `info["legal_moves"]`
+    is a (num_envs, 3) mask of legal FOLD / CHECK_CALL / RAISE actions. Opponents are played out on reset and after every step,
+    so the learner is always the current player of a running table. A table terminates as soon as the learner is out of chips,
+    rather than playing the remaining opponents out (the reward is the same either way).
+
+    Table i reset with seed s draws the same decks as a `TexasHoldemEnv` reset with seed s + i. Pass `parity_check=True` to mirror
+    every table with a scalar `PokerGame` and raise as soon as the two disagree. With `observation_mode=OBS_FLAT`, observations are
+    a reused (num_envs, obs_dim) float32 array in the layout of `TexasHoldemEnv`'s flat observations. With `equity_samples` > 0,
+    observations end with the learner's equity like `TexasHoldemEnv`'s, estimated for every table in one batch of runouts.
+    """
+
+    metadata = {"render_modes": [], "autoreset_mode": AutoresetMode.NEXT_STEP}
+
+    def __init__(self, num_envs: int, initial_bankroll: int, small_blind: int, big_blind: int, num_players: int, learner_seat: int = 0, parity_check: bool = False,
+                 observation_mode: str = OBS_TUPLE, equity_samples: int = 0):
+        self.num_envs = num_envs
+        self.num_players: int = num_players
+        self.learner_seat: int = learner_seat
+        self.game = BatchedPokerGame(num_envs, num_players, initial_bankroll, small_blind, big_blind, parity_check=parity_check)
+        self.opponent_rng: np.random.Generator = np.random.default_rng()
+        # Number of Monte-Carlo runouts per table for the equity observation (0 leaves equity out of the observation)
+        self.equity_samples: int = equity_samples
+        self.equity_rng: np.random.Generator = np.random.default_rng()
+        self.bankroll_bucket: int = num_players * initial_bankroll // 10
+
+        self.single_action_space = spaces.Discrete(len(PlayerAction) - 2)
+        self.action_space = batch_space(self.single_action_space, num_envs)
+        if observation_mode not in (OBS_TUPLE, OBS_FLAT):
+            raise ValueError(f"Unknown observation mode {observation_mode!r}")
+        self.encoder: Optional[BatchObservationEncoder] = None
+        if observation_mode == OBS_FLAT:
+            self.encoder = BatchObservationEncoder(ObservationLayout(num_players, initial_bankroll, equity=equity_samples > 0), num_envs)
+            self.single_observation_space = self.encoder.layout.space
+        else:
+            self.single_observation_space = spaces.Tuple(
+                (
+                    spaces.Discrete(1, start=num_players),  # number of players
+                    spaces.Discrete(num_players, start=0),  # current player
+                    spaces.Discrete(self.bankroll_bucket),  # current player bankroll
+                    spaces.Discrete(11),  # current hand rank (0 before the flop, then 1 = high card ... 10 = royal flush)
+                    spaces.Discrete(len(Round)),  # current round
+                    *([spaces.Discrete(10)] if equity_samples > 0 else []),  # current player equity (in tenths)
+                )
+            )
+        self.observation_space = batch_space(self.single_observation_space, num_envs)
+
+        self.autoreset: np.ndarray = np.zeros(num_envs, dtype=bool)
+        self.legal_moves: np.ndarray = np.ones((num_envs, NUM_DECISIONS), dtype=bool)
+
+    def _get_obs(self):
+        tables = self.game.tables
+        current = self.game.current_player_idx
+        self.legal_moves = self.game.determine_legal_moves()
+        equity = self._get_equity() if self.equity_samples > 0 else None
+        if self.encoder is not None:
+            return self.encoder.encode(self.game, self.legal_moves, equity)
+        return (
+            np.full(self.num_envs, self.num_players, dtype=np.int64),  # number of players
+            current.astype(np.int64),  # current player
+            self.game.bankrolls[tables, current] // self.bankroll_bucket,  # current player bankroll
+            self.game.hand_rank_index(),  # current hand rank
+            self.game.round.astype(np.int64),  # current round
+            *([np.minimum((equity * 10).astype(np.int64), 9)] if equity is not None else []),  # current player equity
+        )
+
+    def _get_equity(self) -> np.ndarray:
+        """
+        The current player's equity against the other active players on every table, like `TexasHoldemEnv._get_equity()`.
+
+        Tables are grouped by board size and number of opponents, and each group is simulated in one batch. Finished tables get 0.
+        """
+        game = self.game
+        equity = np.zeros(self.num_envs, dtype=np.float64)
+        hole_cards = game.hole_cards[game.tables, game.current_player_idx]
+        playing = ~game.done & (hole_cards[:, 0] >= 0)
+        opponents = np.maximum(game.active_players.sum(axis=1) - 1, 1)
+        preflop = playing & (game.num_community_cards == 0)
+        if preflop.any():
+            equity[preflop] = preflop_equity_batch(hole_cards[preflop], opponents[preflop] + 1)
+        for known in (3, 4, 5):
+            for count in np.unique(opponents[playing & (game.num_community_cards == known)]):
+                group = playing & (game.num_community_cards == known) & (opponents == count)
+                equity[group] = simulate_equity_batch(hole_cards[group], game.community_cards[group, :known], int(count), self.equity_samples, self.equity_rng)
+        return equity
+
+    def _get_info(self) -> dict:
+        return {'legal_moves': self.legal_moves}
+
+    def _learner_busted(self) -> np.ndarray:
+        """Tables where the learner has run out of chips and can no longer act, so the game is lost for it."""
+        return ~self.game.done & (self.game.bankrolls[:, self.learner_seat] == 0) & ~self.game.active_players[:, self.learner_seat]
+
+    def _play_opponents(self, mask: np.ndarray) -> None:
+        """Let the autoplay opponents act on the masked tables until it is the learner's turn, the learner is out or the game is over."""
+        while True:
+            waiting = mask & ~self.game.done & ~self._learner_busted() & (self.game.current_player_idx != self.learner_seat)
+            if not waiting.any():
+                return
+            legal = self.game.determine_legal_moves()
+            actions = np.argmax(self.opponent_rng.random(legal.shape) * legal, axis=1)
+            self.game.do_step(actions, waiting)
+
+    def reset(self, *, seed: Optional[int] = None, options: Optional[dict] = None):  # type: ignore
+        super().reset(seed=seed)
+        if seed is not None:
+            self.game.set_rngs([seeding.np_random(seed + table)[0] for table in range(self.num_envs)])
+            self.opponent_rng = np.random.default_rng([seed, self.num_envs])
+            self.equity_rng = np.random.default_rng([seed, self.num_envs, 1])
+        everything = np.ones(self.num_envs, dtype=bool)
+        self.game.reset(everything)
+        self._play_opponents(everything)
+        self.autoreset[:] = False
+        return (self._get_obs(), self._get_info())
+
+    def step(self, actions):
+        actions = np.asarray(actions)
+        rewards = np.zeros(self.num_envs, dtype=np.float64)
+
+        # Tables that finished on the last step start a new game instead of taking the action
+        restarting = self.autoreset.copy()
+        if restarting.any():
+            self.game.reset(restarting)
+            self._play_opponents(restarting)
+
+        stepping = ~restarting & ~self.game.done
+        illegal = stepping & ~self.legal_moves[self.game.tables, np.clip(actions, 0, NUM_DECISIONS - 1)]
+        if illegal.any():
+            log.warning(f"Illegal actions on {illegal.sum()} table(s)")
+        rewards[illegal] = -10.0
+        stepping &= ~illegal
+        rewards[stepping & (actions == PlayerAction.FOLD.value)] = -5.0
+        self.game.do_step(actions, stepping)
+        self._play_opponents(stepping)
+
+        terminated = self.game.done | self._learner_busted()
+        payout = float(self.game.initial_bankroll * self.num_players)
+        rewards[terminated] = np.where(self.game.winner[terminated] == self.learner_seat, payout, -payout)
+        self.autoreset = terminated
+        # Observation, reward, terminated, truncated, info
+        return (self._get_obs(), rewards, terminated, np.zeros(self.num_envs, dtype=bool), self._get_info())
+
+
+def run_seed_parity_check(num_envs: int, num_players: int, seed: int, equity_samples: int = 0) -> None:
+    """
+    Check that table i of a `TexasHoldemVectorEnv` reset with `seed` shuffles the same deck and deals the same hole cards as a
+    `TexasHoldemEnv` (with the same options) reset with `seed` + i, raising on the first table that differs.
+    """
+    from gym_env.env import TexasHoldemEnv
+
+    vector_env = TexasHoldemVectorEnv(num_envs, 100, 2, 5, num_players, equity_samples=equity_samples)
+    vector_env.reset(seed=seed)
+    for table in range(num_envs):
+        env = TexasHoldemEnv(100, 2, 5, [Player("Learner", False)] + [RandomPlayer() for _ in range(num_players - 1)], equity_samples=equity_samples)
+        env.reset(seed=seed + table)
+        if not np.array_equal(env.game.deck, vector_env.game.deck[table]):
+            raise AssertionError(f"Table {table} shuffled {vector_env.game.deck[table].tolist()}, TexasHoldemEnv with seed {seed + table} shuffled {env.game.deck.tolist()}")
+        hole_cards = [player.cards for player in env.game.players]
+        if hole_cards != vector_env.game.hole_cards[table].tolist():
+            raise AssertionError(f"Table {table} dealt {vector_env.game.hole_cards[table].tolist()}, TexasHoldemEnv with seed {seed + table} dealt {hole_cards}")
+        env.close()
+    vector_env.close()
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Check that the vector env's tables deal like TexasHoldemEnv reset with the same seeds.")
+    parser.add_argument("--envs", type=int, default=16)
+    parser.add_argument("--players", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 7, 1234])
+    parser.add_argument("--equity-samples", type=int, nargs="+", default=[0, 16])
+    args = parser.parse_args()
+
+    for num_players in args.players:
+        for equity_samples in args.equity_samples:
+            for seed in args.seeds:
+                run_seed_parity_check(args.envs, num_players, seed, equity_samples)
+        log.info(f"{num_players} players: {args.envs} tables deal like TexasHoldemEnv for seeds {args.seeds} (equity samples {args.equity_samples})")
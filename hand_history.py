@@ -0,0 +1,445 @@
+import argparse
+import json
+import logging
+import os
+import time
+from typing import BinaryIO, Iterable, Iterator, Optional
+
+import numpy as np
+
+from agents.player import Player
+from events import GameEvent, HandStartEvent, DealEvent, BlindEvent, ActionEvent, RoundStartEvent, ShowdownEvent, log_event
+from poker import PokerGame
+from util import ColoredFormatter, PlayerAction, Round, DECK_SIZE
+
+log = logging.getLogger(__name__)
+
+# A shard is a directory holding two append-only files of fixed-size little-endian records plus a small metadata file:
+# - hands.bin: one HAND_DTYPE record per finished hand
+# - actions.bin: the ACTION_DTYPE records of every hand, in order (hand i owns actions[action_start:action_start + num_actions])
+# - meta.json: format version and the blinds the hands were played with
+FORMAT_VERSION: int = 1
+MAX_SEATS: int = 8
+NO_CARD: int = -1
+
+HAND_DTYPE = np.dtype([
+    ('action_start', '<u8'),  # Index of the hand's first action in actions.bin
+    ('num_actions', '<u2'),  # Including the blinds
+    ('num_players', 'u1'),
+    ('dealer', 'u1'),
+    ('num_board', 'u1'),
+    ('winners', 'u1'),  # Bitmask of winning seats
+    ('pot', '<i4'),  # Community pot at showdown
+    ('share', '<i4'),  # Chips won by each winner
+    ('bankrolls', '<i4', (MAX_SEATS,)),  # Bankrolls at the start of the hand
+    ('hole_cards', 'i1', (MAX_SEATS, 2)),  # NO_CARD for empty/busted seats
+    ('board', 'i1', (5,)),  # NO_CARD for cards that weren't dealt
+])
+
+ACTION_DTYPE = np.dtype([
+    ('seat', 'u1'),
+    ('action', 'u1'),  # PlayerAction value
+    ('round', 'u1'),  # Round value
+    ('amount', '<i4'),  # Chips put into the pot by the action
+])
+
+HANDS_FILE: str = "hands.bin"
+ACTIONS_FILE: str = "actions.bin"
+META_FILE: str = "meta.json"
+
+
+def _read_meta(path: str) -> dict:
+    with open(os.path.join(path, META_FILE)) as f:
+        meta: dict = json.load(f)
+    if meta.get('version') != FORMAT_VERSION:
+        raise ValueError(f"Hand history {path} has format version {meta.get('version')}, expected {FORMAT_VERSION}")
+    return meta
+
+
+def _open_records(path: str, dtype: np.dtype) -> np.ndarray:
+    """Memory-map a record file read-only, ignoring a partially written trailing record."""
+    count: int = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if count == 0:
+        # np.memmap can't map an empty file
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+
+
+class HandHistoryWriter:
+    """
+    Records every hand a `PokerGame` plays to a hand-history shard (see `HAND_DTYPE`), as a subscriber to the game's events.
+
+    Records are collected in preallocated buffers and appended to disk every `buffer_size` hands, so recording doesn't touch
+    the disk on every step. Opening an existing shard appends to it. Hands that are interrupted by a reset are dropped.
+    Each parallel worker should write its own shard; `merge_shards()` combines them afterwards.
+
+    The writer's position is kept in the game's snapshots, so `PokerGame.undo()` and `restore()` take back whatever was recorded
+    since (truncating the shard's files if it was already flushed). Only snapshots of states the recording has passed through can
+    be restored - not one taken on a line of play that was itself taken back afterwards.
+    """
+
+    def __init__(self, path: str, small_blind: int, big_blind: int, buffer_size: int = 4096):
+        self.path: str = path
+        os.makedirs(path, exist_ok=True)
+        meta = {'version': FORMAT_VERSION, 'small_blind': small_blind, 'big_blind': big_blind}
+        if os.path.exists(os.path.join(path, META_FILE)):
+            existing = _read_meta(path)
+            if existing != meta:
+                raise ValueError(f"Cannot append to hand history {path}: it was recorded with {existing}, not {meta}")
+        else:
+            with open(os.path.join(path, META_FILE), "w") as f:
+                json.dump(meta, f)
+
+        self.hands_file: BinaryIO = open(os.path.join(path, HANDS_FILE), "ab")
+        self.actions_file: BinaryIO = open(os.path.join(path, ACTIONS_FILE), "ab")
+        # Continue action offsets after whatever the shard already holds
+        self.actions_written: int = os.path.getsize(os.path.join(path, ACTIONS_FILE)) // ACTION_DTYPE.itemsize
+        self.hands_written: int = os.path.getsize(os.path.join(path, HANDS_FILE)) // HAND_DTYPE.itemsize
+        self.hands: np.ndarray = np.zeros(buffer_size, dtype=HAND_DTYPE)
+        self.actions: np.ndarray = np.zeros(buffer_size * 16, dtype=ACTION_DTYPE)
+        self.num_hands: int = 0
+        self.num_actions: int = 0
+
+        # The hand being played - written into self.hands[self.num_hands] once it finishes
+        self.in_hand: bool = False
+        self.hand_action_start: int = 0
+        self.hand_pot: int = 0
+        self.round: Round = Round.PREFLOP
+
+    def attach(self, game: PokerGame) -> None:
+        """Start recording the hands played by a game."""
+        game.events.subscribe(self)
+
+    def detach(self, game: PokerGame) -> None:
+        """Stop recording a game's hands."""
+        game.events.unsubscribe(self)
+
+    def snapshot_state(self) -> tuple:
+        # Records before the current hand's never change, so only the hand being played (and its buffered actions) is copied
+        start: int = self.actions_written + self.num_actions
+        if self.in_hand:
+            start = max(self.hand_action_start, self.actions_written)
+        buffered = self.actions[start - self.actions_written:self.num_actions].copy()
+        return (self.hands_written + self.num_hands, start, buffered, self.in_hand, self.hand_action_start, self.hand_pot, self.round,
+                self.hands[self.num_hands].copy())
+
+    def restore_state(self, state: tuple) -> None:
+        num_hands, start, buffered, self.in_hand, self.hand_action_start, self.hand_pot, self.round, record = state
+        if self.actions_written > start or self.hands_written > num_hands:
+            # Records made after the snapshot were flushed since - take them back out of the files
+            self.flush()
+            self.hands_file.truncate(num_hands * HAND_DTYPE.itemsize)
+            self.actions_file.truncate(start * ACTION_DTYPE.itemsize)
+            self.hands_written, self.actions_written = num_hands, start
+        self.num_hands = num_hands - self.hands_written
+        self.num_actions = start - self.actions_written + len(buffered)
+        self.actions[self.num_actions - len(buffered):self.num_actions] = buffered
+        self.hands[self.num_hands] = record
+
+    def __call__(self, event: GameEvent) -> None:
+        if isinstance(event, HandStartEvent):
+            self._start_hand(event)
+        elif not self.in_hand:
+            return
+        elif isinstance(event, DealEvent):
+            record = self.hands[self.num_hands]
+            if event.seat is None:
+                num_board: int = int(record['num_board'])
+                record['board'][num_board:num_board + len(event.cards)] = event.cards
+                record['num_board'] = num_board + len(event.cards)
+            else:
+                record['hole_cards'][event.seat] = event.cards
+        elif isinstance(event, (BlindEvent, ActionEvent)):
+            if self.num_actions == len(self.actions):
+                self._flush_actions()
+            self.actions[self.num_actions] = (event.seat, event.action.value, self.round.value, event.amount)
+            self.num_actions += 1
+            self.hand_pot += event.amount
+        elif isinstance(event, RoundStartEvent):
+            self.round = event.round
+        elif isinstance(event, ShowdownEvent):
+            self._finish_hand(event)
+
+    def _start_hand(self, event: HandStartEvent) -> None:
+        if self.in_hand and self.hand_action_start >= self.actions_written:
+            # The previous hand never reached a showdown (the game was reset) - drop its buffered actions
+            # (any that were already flushed stay in the file, but no hand refers to them)
+            self.num_actions = self.hand_action_start - self.actions_written
+        record = self.hands[self.num_hands]
+        record['num_players'] = len(event.bankrolls)
+        record['dealer'] = event.dealer
+        record['num_board'] = 0
+        record['bankrolls'] = 0
+        record['bankrolls'][:len(event.bankrolls)] = event.bankrolls
+        record['hole_cards'] = NO_CARD
+        record['board'] = NO_CARD
+        self.hand_action_start = self.actions_written + self.num_actions
+        self.hand_pot = 0
+        self.round = Round.PREFLOP
+        self.in_hand = True
+
+    def _finish_hand(self, event: ShowdownEvent) -> None:
+        record = self.hands[self.num_hands]
+        start: int = self.hand_action_start
+        end: int = self.actions_written + self.num_actions
+        record['action_start'] = start
+        record['num_actions'] = end - start
+        record['winners'] = sum(1 << seat for seat in event.winners)
+        record['share'] = event.share
+        # Every chip put in during the hand ends up in the community pot
+        record['pot'] = self.hand_pot
+        self.in_hand = False
+        self.num_hands += 1
+        if self.num_hands == len(self.hands):
+            self.flush()
+
+    def _flush_actions(self) -> None:
+        self.actions[:self.num_actions].tofile(self.actions_file)
+        self.actions_written += self.num_actions
+        self.num_actions = 0
+
+    def flush(self) -> None:
+        """Append all buffered hands (and their actions) to the shard."""
+        self._flush_actions()
+        self.hands[:self.num_hands].tofile(self.hands_file)
+        self.hands_written += self.num_hands
+        self.num_hands = 0
+        self.hands_file.flush()
+        self.actions_file.flush()
+
+    def close(self) -> None:
+        """Flush the buffers and close the shard's files. A hand that is still being played is not recorded."""
+        self.flush()
+        self.hands_file.close()
+        self.actions_file.close()
+
+    def __enter__(self) -> "HandHistoryWriter":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class HandHistory:
+    """
+    Read-only, memory-mapped view of a hand-history shard.
+
+    `hands` and `actions` are structured arrays backed by the shard's files, so they can be scanned and filtered with NumPy without
+    reading the whole shard into memory, e.g. `history.hands[history.hands['num_board'] == 5]` for hands that reached the river.
+    """
+
+    def __init__(self, path: str):
+        self.path: str = path
+        meta = _read_meta(path)
+        self.small_blind: int = meta['small_blind']
+        self.big_blind: int = meta['big_blind']
+        self.actions: np.ndarray = _open_records(os.path.join(path, ACTIONS_FILE), ACTION_DTYPE)
+        hands = _open_records(os.path.join(path, HANDS_FILE), HAND_DTYPE)
+        # A writer that died mid-flush may have written hands without all of their actions
+        complete = len(hands)
+        while complete > 0 and int(hands[complete - 1]['action_start']) + int(hands[complete - 1]['num_actions']) > len(self.actions):
+            complete -= 1
+        self.hands: np.ndarray = hands[:complete]
+
+    def __len__(self) -> int:
+        return len(self.hands)
+
+    def hand_actions(self, index: int) -> np.ndarray:
+        """Get the actions of a hand, blinds included."""
+        start: int = int(self.hands[index]['action_start'])
+        return self.actions[start:start + int(self.hands[index]['num_actions'])]
+
+    def replay(self, index: int, subscribers: Iterable = ()) -> Iterator[PokerGame]:
+        """Replay a recorded hand (see `replay_hand()`)."""
+        return replay_hand(self.hands[index], self.hand_actions(index), self.small_blind, self.big_blind, subscribers)
+
+
+class ReplayGame(PokerGame):
+    """A `PokerGame` set up at the start of a recorded hand, which deals the recorded cards instead of shuffling."""
+
+    def __init__(self, hand: np.void, small_blind: int, big_blind: int):
+        super().__init__(0, small_blind, big_blind)
+        for seat in range(int(hand['num_players'])):
+            player = Player(f"Player {seat}", True)
+            player.seat = seat
+            player.bankroll = int(hand['bankrolls'][seat])
+            self.players.append(player)
+        self.dealer_idx = int(hand['dealer'])
+        # Cards are drawn in a fixed order: two for each player with chips (by seat), then the board
+        dealt = [int(card) for seat in range(len(self.players)) if self.players[seat].bankroll > 0 for card in hand['hole_cards'][seat]]
+        dealt.extend(int(card) for card in hand['board'][:int(hand['num_board'])])
+        rest = np.setdiff1d(np.arange(DECK_SIZE), dealt)
+        self.recorded_deck: np.ndarray = np.concatenate((np.array(dealt), rest)).astype(np.uint8)
+
+    def generate_deck(self) -> None:
+        self.deck = self.recorded_deck.copy()
+        self.deck_idx = 0
+
+
+def replay_hand(hand: np.void, actions: np.ndarray, small_blind: int, big_blind: int, subscribers: Iterable = ()) -> Iterator[PokerGame]:
+    """
+    Rebuild the game states of a recorded hand.
+
+    Yields the game before every decision after the blinds (with `legal_moves` set for the player to act), then once more after the
+    showdown. The same game object is updated in place, so copy anything that should outlive the next step. `subscribers` are
+    subscribed to the game's events before the hand starts. Raises `ValueError` if the replay doesn't match the record.
+    """
+    game = ReplayGame(hand, small_blind, big_blind)
+    for subscriber in subscribers:
+        game.events.subscribe(subscriber)
+    game.start_new_hand()
+    for index, (seat, action, _, amount) in enumerate(actions[2:], start=2):
+        if game.round == Round.SHOWDOWN:
+            raise ValueError(f"Replay reached the showdown before action {index} of {len(actions)}")
+        game.determine_legal_moves()
+        if game.current_player_idx != seat or PlayerAction(action) not in game.legal_moves:
+            raise ValueError(f"Replay diverged at action {index}: recorded {PlayerAction(action)} by seat {seat}, but seat {game.current_player_idx} is to act with {game.legal_moves}")
+        yield game
+        bankroll: int = game.players[seat].bankroll
+        game.process_decision(PlayerAction(action))
+        if bankroll - game.players[seat].bankroll != amount:
+            raise ValueError(f"Replay diverged at action {index}: recorded contribution {amount}, replayed {bankroll - game.players[seat].bankroll}")
+        game.next_player()
+    if game.round != Round.SHOWDOWN:
+        raise ValueError(f"Replay ran out of actions before the showdown ({len(actions)} recorded)")
+    game.end_hand()
+    if game.community_pot != int(hand['pot']):
+        raise ValueError(f"Replay ended with a pot of {game.community_pot}, recorded {int(hand['pot'])}")
+    yield game
+
+
+def _copy_records(source: str, dest: BinaryIO, dtype: np.dtype, count: int, chunk_size: int, offset: int = 0) -> None:
+    """Append the first `count` records of a file to an open file in chunks, shifting `action_start` by `offset` (hands only)."""
+    records = _open_records(source, dtype)
+    for start in range(0, count, chunk_size):
+        chunk = np.array(records[start:min(start + chunk_size, count)])
+        if offset:
+            chunk['action_start'] += offset
+        chunk.tofile(dest)
+
+
+def merge_shards(dest: str, sources: list[str], chunk_size: int = 1 << 20) -> int:
+    """
+    Merge hand-history shards (e.g. one per rollout worker) into a new shard, in the order given. Returns the number of hands merged.
+
+    Records are streamed through in chunks of `chunk_size`, so shards larger than memory can be merged.
+    """
+    if os.path.exists(os.path.join(dest, HANDS_FILE)):
+        raise FileExistsError(f"Hand history {dest} already exists")
+    metas = [_read_meta(source) for source in sources]
+    if any(meta != metas[0] for meta in metas):
+        raise ValueError(f"Cannot merge hand histories recorded with different settings: {metas}")
+    os.makedirs(dest, exist_ok=True)
+    with open(os.path.join(dest, META_FILE), "w") as f:
+        json.dump(metas[0], f)
+
+    merged_hands: int = 0
+    merged_actions: int = 0
+    with open(os.path.join(dest, HANDS_FILE), "wb") as hands_file, open(os.path.join(dest, ACTIONS_FILE), "wb") as actions_file:
+        for source in sources:
+            history = HandHistory(source)
+            # Only copy actions that belong to complete hands
+            num_actions: int = int(history.hands[-1]['action_start']) + int(history.hands[-1]['num_actions']) if len(history) else 0
+            _copy_records(os.path.join(source, ACTIONS_FILE), actions_file, ACTION_DTYPE, num_actions, chunk_size)
+            _copy_records(os.path.join(source, HANDS_FILE), hands_file, HAND_DTYPE, len(history), chunk_size, merged_actions)
+            merged_hands += len(history)
+            merged_actions += num_actions
+            log.info(f"Merged {len(history)} hands from {source}")
+    return merged_hands
+
+
+def verify_history(history: HandHistory, limit: Optional[int] = None) -> int:
+    """Replay the first `limit` hands of a history (all by default), raising `ValueError` on the first mismatch. Returns the number replayed."""
+    count: int = len(history) if limit is None else min(limit, len(history))
+    for index in range(count):
+        try:
+            for _ in history.replay(index):
+                pass
+        except ValueError as e:
+            raise ValueError(f"Hand {index}: {e}") from e
+    return count
+
+
+def run_undo_check(path: str, num_players: int, num_steps: int, undo_every: int, buffer_size: int, seed: int = 0) -> int:
+    """
+    Record a game of random moves to a new shard, undoing a step every `undo_every` steps, and verify every recorded hand.
+    A small `buffer_size` makes undo cross flushes too. Returns the number of hands recorded.
+    """
+    game = PokerGame(100, 2, 5)
+    for seat in range(num_players):
+        player = Player(f"Player {seat}", True)
+        player.seat = seat
+        game.players.append(player)
+    game.set_rng(np.random.default_rng(seed))
+    action_rng = np.random.default_rng(seed + 1)
+    game.set_undo_depth(1)
+    with HandHistoryWriter(path, game.small_blind, game.big_blind, buffer_size) as writer:
+        writer.attach(game)
+        game.reset()
+        for step in range(1, num_steps + 1):
+            if game.done:
+                game.reset()
+            game.determine_legal_moves()
+            game.do_step(game.legal_moves[action_rng.integers(len(game.legal_moves))])
+            if step % undo_every == 0:
+                game.undo()
+    return verify_history(HandHistory(path))
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Inspect, verify, replay or merge hand-history shards.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    info_parser = subparsers.add_parser("info", help="summarize a shard")
+    info_parser.add_argument("path")
+    verify_parser = subparsers.add_parser("verify", help="replay hands and check them against their records")
+    verify_parser.add_argument("path")
+    verify_parser.add_argument("--limit", type=int, default=None, help="hands to replay (default: all)")
+    replay_parser = subparsers.add_parser("replay", help="log a recorded hand as it is replayed")
+    replay_parser.add_argument("path")
+    replay_parser.add_argument("index", type=int)
+    merge_parser = subparsers.add_parser("merge", help="merge shards into a new shard")
+    merge_parser.add_argument("dest")
+    merge_parser.add_argument("sources", nargs="+")
+    undo_parser = subparsers.add_parser("check-undo", help="record a game that undoes steps into a new shard and verify it")
+    undo_parser.add_argument("path")
+    undo_parser.add_argument("--players", type=int, default=4)
+    undo_parser.add_argument("--steps", type=int, default=5000)
+    undo_parser.add_argument("--undo-every", type=int, default=7)
+    undo_parser.add_argument("--buffer-size", type=int, default=4, help="hands buffered between flushes (small, so undo crosses flushes)")
+    undo_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "info":
+        history = HandHistory(args.path)
+        log.info(f"{args.path}: {len(history)} hands, {len(history.actions)} actions (blinds {history.small_blind}/{history.big_blind})")
+        if len(history):
+            log.info(f"Hands reaching each street (preflop/flop/turn/river): {[int(np.count_nonzero(history.hands['num_board'] >= n)) for n in (0, 3, 4, 5)]}")
+            log.info(f"Mean pot: {history.hands['pot'].mean():.1f}")
+    elif args.command == "verify":
+        history = HandHistory(args.path)
+        start = time.perf_counter()
+        try:
+            count = verify_history(history, args.limit)
+        except ValueError as e:
+            log.error(str(e))
+            raise SystemExit(1)
+        log.info(f"Replayed {count} hands in {time.perf_counter() - start:.1f}s, all match their records")
+    elif args.command == "check-undo":
+        if os.path.exists(os.path.join(args.path, HANDS_FILE)):
+            raise SystemExit(f"Hand history {args.path} already exists")
+        count = run_undo_check(args.path, args.players, args.steps, args.undo_every, args.buffer_size, args.seed)
+        log.info(f"Recorded {count} hands while undoing every {args.undo_every} steps, all match their records")
+    elif args.command == "replay":
+        for _ in HandHistory(args.path).replay(args.index, [log_event]):
+            pass
+    else:
+        start = time.perf_counter()
+        count = merge_shards(args.dest, args.sources)
+        log.info(f"Merged {count} hands into {args.dest} in {time.perf_counter() - start:.1f}s")
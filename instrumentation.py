@@ -0,0 +1,61 @@
+import time
+from typing import Any, Callable
+
+# Phases of a TexasHoldemEnv step that PhaseTimer can tell apart
+DEALING: str = "dealing"
+BETTING: str = "betting"
+EVALUATION: str = "evaluation"
+OBSERVATION: str = "observation"
+AUTOPLAY: str = "autoplay"
+STEP: str = "step"
+
+
+class PhaseTimer:
+    """
+    Cumulative call counters and timers for phases of the game loop.
+
+    Timing is installed by replacing methods on a specific object with timed wrappers (see `install()`), so objects that are never
+    instrumented run exactly the code they did before. Each phase gets its call count, its total time (including phases nested
+    inside it) and its self time (excluding nested phases), so self times add up without double counting.
+    """
+
+    def __init__(self):
+        # phase -> [calls, total ns, self ns]
+        self.counters: dict[str, list[int]] = {}
+        self.stack: list[list[int]] = []
+        # Time since which the phase on top of the stack has been accumulating self time
+        self.mark: int = 0
+
+    def install(self, owner: Any, name: str, phase: str) -> None:
+        """Time every call of `owner.name` under `phase`, by shadowing the method with a wrapper on the instance."""
+        method: Callable = getattr(owner, name)
+        counter: list[int] = self.counters.setdefault(phase, [0, 0, 0])
+        stack = self.stack
+        clock = time.perf_counter_ns
+
+        def timed(*args, **kwargs):
+            start: int = clock()
+            if stack:
+                stack[-1][2] += start - self.mark
+            self.mark = start
+            stack.append(counter)
+            try:
+                return method(*args, **kwargs)
+            finally:
+                end: int = clock()
+                counter[0] += 1
+                counter[1] += end - start
+                counter[2] += end - self.mark
+                stack.pop()
+                self.mark = end
+
+        setattr(owner, name, timed)
+
+    def reset(self) -> None:
+        """Zero every counter (e.g. at the start of an episode)."""
+        for counter in self.counters.values():
+            counter[:] = [0, 0, 0]
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        """Get each phase's call count and total/self time in seconds."""
+        return {phase: {'calls': calls, 'total_s': total / 1e9, 'self_s': own / 1e9} for phase, (calls, total, own) in self.counters.items()}
@@ -0,0 +1,385 @@
+import argparse
+import bisect
+import itertools
+import logging
+import time
+from math import comb
+from typing import Sequence
+
+import numpy as np
+
+from util import ColoredFormatter, cards_to_str
+
+log = logging.getLogger(__name__)
+
+NUM_RANKS: int = 13
+NUM_SUITS: int = 4
+# Cards dealt in each round of Texas Hold'em: hole cards, flop, turn, river. The flop, turn and river are told apart, which is
+# what a betting policy needs - equity only depends on the board as a whole, so (2, 5) collapses far more river hands.
+HOLDEM_ROUNDS: tuple[int, ...] = (2, 3, 1, 1)
+# Bits per round in a suit's count key (so up to 7 cards per round)
+COUNT_BITS: int = 3
+# Bits per suit count key in a configuration code (4 rounds at most)
+KEY_BITS: int = 12
+MAX_ROUNDS: int = KEY_BITS // COUNT_BITS
+
+
+def _colex_tables() -> tuple[np.ndarray, list[list[int]]]:
+    """Colexicographic rank of every subset of the 13 ranks (as a bitmask) among subsets of its size, and the inverse per size."""
+    colex = np.zeros(1 << NUM_RANKS, dtype=np.int64)
+    unrank: list[list[int]] = [[0] * comb(NUM_RANKS, size) for size in range(NUM_RANKS + 1)]
+    for mask in range(1 << NUM_RANKS):
+        positions = [bit for bit in range(NUM_RANKS) if mask >> bit & 1]
+        index = sum(comb(position, i + 1) for i, position in enumerate(positions))
+        colex[mask] = index
+        unrank[len(positions)][index] = mask
+    return colex, unrank
+
+
+COLEX, COLEX_UNRANK = _colex_tables()
+COLEX_LIST: list[int] = COLEX.tolist()
+POPCOUNT: np.ndarray = np.array([bin(mask).count("1") for mask in range(1 << NUM_RANKS)], dtype=np.int64)
+
+
+def _compress(mask: int, free: int) -> int:
+    """Keep the bits of `mask` that are set in `free`, packed down to the low bits (like the PEXT instruction)."""
+    result: int = 0
+    position: int = 0
+    for bit in range(NUM_RANKS):
+        if free >> bit & 1:
+            if mask >> bit & 1:
+                result |= 1 << position
+            position += 1
+    return result
+
+
+def _expand(mask: int, free: int) -> int:
+    """Spread the low bits of `mask` onto the bits set in `free` (the inverse of `_compress()`, like PDEP)."""
+    result: int = 0
+    position: int = 0
+    for bit in range(NUM_RANKS):
+        if free >> bit & 1:
+            if mask >> position & 1:
+                result |= 1 << bit
+            position += 1
+    return result
+
+
+# Batched _compress() is done with lookups on the low 7 and high 6 rank bits: table[free bits << width | mask bits]
+LOW_BITS: int = 7
+HIGH_BITS: int = NUM_RANKS - LOW_BITS
+COMPRESS_LOW: np.ndarray = np.array([_compress(key & ((1 << LOW_BITS) - 1), key >> LOW_BITS) for key in range(1 << (2 * LOW_BITS))], dtype=np.int64)
+COMPRESS_HIGH: np.ndarray = np.array([_compress(key & ((1 << HIGH_BITS) - 1), key >> HIGH_BITS) for key in range(1 << (2 * HIGH_BITS))], dtype=np.int64)
+
+
+def _multiset_unrank(index: int, size: int, count: int) -> list[int]:
+    """Get the `count` values (descending) of the multiset over [0, size) with the given combinatorial index."""
+    values: list[int] = []
+    for i in range(count):
+        k = count - i
+        # Largest b with C(b, k) <= index; b runs over [k - 1, size + k - 2]
+        low, high = k - 1, size + k - 2
+        while low < high:
+            middle = (low + high + 1) // 2
+            if comb(middle, k) <= index:
+                low = middle
+            else:
+                high = middle - 1
+        index -= comb(low, k)
+        values.append(low - (k - 1))
+    return values
+
+
+class HandIndexer:
+    """
+    Perfect indexing of poker hands up to suit isomorphism (after Waugh, "A Fast and Optimal Hand Isomorphism Algorithm").
+
+    A hand is the cards dealt in each round so far (e.g. hole cards, then the flop, turn and river). Two hands get the same index
+    exactly when one can be turned into the other by relabelling suits and reordering cards within a round, and the indices of
+    each round are dense: [0, size(round)). `unindex()` gives back a representative hand of an index.
+
+    Each suit of a hand is described by the set of ranks it got in every round. Suits are put in a canonical order by their card
+    counts per round and then by the index of their rank sets; a hand's index combines which count pattern ("configuration")
+    its suits have with the multiset of rank-set indices of each group of suits sharing a count pattern.
+    """
+
+    def __init__(self, cards_per_round: Sequence[int] = HOLDEM_ROUNDS):
+        if any(not 0 < cards < 1 << COUNT_BITS for cards in cards_per_round) or not 0 < len(cards_per_round) <= MAX_ROUNDS:
+            raise ValueError(f"Hands must have 1-{MAX_ROUNDS} rounds of 1-{(1 << COUNT_BITS) - 1} cards each, got {cards_per_round}")
+        self.cards_per_round: tuple[int, ...] = tuple(cards_per_round)
+        self.rounds: int = len(cards_per_round)
+        self.round_starts: list[int] = [sum(cards_per_round[:r]) for r in range(self.rounds + 1)]
+
+        # Per-round tables, keyed by suit count keys (each round's count in COUNT_BITS bits, the first round most significant)
+        self.suit_sizes: list[np.ndarray] = []  # count key -> number of possible rank-set sequences for a suit
+        self.config_codes: list[np.ndarray] = []  # sorted codes of the 4 suits' count keys (descending) -> configuration
+        self.config_offsets: list[np.ndarray] = []
+        self.config_groups: list[list[list[tuple[int, int]]]] = []  # configuration -> [(count key, number of suits)]
+        self.sizes: list[int] = []
+        for r in range(self.rounds):
+            self._build_round(r)
+
+    def _count_key(self, counts: Sequence[int]) -> int:
+        key: int = 0
+        for count in counts:
+            key = key << COUNT_BITS | count
+        return key
+
+    def _key_counts(self, key: int, rounds: int) -> list[int]:
+        return [key >> (COUNT_BITS * (rounds - 1 - r)) & ((1 << COUNT_BITS) - 1) for r in range(rounds)]
+
+    def _build_round(self, r: int) -> None:
+        rounds = r + 1
+        suit_sizes = np.zeros(1 << (COUNT_BITS * rounds), dtype=np.int64)
+        for key in range(len(suit_sizes)):
+            used: int = 0
+            size: int = 1
+            for count in self._key_counts(key, rounds):
+                # Keys with more cards than ranks in a suit never occur
+                size *= comb(max(NUM_RANKS - used, 0), count)
+                used += count
+            suit_sizes[key] = size
+        self.suit_sizes.append(suit_sizes)
+
+        # Every way of splitting each round's cards between the suits, with the suits sorted into canonical order
+        splits = [[split for split in itertools.product(range(cards + 1), repeat=NUM_SUITS) if sum(split) == cards] for cards in self.cards_per_round[:rounds]]
+        configs: set[tuple[int, ...]] = set()
+        for per_round in itertools.product(*splits):
+            configs.add(tuple(sorted((self._count_key([split[suit] for split in per_round]) for suit in range(NUM_SUITS)), reverse=True)))
+        codes: list[int] = []
+        offsets: list[int] = []
+        groups: list[list[tuple[int, int]]] = []
+        total: int = 0
+        for config in sorted(configs, key=self._config_code):
+            config_groups = [(key, len(list(run))) for key, run in itertools.groupby(config)]
+            codes.append(self._config_code(config))
+            offsets.append(total)
+            groups.append(config_groups)
+            size: int = 1
+            for key, count in config_groups:
+                size *= comb(int(suit_sizes[key]) + count - 1, count)
+            total += size
+        self.config_codes.append(np.array(codes, dtype=np.int64))
+        self.config_offsets.append(np.array(offsets, dtype=np.int64))
+        self.config_groups.append(groups)
+        self.sizes.append(total)
+
+    def _config_code(self, keys: Sequence[int]) -> int:
+        code: int = 0
+        for key in keys:
+            code = code << KEY_BITS | key
+        return code
+
+    def size(self, round: int) -> int:
+        """Number of distinct hands (up to suit isomorphism) after the given round (0 = pre-flop)."""
+        return self.sizes[round]
+
+    def _round_of(self, num_cards: int) -> int:
+        if num_cards not in self.round_starts[1:]:
+            raise ValueError(f"{num_cards} cards don't make up a whole number of rounds of {self.cards_per_round}")
+        return self.round_starts.index(num_cards) - 1
+
+    def index(self, cards: Sequence[int]) -> int:
+        """Get the isomorphic index of a hand: hole cards followed by the board cards dealt so far, in dealing order."""
+        r = self._round_of(len(cards))
+        rounds = r + 1
+        sets = [[0] * rounds for _ in range(NUM_SUITS)]
+        for round_index in range(rounds):
+            for card in cards[self.round_starts[round_index]:self.round_starts[round_index + 1]]:
+                sets[card & 3][round_index] |= 1 << (card >> 2)
+
+        suits: list[tuple[int, int]] = []
+        for suit_sets in sets:
+            used: int = 0
+            index: int = 0
+            radix: int = 1
+            key: int = 0
+            for mask in suit_sets:
+                count = bin(mask).count("1")
+                index += COLEX_LIST[_compress(mask, ~used)] * radix
+                radix *= comb(NUM_RANKS - bin(used).count("1"), count)
+                used |= mask
+                key = key << COUNT_BITS | count
+            suits.append((key, index))
+        suits.sort(reverse=True)
+
+        config = int(np.searchsorted(self.config_codes[r], self._config_code([key for key, _ in suits])))
+        result: int = 0
+        position: int = 0
+        for key, count in self.config_groups[r][config]:
+            group: int = 0
+            for i in range(count):
+                group += comb(suits[position + i][1] + count - 1 - i, count - i)
+            result = result * comb(int(self.suit_sizes[r][key]) + count - 1, count) + group
+            position += count
+        return int(self.config_offsets[r][config]) + result
+
+    def unindex(self, round: int, index: int) -> list[int]:
+        """Get a representative hand (hole cards, then board cards in dealing order) of an isomorphic index."""
+        if not 0 <= index < self.sizes[round]:
+            raise ValueError(f"Index {index} is out of range for round {round} (size {self.sizes[round]})")
+        rounds = round + 1
+        config = bisect.bisect_right(self.config_offsets[round].tolist(), index) - 1
+        remainder = index - int(self.config_offsets[round][config])
+        groups = self.config_groups[round][config]
+        group_sizes = [comb(int(self.suit_sizes[round][key]) + count - 1, count) for key, count in groups]
+
+        cards: list[list[int]] = [[] for _ in range(rounds)]
+        suit: int = 0
+        for g, (key, count) in enumerate(groups):
+            stride: int = 1
+            for size in group_sizes[g + 1:]:
+                stride *= size
+            group, remainder = divmod(remainder, stride)
+            for suit_index in _multiset_unrank(group, int(self.suit_sizes[round][key]), count):
+                used: int = 0
+                for round_index, card_count in enumerate(self._key_counts(key, rounds)):
+                    choices = comb(NUM_RANKS - bin(used).count("1"), card_count)
+                    suit_index, colex = divmod(suit_index, choices)
+                    mask = _expand(COLEX_UNRANK[card_count][colex], ~used & ((1 << NUM_RANKS) - 1))
+                    cards[round_index].extend(rank * 4 + suit for rank in range(NUM_RANKS) if mask >> rank & 1)
+                    used |= mask
+                suit += 1
+        return [card for round_cards in cards for card in sorted(round_cards)]
+
+    def index_batch(self, cards: np.ndarray) -> np.ndarray:
+        """Index an (N, num_cards) array of hands at once (see `index()`), returning an int64 array of N indices."""
+        cards = np.asarray(cards, dtype=np.int64)
+        r = self._round_of(cards.shape[1])
+        rounds = r + 1
+        n = cards.shape[0]
+        rows = np.arange(n)
+
+        keys = np.zeros((n, NUM_SUITS), dtype=np.int64)
+        suit_indices = np.zeros((n, NUM_SUITS), dtype=np.int64)
+        used = np.zeros((n, NUM_SUITS), dtype=np.int64)
+        radix = np.ones((n, NUM_SUITS), dtype=np.int64)
+        for round_index in range(rounds):
+            masks = np.zeros((n, NUM_SUITS), dtype=np.int64)
+            for column in range(self.round_starts[round_index], self.round_starts[round_index + 1]):
+                masks[rows, cards[:, column] & 3] |= 1 << (cards[:, column] >> 2)
+            counts = POPCOUNT[masks]
+            used_count = POPCOUNT[used]
+            free = ~used & ((1 << NUM_RANKS) - 1)
+            low_free = free & ((1 << LOW_BITS) - 1)
+            compressed = COMPRESS_LOW[low_free << LOW_BITS | masks & ((1 << LOW_BITS) - 1)]
+            compressed |= COMPRESS_HIGH[(free >> LOW_BITS) << HIGH_BITS | masks >> LOW_BITS] << POPCOUNT[low_free]
+            suit_indices += COLEX[compressed] * radix
+            radix *= _comb_array(NUM_RANKS - used_count, counts)
+            used |= masks
+            keys = keys << COUNT_BITS | counts
+
+        # Canonical suit order: by count key, then rank-set index, both descending
+        order = np.argsort(-(keys << 40 | suit_indices), axis=1, kind="stable")
+        keys = np.take_along_axis(keys, order, axis=1)
+        suit_indices = np.take_along_axis(suit_indices, order, axis=1)
+        codes = keys[:, 0] << (3 * KEY_BITS) | keys[:, 1] << (2 * KEY_BITS) | keys[:, 2] << KEY_BITS | keys[:, 3]
+        config = np.searchsorted(self.config_codes[r], codes)
+
+        # Position of each suit within its group of suits with the same count key, and the group's size
+        same = keys[:, :, None] == keys[:, None, :]
+        group_count = same.sum(axis=2)
+        group_position = np.tril(same, k=-1).sum(axis=2)
+        first = group_position == 0
+        terms = _comb_array(suit_indices + group_count - 1 - group_position, group_count - group_position)
+        group_sizes = np.where(first, _comb_array(self.suit_sizes[r][keys] + group_count - 1, group_count), 1)
+        # Groups are combined in mixed radix, the first group being the most significant
+        strides = np.ones((n, NUM_SUITS), dtype=np.int64)
+        for position in range(NUM_SUITS - 2, -1, -1):
+            strides[:, position] = strides[:, position + 1] * group_sizes[:, position + 1]
+        return self.config_offsets[r][config] + (terms * strides).sum(axis=1)
+
+
+def _comb_array(n: np.ndarray, k: np.ndarray) -> np.ndarray:
+    """Element-wise C(n, k) for small k, 0 where k > n."""
+    n = np.asarray(n, dtype=np.int64)
+    k = np.broadcast_to(np.asarray(k, dtype=np.int64), n.shape)
+    result = np.ones(n.shape, dtype=np.int64)
+    for j in range(1, int(k.max(initial=0)) + 1):
+        step = j <= k
+        result = np.where(step, result * np.maximum(n - j + 1, 0) // j, result)
+    return result
+
+
+# Shared by every caller in the process, per round layout
+_indexers: dict[tuple[int, ...], HandIndexer] = {}
+
+
+def get_indexer(cards_per_round: Sequence[int] = HOLDEM_ROUNDS) -> HandIndexer:
+    """Get the process-wide hand indexer for a round layout, building its tables on first use."""
+    key = tuple(cards_per_round)
+    if key not in _indexers:
+        _indexers[key] = HandIndexer(key)
+    return _indexers[key]
+
+
+def run_checks(indexer: HandIndexer, num_hands: int, seed: int = 0) -> None:
+    """
+    Check the indexer on random hands of every round, raising on the first failure: indices are the same for suit relabellings
+    and reorderings within rounds, the batched path matches the scalar one, and `unindex()` round-trips.
+    """
+    rng = np.random.default_rng(seed)
+    permutations = list(itertools.permutations(range(NUM_SUITS)))
+    for r in range(indexer.rounds):
+        num_cards = indexer.round_starts[r + 1]
+        hands = np.argsort(rng.random((num_hands, 52)), axis=1)[:, :num_cards]
+        start = time.perf_counter()
+        batch = indexer.index_batch(hands)
+        batch_time = time.perf_counter() - start
+        if batch.min() < 0 or batch.max() >= indexer.size(r):
+            raise AssertionError(f"Round {r}: batched indices out of range")
+        start = time.perf_counter()
+        scalar = [indexer.index(hand) for hand in hands.tolist()]
+        scalar_time = time.perf_counter() - start
+        if scalar != batch.tolist():
+            raise AssertionError(f"Round {r}: index_batch() differs from index()")
+        # Relabel suits and shuffle cards within each round
+        relabelled = np.array(permutations)[rng.integers(len(permutations), size=num_hands)]
+        moved = (hands & ~3) | np.take_along_axis(relabelled, hands & 3, axis=1)
+        for round_index in range(r + 1):
+            block = moved[:, indexer.round_starts[round_index]:indexer.round_starts[round_index + 1]]
+            block[:] = np.take_along_axis(block, np.argsort(rng.random(block.shape), axis=1), axis=1)
+        if not np.array_equal(indexer.index_batch(moved), batch):
+            raise AssertionError(f"Round {r}: isomorphic hands got different indices")
+        for index in rng.integers(indexer.size(r), size=min(num_hands, 2000)).tolist():
+            hand = indexer.unindex(r, index)
+            if indexer.index(hand) != index:
+                raise AssertionError(f"Round {r}: unindex({index}) = {cards_to_str(hand)}, which indexes to {indexer.index(hand)}")
+        hands_total: int = 1
+        for round_index in range(r + 1):
+            hands_total *= comb(52 - indexer.round_starts[round_index], indexer.cards_per_round[round_index])
+        log.info(f"Round {r}: {indexer.size(r):,} classes ({hands_total:,} hands), "
+                 f"index {scalar_time * 1e6 / num_hands:.2f} us, index_batch {batch_time * 1e9 / num_hands:.0f} ns per hand")
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Check the suit-isomorphic hand indexer and measure its speed.")
+    parser.add_argument("--hands", type=int, default=20000, help="random hands checked per round")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rounds", type=int, nargs="+", default=list(HOLDEM_ROUNDS), help="cards dealt per round, e.g. 2 5 for hole cards plus a whole board")
+    parser.add_argument("--exhaustive", action="store_true", help="also check that every pre-flop and flop hand maps onto a dense range")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    indexer = get_indexer(args.rounds)
+    log.info(f"Built tables in {time.perf_counter() - start:.2f}s")
+    run_checks(indexer, args.hands, args.seed)
+    if args.exhaustive and indexer.cards_per_round[:2] == (2, 3):
+        hole = np.array(list(itertools.combinations(range(52), 2)))
+        if len(np.unique(indexer.index_batch(hole))) != indexer.size(0):
+            raise AssertionError("Pre-flop indices are not dense")
+        flops = np.array(list(itertools.combinations(range(52), 3)))
+        seen = np.zeros(indexer.size(1), dtype=bool)
+        for a, b in hole.tolist():
+            boards = flops[~np.isin(flops, (a, b)).any(axis=1)]
+            seen[indexer.index_batch(np.hstack((np.broadcast_to([a, b], (len(boards), 2)), boards)))] = True
+        if not seen.all():
+            raise AssertionError(f"{(~seen).sum()} flop indices are never reached")
+        log.info("Every pre-flop and flop index is reached")
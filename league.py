@@ -0,0 +1,302 @@
+import argparse
+import importlib
+import itertools
+import logging
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from functools import partial
+from typing import Callable, NamedTuple, Optional
+
+import multiprocessing as mp
+import numpy as np
+
+from agents.player import Player
+from events import GameEvent, HandStartEvent
+from gym_env.env import TexasHoldemEnv
+from rng_streams import EpisodeSeeds
+from util import ColoredFormatter
+
+log = logging.getLogger(__name__)
+
+# Makes a fresh agent for a seat - must be picklable (a Player subclass, or a functools.partial of one) to reach the workers
+AgentFactory = Callable[[], Player]
+
+# Sequential probability ratio test outcomes for the first seat of a seating
+STRONGER: str = "stronger"
+WEAKER: str = "weaker"
+UNDECIDED: str = "undecided"
+
+
+class BatchResult(NamedTuple):
+    """Per-seat totals of a batch of games played by one seating."""
+    seating: int
+    games: int
+    wins: np.ndarray  # (seats,) games won
+    draws: int  # Games stopped at the hand limit
+    hands: np.ndarray  # (seats,) hands each seat was dealt into
+    chips: np.ndarray  # (seats,) sum of per-hand chip results
+    chips_squared: np.ndarray  # (seats,) sum of squared per-hand chip results
+
+
+class HandTracker:
+    """Event subscriber collecting each seat's chip result for every finished hand."""
+
+    def __init__(self, num_seats: int):
+        self.hands: int = 0
+        self.bankrolls: Optional[tuple[int, ...]] = None
+        self.dealt: np.ndarray = np.zeros(num_seats, dtype=np.int64)
+        self.chips: np.ndarray = np.zeros(num_seats, dtype=np.int64)
+        self.chips_squared: np.ndarray = np.zeros(num_seats, dtype=np.int64)
+
+    def __call__(self, event: GameEvent) -> None:
+        if isinstance(event, HandStartEvent):
+            self.finish_hand(event.bankrolls)
+            self.bankrolls = event.bankrolls
+            self.hands += 1
+
+    def finish_hand(self, bankrolls: tuple[int, ...]) -> None:
+        """Record the hand that started with `self.bankrolls` and ended with `bankrolls`."""
+        if self.bankrolls is None:
+            return
+        start = np.array(self.bankrolls, dtype=np.int64)
+        delta = np.array(bankrolls, dtype=np.int64) - start
+        in_hand = start > 0
+        self.dealt += in_hand
+        self.chips += delta * in_hand
+        self.chips_squared += delta * delta * in_hand
+        self.bankrolls = None
+
+
+def play_batch(seating: int, factories: list[AgentFactory], seed: int, first_game: int, num_games: int, initial_bankroll: int, small_blind: int, big_blind: int, max_hands: int) -> BatchResult:
+    """
+    Play games `first_game` to `first_game + num_games - 1` of a seating with the agents seated in order (runs in a worker process).
+
+    Game g of seating s is keyed (seed, s, g) (see `rng_streams.EpisodeSeeds`), so its result doesn't depend on the batch it was played in.
+    """
+    logging.getLogger().setLevel(logging.ERROR)
+    env = TexasHoldemEnv(initial_bankroll, small_blind, big_blind, [factory() for factory in factories])
+    if not all(player.autoplay for player in env.game.players):
+        raise ValueError("League agents must play on their own (autoplay) - a QPlayer needs a policy path")
+    num_seats = len(factories)
+    wins = np.zeros(num_seats, dtype=np.int64)
+    hands = np.zeros(num_seats, dtype=np.int64)
+    chips = np.zeros(num_seats, dtype=np.int64)
+    chips_squared = np.zeros(num_seats, dtype=np.int64)
+    draws: int = 0
+    for game_index in range(first_game, first_game + num_games):
+        tracker = HandTracker(num_seats)
+        env.game.events.subscribe(tracker)
+        EpisodeSeeds(seed, seating, game_index).reset(env)
+        game = env.game
+        # The env's autoplay loop, but stopping at the hand limit (agents that never bust each other could otherwise play forever)
+        while not game.done and tracker.hands <= max_hands:
+            env.play_turn()
+        if game.done:
+            tracker.finish_hand(tuple(player.bankroll for player in game.players))
+            if game.winner is not None:
+                wins[game.winner] += 1
+        else:
+            draws += 1
+        game.events.unsubscribe(tracker)
+        hands += tracker.dealt
+        chips += tracker.chips
+        chips_squared += tracker.chips_squared
+    env.close()
+    return BatchResult(seating, num_games, wins, draws, hands, chips, chips_squared)
+
+
+class SeatingStats:
+    """
+    Running results of one seating, with a sequential probability ratio test on the first seat's win rate.
+
+    Once the test is decided, further batches are ignored, so the results describe exactly the games the decision was made on.
+    """
+
+    def __init__(self, names: tuple[str, ...], delta: float, alpha: float, beta: float):
+        self.names: tuple[str, ...] = names
+        num_seats = len(names)
+        self.games: int = 0
+        self.draws: int = 0
+        self.wins: np.ndarray = np.zeros(num_seats, dtype=np.int64)
+        self.hands: np.ndarray = np.zeros(num_seats, dtype=np.int64)
+        self.chips: np.ndarray = np.zeros(num_seats, dtype=np.int64)
+        self.chips_squared: np.ndarray = np.zeros(num_seats, dtype=np.int64)
+
+        # Wald's SPRT of "the first seat wins more than its fair share" (p1) against "less than its fair share" (p0)
+        fair: float = 1.0 / num_seats
+        self.p0: float = max(fair - delta, 1e-6)
+        self.p1: float = min(fair + delta, 1.0 - 1e-6)
+        self.upper: float = math.log((1.0 - beta) / alpha)
+        self.lower: float = math.log(beta / (1.0 - alpha))
+        self.llr: float = 0.0
+        self.decision: str = UNDECIDED
+
+    def add(self, result: BatchResult) -> None:
+        if self.decision != UNDECIDED:
+            return
+        self.games += result.games
+        self.draws += result.draws
+        self.wins += result.wins
+        self.hands += result.hands
+        self.chips += result.chips
+        self.chips_squared += result.chips_squared
+        # Drawn games say nothing about who is stronger
+        won = int(result.wins[0])
+        lost = result.games - result.draws - won
+        self.llr += won * math.log(self.p1 / self.p0) + lost * math.log((1.0 - self.p1) / (1.0 - self.p0))
+        if self.llr >= self.upper:
+            self.decision = STRONGER
+        elif self.llr <= self.lower:
+            self.decision = WEAKER
+
+    def win_rate(self, seat: int, z: float = 1.96) -> tuple[float, float, float]:
+        """Win rate of a seat over the decided (not drawn) games, like the SPRT, with a Wilson score interval: (rate, low, high)."""
+        n = self.games - self.draws
+        if n == 0:
+            return (0.0, 0.0, 1.0)
+        p = self.wins[seat] / n
+        center = (p + z * z / (2 * n)) / (1 + z * z / n)
+        half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        return (float(p), max(center - half, 0.0), min(center + half, 1.0))
+
+    def bb_per_100(self, seat: int, big_blind: int, z: float = 1.96) -> tuple[float, float]:
+        """Big blinds won per 100 hands by a seat, with the half-width of its normal confidence interval."""
+        n = int(self.hands[seat])
+        if n < 2:
+            return (0.0, math.inf)
+        mean = self.chips[seat] / n
+        variance = max(self.chips_squared[seat] / n - mean * mean, 0.0) * n / (n - 1)
+        return (100.0 * mean / big_blind, 100.0 * z * math.sqrt(variance / n) / big_blind)
+
+
+class League:
+    """
+    Plays matches between agents across a process pool.
+
+    `seatings` lists the agent names to seat at each table, e.g. [("q", "random"), ("random", "q")]. Each seating plays batches of
+    games until the SPRT on its first seat's win rate is settled (with indifference zone `delta` around the fair share and error
+    rates `alpha`/`beta`) or `max_games` have been played, so CPU isn't spent on matchups that are already decided. A seating's
+    batches are added in game order whichever worker finishes first, so its decision doesn't depend on scheduling, and batches
+    still in flight when it is settled are cancelled or ignored.
+    """
+
+    def __init__(self, agents: dict[str, AgentFactory], seatings: list[tuple[str, ...]], initial_bankroll: int = 100, small_blind: int = 2, big_blind: int = 5,
+                 batch_size: int = 20, max_games: int = 2000, max_hands: int = 1000, delta: float = 0.05, alpha: float = 0.05, beta: float = 0.05):
+        for seating in seatings:
+            if not 2 <= len(seating) <= 8:
+                raise ValueError(f"Seating {seating} must have 2-8 seats")
+            for name in seating:
+                if name not in agents:
+                    raise ValueError(f"Seating {seating} uses unknown agent {name!r}")
+        self.agents: dict[str, AgentFactory] = agents
+        self.seatings: list[tuple[str, ...]] = seatings
+        self.settings: tuple[int, int, int, int] = (initial_bankroll, small_blind, big_blind, max_hands)
+        self.big_blind: int = big_blind
+        self.batch_size: int = batch_size
+        self.max_games: int = max_games
+        self.stats: list[SeatingStats] = [SeatingStats(seating, delta, alpha, beta) for seating in seatings]
+
+    def _settled(self, seating: int, scheduled: int) -> bool:
+        return self.stats[seating].decision != UNDECIDED or scheduled >= self.max_games
+
+    def run(self, workers: Optional[int] = None, seed: int = 0) -> list[SeatingStats]:
+        """Play every seating until it is settled, keeping every worker busy with the seatings that aren't."""
+        scheduled = [0] * len(self.seatings)
+        in_flight: dict[Future, tuple[int, int]] = {}
+        # Per seating: the first game of the next batch to add, and finished batches waiting for earlier ones (by first game)
+        next_game = [0] * len(self.seatings)
+        finished: list[dict[int, BatchResult]] = [{} for _ in self.seatings]
+        next_seating = itertools.cycle(range(len(self.seatings)))
+        workers = workers or os.cpu_count() or 1
+        # Two batches per worker, so workers don't sit idle while results are collected
+        capacity: int = workers * 2
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) as pool:
+
+            def submit() -> bool:
+                for _ in range(len(self.seatings)):
+                    seating = next(next_seating)
+                    if self._settled(seating, scheduled[seating]):
+                        continue
+                    count = min(self.batch_size, self.max_games - scheduled[seating])
+                    factories = [self.agents[name] for name in self.seatings[seating]]
+                    in_flight[pool.submit(play_batch, seating, factories, seed, scheduled[seating], count, *self.settings)] = (seating, scheduled[seating])
+                    scheduled[seating] += count
+                    return True
+                return False
+
+            while len(in_flight) < capacity and submit():
+                pass
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    seating, first_game = in_flight.pop(future)
+                    stats = self.stats[seating]
+                    if stats.decision != UNDECIDED:
+                        continue
+                    finished[seating][first_game] = future.result()
+                    while next_game[seating] in finished[seating] and stats.decision == UNDECIDED:
+                        result = finished[seating].pop(next_game[seating])
+                        stats.add(result)
+                        next_game[seating] += result.games
+                    if stats.decision != UNDECIDED:
+                        log.info(f"{' vs '.join(self.seatings[seating])}: settled after {stats.games} games ({stats.decision})")
+                        finished[seating].clear()
+                        for other, (other_seating, _) in list(in_flight.items()):
+                            if other_seating == seating and other.cancel():
+                                del in_flight[other]
+                while len(in_flight) < capacity and submit():
+                    pass
+        return self.stats
+
+    def report(self) -> str:
+        lines: list[str] = []
+        for stats in self.stats:
+            lines.append(f"{' vs '.join(stats.names)}: {stats.games} games ({stats.draws} drawn), first seat {stats.decision}")
+            for seat, name in enumerate(stats.names):
+                rate, low, high = stats.win_rate(seat)
+                bb, half = stats.bb_per_100(seat, self.big_blind)
+                lines.append(f"  seat {seat} {name:>12}: win rate {rate:6.1%} [{low:.1%}, {high:.1%}] | {bb:+8.1f} +/- {half:.1f} bb/100 over {stats.hands[seat]} hands")
+        return "\n".join(lines)
+
+
+def parse_agent(spec: str) -> tuple[str, AgentFactory]:
+    """Parse "name=module:Class" or "name=module:Class:argument" (e.g. "q=agents.q:QPlayer:q_policy") into a named agent factory."""
+    name, _, target = spec.partition("=")
+    module_name, class_name, *arguments = target.split(":")
+    cls = getattr(importlib.import_module(module_name), class_name)
+    return name, partial(cls, *arguments) if arguments else cls
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Play a league between agents, stopping each matchup once it is statistically settled.")
+    parser.add_argument("--agent", dest="agents", action="append", required=True, help='agent as "name=module:Class[:argument]" (repeatable)')
+    parser.add_argument("--seating", dest="seatings", action="append", default=None, help='comma-separated agent names for one table (repeatable, default: every pair heads-up in both orders)')
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--batch-size", type=int, default=20, help="games per task")
+    parser.add_argument("--max-games", type=int, default=2000, help="games per seating if the test never settles")
+    parser.add_argument("--max-hands", type=int, default=1000, help="hands before a game is called a draw")
+    parser.add_argument("--delta", type=float, default=0.05, help="win rate difference from the fair share the test should detect")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    agents = dict(parse_agent(spec) for spec in args.agents)
+    if args.seatings:
+        seatings = [tuple(seating.split(",")) for seating in args.seatings]
+    else:
+        seatings = list(itertools.permutations(agents, 2))
+    league = League(agents, seatings, batch_size=args.batch_size, max_games=args.max_games, max_hands=args.max_hands, delta=args.delta, alpha=args.alpha, beta=args.beta)
+    start = time.perf_counter()
+    league.run(args.workers, args.seed)
+    log.info(f"League finished in {time.perf_counter() - start:.1f}s")
+    print(league.report())
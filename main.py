@@ -2,6 +2,7 @@ import logging
 import time
 import gymnasium as gym
 from util import ColoredFormatter
+from events import log_event
 from agents.random_player import RandomPlayer
 from agents.human_player import HumanPlayer
 from gym_env.env import TexasHoldemEnv  # noqa: F401
@@ -16,6 +17,8 @@ if __name__ == "__main__":
     log.addHandler(ch)
 
     env = gym.make('TexasHoldem-v0', render_mode="human", initial_bankroll=20, small_blind=2, big_blind=5, players=[HumanPlayer(), RandomPlayer(), RandomPlayer(), RandomPlayer()])
+    # Narrate the game through the logger
+    env.unwrapped.game.events.subscribe(log_event)  # type: ignore
     env.reset()
     obs, reward, done, truncated, info = env.step(None)
     print(f"Reward: {reward}")
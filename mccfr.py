@@ -0,0 +1,589 @@
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+import multiprocessing as mp
+import numpy as np
+
+from agents.player import Player
+from equity import evaluate_batch
+from events import GameEvent, HandStartEvent, ShowdownEvent
+from poker import PokerGame
+from util import ColoredFormatter, DECK_SIZE, PlayerAction
+
+log = logging.getLogger(__name__)
+
+# The solver plays the game's own action set: fold, check/call and the fixed 3 big blind raise
+ACTIONS: tuple[PlayerAction, ...] = (PlayerAction.FOLD, PlayerAction.CHECK_CALL, PlayerAction.RAISE)
+NUM_ACTIONS: int = len(ACTIONS)
+NUM_STREETS: int = 4
+# Preflop hands are bucketed exactly (the 169 starting hands), later streets by equity against a random hand
+NUM_PREFLOP_BUCKETS: int = 169
+POSITIONS: int = 2  # 0 = dealer (small blind, first to act preflop), 1 = big blind
+# Showdown results, indexing the last axis but one of `BettingTree.payoffs`
+DEALER_WINS, TIE, BIG_BLIND_WINS = range(3)
+
+FORMAT_VERSION: int = 1
+STRATEGY_FILE: str = "strategy.npy"
+META_FILE: str = "meta.json"
+CHECKPOINT_FILE: str = "checkpoint.npz"
+
+
+class Abstraction(NamedTuple):
+    """Game settings and card abstraction a solver is trained for - saved with checkpoints and exported policies."""
+    initial_bankroll: int = 100
+    small_blind: int = 2
+    big_blind: int = 5
+    postflop_buckets: int = 8
+    equity_samples: int = 64
+
+
+class _State(NamedTuple):
+    street: int
+    player: int
+    pots: tuple[int, int]  # Chips each position put in this street
+    bankrolls: tuple[int, int]
+    checkers: int
+    min_call: int
+
+
+class BettingTree:
+    """
+    The heads-up betting tree of a `PokerGame` hand with both players starting from `initial_bankroll`, stored as flat arrays.
+
+    Decision nodes are numbered in depth-first order and children always have higher numbers than their parent. `children[node, a]`
+    holds the node reached by action `a` (an index into `ACTIONS`), `num_nodes + t` for terminal `t`, or -1 when `a` is illegal.
+    Information sets are a node plus the acting player's card bucket on the node's street: `offsets[node] + bucket`.
+    """
+
+    def __init__(self, abstraction: Abstraction):
+        self.abstraction: Abstraction = abstraction
+        players: list[int] = []
+        streets: list[int] = []
+        children: list[list[int]] = []
+        # Chips each position put into the pot, and the position that folded (-1 for showdowns)
+        contributions: list[tuple[int, int]] = []
+        folders: list[int] = []
+        # Terminal children are numbered from 0 while building and shifted past the decision nodes afterwards
+        terminal_marks: list[list[bool]] = []
+
+        def build(state: _State) -> int:
+            node = len(players)
+            players.append(state.player)
+            streets.append(state.street)
+            children.append([-1] * NUM_ACTIONS)
+            terminal_marks.append([False] * NUM_ACTIONS)
+            for action_idx, action in enumerate(ACTIONS):
+                if action not in self.legal_moves(state):
+                    continue
+                result = self.apply(state, action)
+                if isinstance(result, _State):
+                    children[node][action_idx] = build(result)
+                else:
+                    folder, bankrolls = result
+                    children[node][action_idx] = len(folders)
+                    terminal_marks[node][action_idx] = True
+                    folders.append(folder)
+                    contributions.append((abstraction.initial_bankroll - bankrolls[0], abstraction.initial_bankroll - bankrolls[1]))
+            return node
+
+        build(self.root_state())
+        self.num_nodes: int = len(players)
+        self.num_terminals: int = len(folders)
+        self.players: np.ndarray = np.array(players, dtype=np.int8)
+        self.streets: np.ndarray = np.array(streets, dtype=np.int8)
+        self.children: np.ndarray = np.array(children, dtype=np.int32)
+        self.children[np.array(terminal_marks)] += self.num_nodes
+        self.legal: np.ndarray = self.children >= 0
+        self.folders: np.ndarray = np.array(folders, dtype=np.int8)
+        self.contributions: np.ndarray = np.array(contributions, dtype=np.int64)
+
+        # (terminal, showdown result, position) chip results
+        pot = self.contributions.sum(axis=1)
+        self.payoffs: np.ndarray = np.empty((self.num_terminals, 3, POSITIONS), dtype=np.int64)
+        for position in range(POSITIONS):
+            won = pot - self.contributions[:, position]
+            lost = -self.contributions[:, position]
+            folded = self.folders >= 0
+            self.payoffs[:, DEALER_WINS, position] = won if position == 0 else lost
+            self.payoffs[:, BIG_BLIND_WINS, position] = lost if position == 0 else won
+            # A split pot is halved like PokerGame.showdown() does, odd chip lost
+            self.payoffs[:, TIE, position] = pot // 2 - self.contributions[:, position]
+            self.payoffs[folded, :, position] = np.where(self.folders[folded] == position, lost[folded], won[folded])[:, None]
+
+        self.bucket_counts: np.ndarray = np.where(self.streets == 0, NUM_PREFLOP_BUCKETS, abstraction.postflop_buckets).astype(np.int64)
+        self.offsets: np.ndarray = np.concatenate(([0], np.cumsum(self.bucket_counts)[:-1]))
+        self.num_infosets: int = int(self.bucket_counts.sum())
+
+    def root_state(self) -> _State:
+        """The state after both blinds are posted: the dealer (small blind) acts first."""
+        settings = self.abstraction
+        small = min(settings.small_blind, settings.initial_bankroll)
+        big = min(settings.big_blind, settings.initial_bankroll)
+        return _State(0, 0, (small, big), (settings.initial_bankroll - small, settings.initial_bankroll - big), 0, max(small, big))
+
+    @staticmethod
+    def legal_moves(state: _State) -> list[PlayerAction]:
+        """`PokerGame.determine_legal_moves()` for a heads-up state."""
+        player = state.player
+        moves = [PlayerAction.FOLD]
+        if state.pots[player] == max(state.pots) or state.bankrolls[player] >= state.min_call - state.pots[player]:
+            moves.append(PlayerAction.CHECK_CALL)
+        if state.bankrolls[player] > 0:
+            moves.append(PlayerAction.RAISE)
+        return moves
+
+    def apply(self, state: _State, action: PlayerAction):
+        """
+        Play a legal action the way `PokerGame.process_decision()` and `next_player()` do.
+
+        Returns the next state, or (folded position or -1, bankrolls) once the hand is over.
+        """
+        player = state.player
+        if action == PlayerAction.FOLD:
+            return (player, state.bankrolls)
+        pots = list(state.pots)
+        bankrolls = list(state.bankrolls)
+        checkers = state.checkers
+        contribution = 0
+        if action == PlayerAction.CHECK_CALL:
+            if pots[player] == max(pots):
+                checkers += 1
+            else:
+                contribution = min(state.min_call - pots[player], bankrolls[player])
+        else:
+            contribution = min(3 * self.abstraction.big_blind + state.min_call, bankrolls[player])
+        bankrolls[player] -= contribution
+        pots[player] += contribution
+        min_call = pots[player] if pots[player] == max(pots) else state.min_call
+        if checkers == POSITIONS or (pots[0] == pots[1] and pots[0] != 0):
+            if state.street + 1 == NUM_STREETS:
+                return (-1, (bankrolls[0], bankrolls[1]))
+            # Later streets start with the big blind (the player after the dealer)
+            return _State(state.street + 1, 1, (0, 0), (bankrolls[0], bankrolls[1]), 0, 0)
+        return _State(state.street, 1 - player, (pots[0], pots[1]), (bankrolls[0], bankrolls[1]), checkers, min_call)
+
+    def is_terminal(self, child: int) -> bool:
+        return child >= self.num_nodes
+
+
+def sample_deals(rng: np.random.Generator, count: int) -> np.ndarray:
+    """Deal `count` heads-up hands: (count, 9) card ints holding the dealer's hole cards, the big blind's and the five board cards."""
+    return np.argpartition(rng.random((count, DECK_SIZE)), 8, axis=1)[:, :9].astype(np.int8)
+
+
+def preflop_buckets(hole_cards: np.ndarray) -> np.ndarray:
+    """`preflop.starting_hand_index()` of a (..., 2) array of hole cards."""
+    ranks = hole_cards >> 2
+    high = np.maximum(ranks[..., 0], ranks[..., 1]).astype(np.int64)
+    low = np.minimum(ranks[..., 0], ranks[..., 1]).astype(np.int64)
+    suited = (hole_cards[..., 0] & 3) == (hole_cards[..., 1] & 3)
+    return np.where(suited, high * 13 + low, low * 13 + high)
+
+
+def equity_buckets(hole_cards: np.ndarray, boards: np.ndarray, num_buckets: int, num_samples: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Bucket (n, 2) hole cards on (n, k) boards (3 <= k <= 5) by their Monte-Carlo equity against one random hand.
+
+    All n hands are simulated in one batch of n * num_samples runouts. Bucket b holds equities in [b / num_buckets, (b + 1) / num_buckets).
+    """
+    n, known = boards.shape
+    needed = 5 - known + 2
+    dead = np.zeros((n, DECK_SIZE), dtype=bool)
+    dead[np.arange(n)[:, None], hole_cards] = True
+    dead[np.arange(n)[:, None], boards] = True
+    keys = rng.random((n, num_samples, DECK_SIZE))
+    keys[np.broadcast_to(dead[:, None, :], keys.shape)] = 2.0
+    drawn = np.argpartition(keys, needed - 1, axis=2)[:, :, :needed].astype(np.int8)
+
+    hands = np.empty((2, n, num_samples, 7), dtype=np.int8)
+    hands[:, :, :, 2:2 + known] = boards[None, :, None, :]
+    hands[:, :, :, 2 + known:] = drawn[None, :, :, :5 - known]
+    hands[0, :, :, :2] = hole_cards[:, None, :]
+    hands[1, :, :, :2] = drawn[:, :, 5 - known:]
+    scores = evaluate_batch(hands.reshape(-1, 7)).reshape(2, n, num_samples)
+    equity = ((scores[0] > scores[1]) + 0.5 * (scores[0] == scores[1])).mean(axis=1)
+    return np.minimum((equity * num_buckets).astype(np.int64), num_buckets - 1)
+
+
+def deal_buckets(deals: np.ndarray, abstraction: Abstraction, rng: np.random.Generator) -> np.ndarray:
+    """Bucket both positions' hands on every street of a batch of deals (see `sample_deals()`), returning (count, positions, streets)."""
+    buckets = np.empty((deals.shape[0], POSITIONS, NUM_STREETS), dtype=np.int64)
+    for position in range(POSITIONS):
+        hole_cards = deals[:, 2 * position:2 * position + 2]
+        buckets[:, position, 0] = preflop_buckets(hole_cards)
+        for street, known in enumerate((3, 4, 5), start=1):
+            buckets[:, position, street] = equity_buckets(hole_cards, deals[:, 4:4 + known], abstraction.postflop_buckets, abstraction.equity_samples, rng)
+    return buckets
+
+
+def showdown_results(deals: np.ndarray) -> np.ndarray:
+    """Who would win each deal at showdown (`DEALER_WINS`, `TIE` or `BIG_BLIND_WINS`)."""
+    hands = np.concatenate((deals[:, [0, 1, 2, 3]].reshape(-1, 2, 2), np.broadcast_to(deals[:, None, 4:], (deals.shape[0], 2, 5))), axis=2)
+    scores = evaluate_batch(hands.reshape(-1, 7)).reshape(-1, 2)
+    return np.select([scores[:, 0] > scores[:, 1], scores[:, 0] == scores[:, 1]], [DEALER_WINS, TIE], BIG_BLIND_WINS)
+
+
+def regret_matching(regrets: np.ndarray, legal: np.ndarray) -> np.ndarray:
+    """Current strategies of a (..., actions) regret array: positive regrets normalized, or uniform over legal actions if none are."""
+    positive = np.where(legal, np.maximum(regrets, 0.0), 0.0)
+    total = positive.sum(axis=-1, keepdims=True)
+    uniform = legal / np.maximum(legal.sum(axis=-1, keepdims=True), 1)
+    return np.where(total > 0.0, positive / np.where(total > 0.0, total, 1.0), uniform)
+
+
+class MCCFRSolver:
+    """
+    External-sampling Monte Carlo CFR for heads-up `PokerGame` hands.
+
+    Cumulative regrets and average-strategy sums live in two (infosets, actions) arrays indexed by `BettingTree` information sets.
+    Each iteration deals one hand and walks the tree once per position: every action of the traversing position is explored, the
+    opponent's is sampled from its current strategy (whose probabilities are added to the average strategy on the way).
+    """
+
+    def __init__(self, abstraction: Abstraction = Abstraction(), tree: Optional[BettingTree] = None):
+        self.abstraction: Abstraction = abstraction
+        self.tree: BettingTree = tree if tree is not None else get_tree(abstraction)
+        self.regrets: np.ndarray = np.zeros((self.tree.num_infosets, NUM_ACTIONS), dtype=np.float64)
+        self.strategy_sums: np.ndarray = np.zeros((self.tree.num_infosets, NUM_ACTIONS), dtype=np.float64)
+        self.iterations: int = 0
+        # The tree as Python lists - the traversal reads one entry at a time, which lists do much faster than arrays
+        self._children: list[list[int]] = self.tree.children.tolist()
+        self._players: list[int] = self.tree.players.tolist()
+        self._streets: list[int] = self.tree.streets.tolist()
+        self._offsets: list[int] = self.tree.offsets.tolist()
+        self._payoffs: list[list[list[int]]] = self.tree.payoffs.tolist()
+        self._legal: list[list[int]] = [[a for a in range(NUM_ACTIONS) if children[a] >= 0] for children in self._children]
+
+    def run(self, iterations: int, rng: np.random.Generator, batch_size: int = 256) -> None:
+        """Run `iterations` iterations, dealing and bucketing the hands `batch_size` at a time."""
+        # Opponent actions are sampled one at a time, which `random.Random` does much faster than a NumPy generator
+        sampler = random.Random(int(rng.integers(2 ** 63)))
+        done: int = 0
+        while done < iterations:
+            count = min(batch_size, iterations - done)
+            deals = sample_deals(rng, count)
+            buckets = deal_buckets(deals, self.abstraction, rng).tolist()
+            results = showdown_results(deals).tolist()
+            for deal in range(count):
+                for traverser in range(POSITIONS):
+                    self._traverse(0, traverser, buckets[deal], results[deal], sampler)
+            done += count
+            self.iterations += count
+
+    def _traverse(self, node: int, traverser: int, buckets: list[list[int]], result: int, sampler: random.Random) -> float:
+        num_nodes = self.tree.num_nodes
+        player = self._players[node]
+        infoset = self._offsets[node] + buckets[player][self._streets[node]]
+        children = self._children[node]
+        legal = self._legal[node]
+        regrets = self.regrets[infoset].tolist()
+        positive = [max(regrets[a], 0.0) for a in legal]
+        total = sum(positive)
+        strategy = [p / total for p in positive] if total > 0.0 else [1.0 / len(legal)] * len(legal)
+
+        if player != traverser:
+            sums = self.strategy_sums[infoset]
+            draw = sampler.random()
+            chosen = legal[-1]
+            for action, probability in zip(legal, strategy):
+                sums[action] += probability
+            for action, probability in zip(legal, strategy):
+                draw -= probability
+                if draw < 0.0:
+                    chosen = action
+                    break
+            child = children[chosen]
+            if child >= num_nodes:
+                return self._payoffs[child - num_nodes][result][traverser]
+            return self._traverse(child, traverser, buckets, result, sampler)
+
+        values = [0.0] * NUM_ACTIONS
+        expected = 0.0
+        for action, probability in zip(legal, strategy):
+            child = children[action]
+            value = self._payoffs[child - num_nodes][result][traverser] if child >= num_nodes else self._traverse(child, traverser, buckets, result, sampler)
+            values[action] = value
+            expected += probability * value
+        row = self.regrets[infoset]
+        for action in legal:
+            row[action] += values[action] - expected
+        return expected
+
+    def average_strategy(self) -> np.ndarray:
+        """The (infosets, actions) average strategy - uniform over legal actions in information sets that were never reached."""
+        legal = self.tree.legal[np.repeat(np.arange(self.tree.num_nodes), self.tree.bucket_counts)]
+        return regret_matching(self.strategy_sums, legal)
+
+    def merge(self, update: "SolverUpdate") -> None:
+        """Add a worker's regret and strategy-sum changes (see `run_worker()`)."""
+        self.regrets[update.infosets] += update.regrets
+        self.strategy_sums[update.infosets] += update.strategy_sums
+        self.iterations += update.iterations
+
+    def save_checkpoint(self, directory: str) -> None:
+        """Save the solver state to `directory`, written to a temporary file first so an interrupted save keeps the last checkpoint."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, CHECKPOINT_FILE)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, regrets=self.regrets, strategy_sums=self.strategy_sums, iterations=self.iterations,
+                     abstraction=np.array(self.abstraction, dtype=np.int64))
+        os.replace(path + ".tmp", path)
+        log.info(f"Saved checkpoint after {self.iterations} iterations to {path}")
+
+    @classmethod
+    def load_checkpoint(cls, directory: str) -> "MCCFRSolver":
+        with np.load(os.path.join(directory, CHECKPOINT_FILE)) as data:
+            solver = cls(Abstraction(*(int(value) for value in data['abstraction'])))
+            solver.regrets[:] = data['regrets']
+            solver.strategy_sums[:] = data['strategy_sums']
+            solver.iterations = int(data['iterations'])
+        return solver
+
+    def export_policy(self, path: str) -> None:
+        """Save the average strategy to a policy directory that `agents.cfr.CFRPlayer` can play."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, STRATEGY_FILE), self.average_strategy().astype(np.float32))
+        meta = {'version': FORMAT_VERSION, 'iterations': self.iterations, **self.abstraction._asdict()}
+        with open(os.path.join(path, META_FILE), "w") as f:
+            json.dump(meta, f, indent=2)
+        log.info(f"Exported the average strategy of {self.tree.num_infosets} information sets to {path}")
+
+
+_trees: dict[Abstraction, BettingTree] = {}
+
+
+def get_tree(abstraction: Abstraction) -> BettingTree:
+    """Get the betting tree for an abstraction, built on first use and shared after that."""
+    tree = _trees.get(abstraction)
+    if tree is None:
+        tree = BettingTree(abstraction)
+        _trees[abstraction] = tree
+    return tree
+
+
+class SolverUpdate(NamedTuple):
+    """Regret and strategy-sum changes a worker made to the information sets it touched."""
+    infosets: np.ndarray
+    regrets: np.ndarray
+    strategy_sums: np.ndarray
+    iterations: int
+
+
+def run_worker(abstraction: Abstraction, regrets: np.ndarray, strategy_sums: np.ndarray, iterations: int, seed: np.random.SeedSequence) -> SolverUpdate:
+    """Run iterations from a copy of the solver's arrays and return what changed (runs in a worker process)."""
+    solver = MCCFRSolver(abstraction)
+    solver.regrets[:] = regrets
+    solver.strategy_sums[:] = strategy_sums
+    solver.run(iterations, np.random.default_rng(seed))
+    regret_changes = solver.regrets - regrets
+    sum_changes = solver.strategy_sums - strategy_sums
+    touched = np.flatnonzero(np.any(regret_changes != 0.0, axis=1) | np.any(sum_changes != 0.0, axis=1))
+    return SolverUpdate(touched, regret_changes[touched], sum_changes[touched], iterations)
+
+
+def best_response_values(tree: BettingTree, strategy: np.ndarray, deals: np.ndarray, buckets: np.ndarray) -> np.ndarray:
+    """
+    Value of a best response for each position against `strategy`, in chips per hand - a proxy for exploitability.
+
+    The responder knows its own buckets and the fixed sample of `deals`, and picks one action per information set to maximize its
+    value summed over the deals that reach it, so with few deals the values overestimate what a real best response would win.
+    Every deal is walked through the tree at once, with one value per deal.
+    """
+    results = showdown_results(deals)
+    values = np.zeros(POSITIONS)
+    for responder in range(POSITIONS):
+        own = buckets[:, responder, :]
+        other = buckets[:, 1 - responder, :]
+
+        def walk(node: int, reach: np.ndarray) -> np.ndarray:
+            street = int(tree.streets[node])
+            child_values = np.zeros((NUM_ACTIONS, deals.shape[0]))
+            if tree.players[node] != responder:
+                probabilities = strategy[tree.offsets[node] + other[:, street]]
+                value = np.zeros(deals.shape[0])
+                for action in np.flatnonzero(tree.legal[node]):
+                    child = int(tree.children[node, action])
+                    if tree.is_terminal(child):
+                        child_value = tree.payoffs[child - tree.num_nodes, results, responder].astype(np.float64)
+                    else:
+                        child_value = walk(child, reach * probabilities[:, action])
+                    value += probabilities[:, action] * child_value
+                return value
+            legal = np.flatnonzero(tree.legal[node])
+            for action in legal:
+                child = int(tree.children[node, action])
+                child_values[action] = tree.payoffs[child - tree.num_nodes, results, responder] if tree.is_terminal(child) else walk(child, reach)
+            # Opponent-reach weighted value of each action, summed over the deals in each of the responder's buckets
+            num_buckets = int(tree.bucket_counts[node])
+            scores = np.stack([np.bincount(own[:, street], weights=reach * child_values[action], minlength=num_buckets) for action in legal])
+            best = legal[np.argmax(scores, axis=0)]
+            return child_values[best[own[:, street]], np.arange(deals.shape[0])]
+
+        values[responder] = walk(0, np.ones(deals.shape[0])).mean()
+    return values
+
+
+def exploitability(tree: BettingTree, strategy: np.ndarray, deals: np.ndarray, buckets: np.ndarray) -> float:
+    """Best-response proxy (see `best_response_values()`) averaged over both positions, in big blinds per 100 hands."""
+    return 100.0 * float(best_response_values(tree, strategy, deals, buckets).mean()) / tree.abstraction.big_blind
+
+
+def train(solver: MCCFRSolver, iterations: int, workers: int = 0, merge_every: int = 1000, eval_every: int = 10000, eval_deals: int = 2000,
+          checkpoint_dir: Optional[str] = None, seed: int = 0) -> list[tuple[int, float]]:
+    """
+    Train for `iterations` more iterations, returning (iterations, exploitability proxy) measured every `eval_every` iterations.
+
+    With `workers` > 0 each worker runs up to `merge_every` iterations from a copy of the current arrays, and the changes are merged
+    back before the next round of tasks; with 0 the iterations run in this process. A checkpoint is saved after every evaluation if `checkpoint_dir` is given.
+    """
+    seeds = np.random.SeedSequence([seed, solver.iterations])
+    rng = np.random.default_rng(seeds.spawn(1)[0])
+    eval_rng = np.random.default_rng(seed)
+    deals = sample_deals(eval_rng, eval_deals)
+    buckets = deal_buckets(deals, solver.abstraction, eval_rng)
+    history: list[tuple[int, float]] = []
+    target = solver.iterations + iterations
+    next_eval = solver.iterations + eval_every
+
+    def evaluate() -> None:
+        start = time.perf_counter()
+        value = exploitability(solver.tree, solver.average_strategy(), deals, buckets)
+        history.append((solver.iterations, value))
+        log.info(f"{solver.iterations} iterations: best response proxy {value:.1f} bb/100 ({time.perf_counter() - start:.1f}s)")
+        if checkpoint_dir is not None:
+            solver.save_checkpoint(checkpoint_dir)
+
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn")) if workers > 0 else None
+    try:
+        while solver.iterations < target:
+            chunk = min(merge_every * max(workers, 1), next_eval - solver.iterations, target - solver.iterations)
+            start = time.perf_counter()
+            if pool is None:
+                solver.run(chunk, rng)
+            else:
+                shares = [chunk // workers + (worker < chunk % workers) for worker in range(workers)]
+                tasks = [pool.submit(run_worker, solver.abstraction, solver.regrets, solver.strategy_sums, share, child)
+                         for share, child in zip(shares, seeds.spawn(workers)) if share > 0]
+                for task in tasks:
+                    solver.merge(task.result())
+            log.debug(f"{solver.iterations} iterations ({time.perf_counter() - start:.1f}s for the last {chunk})")
+            if solver.iterations >= next_eval or solver.iterations >= target:
+                evaluate()
+                next_eval = solver.iterations + eval_every
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return history
+
+
+class _Trace:
+    """Event subscriber following a duplicate-mode `PokerGame` hand through a `BettingTree` (used by `run_parity_check()`)."""
+
+    def __init__(self, game: PokerGame):
+        self.game: PokerGame = game
+        self.dealer: int = 0
+        # (showdown, bankrolls right after it) - duplicate mode resets the bankrolls as soon as the next hand starts
+        self.showdowns: list[tuple[ShowdownEvent, list[int]]] = []
+
+    def __call__(self, event: GameEvent) -> None:
+        if isinstance(event, HandStartEvent):
+            self.dealer = event.dealer
+        elif isinstance(event, ShowdownEvent):
+            self.showdowns.append((event, [player.bankroll for player in self.game.players]))
+
+
+def run_parity_check(num_hands: int = 2000, abstraction: Abstraction = Abstraction(), seed: int = 0) -> bool:
+    """Play random legal actions through a `PokerGame` and the betting tree side by side, checking both agree on every decision and result."""
+    tree = get_tree(abstraction)
+    game = PokerGame(abstraction.initial_bankroll, abstraction.small_blind, abstraction.big_blind)
+    for seat in range(POSITIONS):
+        player = Player(f"Player {seat}", True)
+        player.seat = seat
+        game.players.append(player)
+    trace = _Trace(game)
+    game.events.subscribe(trace)
+    game.set_duplicate(seed)
+    rng = random.Random(seed)
+    game.reset()
+    for hand in range(num_hands):
+        dealer = trace.dealer
+        node = 0
+        showdowns = len(trace.showdowns)
+        while True:
+            game.determine_legal_moves()
+            position = (game.current_player_idx - dealer) % POSITIONS
+            expected = [ACTIONS[action] for action in np.flatnonzero(tree.legal[node])]
+            if position != tree.players[node] or game.round.value != tree.streets[node] or game.legal_moves != expected:
+                log.error(f"Hand {hand}, node {node}: game has position {position} on {game.round.name} with {game.legal_moves}, "
+                          f"tree has position {tree.players[node]} on street {tree.streets[node]} with {expected}")
+                return False
+            action = rng.choice(game.legal_moves)
+            game.do_step(action)
+            child = int(tree.children[node, ACTIONS.index(action)])
+            if len(trace.showdowns) > showdowns:
+                if not tree.is_terminal(child):
+                    log.error(f"Hand {hand}: game ended the hand at node {node}, the tree didn't")
+                    return False
+                event, bankrolls = trace.showdowns[-1]
+                winners = [(seat - dealer) % POSITIONS for seat in event.winners]
+                result = TIE if len(winners) > 1 else (DEALER_WINS if winners[0] == 0 else BIG_BLIND_WINS)
+                payoffs = tree.payoffs[child - tree.num_nodes, result]
+                changes = [bankrolls[(dealer + position) % POSITIONS] - abstraction.initial_bankroll for position in range(POSITIONS)]
+                if changes != payoffs.tolist():
+                    log.error(f"Hand {hand}: game results {changes}, tree payoffs {payoffs.tolist()}")
+                    return False
+                break
+            if tree.is_terminal(child):
+                log.error(f"Hand {hand}: the tree ended the hand at node {node}, the game didn't")
+                return False
+            node = child
+    log.info(f"Betting tree matched PokerGame over {num_hands} random hands ({tree.num_nodes} decision nodes, {tree.num_terminals} terminals)")
+    return True
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Solve heads-up hands with external-sampling Monte Carlo CFR.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="train (or resume training) and export the average strategy")
+    train_parser.add_argument("--iterations", type=int, default=100000)
+    train_parser.add_argument("--workers", type=int, default=0, help="worker processes (0 = train in this process)")
+    train_parser.add_argument("--merge-every", type=int, default=2000, help="iterations each worker runs between merges")
+    train_parser.add_argument("--eval-every", type=int, default=20000, help="iterations between best response evaluations and checkpoints")
+    train_parser.add_argument("--eval-deals", type=int, default=2000, help="deals the best response proxy is measured on")
+    train_parser.add_argument("--checkpoint", default="cfr_checkpoint", help="checkpoint directory (resumed from if it holds one)")
+    train_parser.add_argument("--policy-out", default="cfr_policy", help="directory the average strategy is exported to")
+    train_parser.add_argument("--buckets", type=int, default=Abstraction().postflop_buckets, help="equity buckets on the flop, turn and river")
+    train_parser.add_argument("--seed", type=int, default=0)
+    check_parser = subparsers.add_parser("check", help="check the betting tree against PokerGame")
+    check_parser.add_argument("--hands", type=int, default=2000)
+    check_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "check":
+        if not run_parity_check(args.hands, seed=args.seed):
+            raise SystemExit(1)
+    else:
+        if os.path.exists(os.path.join(args.checkpoint, CHECKPOINT_FILE)):
+            solver = MCCFRSolver.load_checkpoint(args.checkpoint)
+            log.info(f"Resuming from {solver.iterations} iterations in {args.checkpoint}")
+        else:
+            solver = MCCFRSolver(Abstraction(postflop_buckets=args.buckets))
+        log.info(f"{solver.tree.num_nodes} decision nodes, {solver.tree.num_infosets} information sets")
+        start = time.perf_counter()
+        train(solver, args.iterations, args.workers, args.merge_every, args.eval_every, args.eval_deals, args.checkpoint, args.seed)
+        elapsed = time.perf_counter() - start
+        log.info(f"Trained {args.iterations} iterations in {elapsed:.1f}s ({args.iterations / elapsed:.0f} per second)")
+        solver.export_policy(args.policy_out)
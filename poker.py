@@ -1,12 +1,52 @@
 import logging
-from util import PlayerAction, Round, suits, ranks, rank_hand
-from typing import Optional
+from collections import deque
+from util import PlayerAction, Round, DECK_SIZE, cards_to_str, rank_hand
+from events import EventBus, HandStartEvent, DealEvent, BlindEvent, ActionEvent, RoundStartEvent, RoundEndEvent, ShowdownEvent, GameOverEvent
+from typing import Any, NamedTuple, Optional
 from agents.player import Player
 
 import numpy as np
 
 log = logging.getLogger(__name__)
 
+# Ordered deck that every hand's shuffled permutation is drawn from
+FRESH_DECK: np.ndarray = np.arange(DECK_SIZE, dtype=np.uint8)
+
+
+class PlayerSnapshot(NamedTuple):
+    bankroll: int
+    round_contribution: int
+    cards: tuple[int, ...]
+    actions: tuple[PlayerAction, ...]
+    rng_state: Any  # The player's own random stream (see `Player.rng_state()`)
+
+
+class GameSnapshot(NamedTuple):
+    """Immutable copy of everything `PokerGame` changes while playing, taken by `PokerGame.snapshot()`."""
+    rng_state: dict
+    done: bool
+    winner: Optional[int]
+    active_players: tuple[bool, ...]
+    current_player_idx: int
+    has_current_player: bool
+    dealer_idx: int
+    small_blind_idx: int
+    big_blind_idx: int
+    round: Round
+    community_pot: int
+    round_pot: int
+    player_pots: tuple[int, ...]
+    deck: np.ndarray  # Shared, not copied - decks are replaced on every shuffle, never modified
+    deck_idx: int
+    hand_number: int
+    community_cards: tuple[int, ...]
+    checkers: int
+    min_call: int
+    legal_moves: tuple[PlayerAction, ...]
+    hand_ranks: tuple[Optional[tuple[str, int, int]], ...]
+    players: tuple[PlayerSnapshot, ...]
+    subscriber_states: tuple  # (subscriber, state) pairs from `EventBus.snapshot_states()`
+
 
 class PokerGame:
     def __init__(self, initial_bankroll: int, small_blind: int, big_blind: int):
@@ -33,14 +73,30 @@ class PokerGame:
         self.round_pot: int = 0
         self.player_pots: list[int] = []
 
-        self.deck: list[str] = []
-        self.community_cards: list[str] = []
+        # Shuffled deck for the current hand; cards are drawn by advancing deck_idx
+        self.deck: np.ndarray = FRESH_DECK.copy()
+        self.deck_idx: int = 0
+        self.community_cards: list[int] = []
+
+        # Hands started since the last reset()
+        self.hand_number: int = 0
+        # Duplicate mode (see set_duplicate()): when set, each hand's deck only depends on this seed and the hand number
+        self.deck_seed: Optional[int] = None
 
         self.checkers: int = 0
         self.min_call: int = 0
 
         self.legal_moves: list[PlayerAction] = []
 
+        # Each player's hand rank on the current street, filled in on first use and cleared whenever cards are dealt
+        self.hand_ranks: list[Optional[tuple[str, int, int]]] = []
+
+        # Structured game events (deals, bets, showdowns, ...) - subscribe to these instead of parsing logs
+        self.events: EventBus = EventBus()
+
+        # Snapshots taken before each do_step() while undo is enabled (see set_undo_depth())
+        self.undo_stack: deque[GameSnapshot] = deque(maxlen=0)
+
     def set_rng(self, gen: np.random.Generator) -> None:
         """
         Replace the game's random number generator with an external one.
@@ -49,7 +105,96 @@ class PokerGame:
         """
         self.rng = gen
 
+    def set_duplicate(self, deck_seed: Optional[int]) -> None:
+        """
+        Turn duplicate mode on (with a deck seed) or off (with None).
+
+        In duplicate mode every hand starts from fresh bankrolls, with the dealer button and the deck fixed by the deck seed and the
+        hand number alone, so the Nth hand deals the same cards to the same seats no matter how earlier hands were played. Playing
+        the same seed again with the players moved to other seats gives each of them the cards another seat held (see `duplicate.py`).
+        The game never ends by itself in this mode, so callers decide how many hands to play.
+        """
+        self.deck_seed = deck_seed
+
+    def snapshot(self) -> GameSnapshot:
+        """Capture the game's full state (including the deck position and the game's and players' RNG states), to be restored later with `restore()`."""
+        return GameSnapshot(
+            self.rng.bit_generator.state,
+            self.done,
+            self.winner,
+            tuple(self.active_players),
+            self.current_player_idx,
+            self.current_player is not None,
+            self.dealer_idx,
+            self.small_blind_idx,
+            self.big_blind_idx,
+            self.round,
+            self.community_pot,
+            self.round_pot,
+            tuple(self.player_pots),
+            self.deck,
+            self.deck_idx,
+            self.hand_number,
+            tuple(self.community_cards),
+            self.checkers,
+            self.min_call,
+            tuple(self.legal_moves),
+            tuple(self.hand_ranks),
+            tuple(PlayerSnapshot(player.bankroll, player.round_contribution, tuple(player.cards), tuple(player.actions), player.rng_state()) for player in self.players),
+            self.events.snapshot_states() if self.events.subscribers else ()
+        )
+
+    def restore(self, snapshot: GameSnapshot) -> None:
+        """
+        Return the game to a state captured by `snapshot()`. The game must have the same players it had when the snapshot was taken.
+
+        Continuing from a restored state deals the same cards as continuing from the original. No events are emitted, but subscribers
+        that keep state of their own get back what they had when the snapshot was taken (see `EventBus`).
+        """
+        if len(snapshot.players) != len(self.players):
+            raise ValueError(f"Snapshot has {len(snapshot.players)} players, but the game has {len(self.players)}")
+        self.rng.bit_generator.state = snapshot.rng_state
+        self.done = snapshot.done
+        self.winner = snapshot.winner
+        self.active_players = list(snapshot.active_players)
+        self.current_player_idx = snapshot.current_player_idx
+        self.current_player = self.players[self.current_player_idx] if snapshot.has_current_player else None
+        self.dealer_idx = snapshot.dealer_idx
+        self.small_blind_idx = snapshot.small_blind_idx
+        self.big_blind_idx = snapshot.big_blind_idx
+        self.round = snapshot.round
+        self.community_pot = snapshot.community_pot
+        self.round_pot = snapshot.round_pot
+        self.player_pots = list(snapshot.player_pots)
+        self.deck = snapshot.deck
+        self.deck_idx = snapshot.deck_idx
+        self.hand_number = snapshot.hand_number
+        self.community_cards = list(snapshot.community_cards)
+        self.checkers = snapshot.checkers
+        self.min_call = snapshot.min_call
+        self.legal_moves = list(snapshot.legal_moves)
+        self.hand_ranks = list(snapshot.hand_ranks)
+        for player, player_snapshot in zip(self.players, snapshot.players):
+            player.bankroll = player_snapshot.bankroll
+            player.round_contribution = player_snapshot.round_contribution
+            player.cards = list(player_snapshot.cards)
+            player.actions = list(player_snapshot.actions)
+            player.restore_rng_state(player_snapshot.rng_state)
+        for subscriber, state in snapshot.subscriber_states:
+            subscriber.restore_state(state)
+
+    def set_undo_depth(self, depth: int) -> None:
+        """Keep snapshots of the last `depth` steps so they can be reversed with `undo()` (0, the default, disables undo)."""
+        self.undo_stack = deque(self.undo_stack, maxlen=depth)
+
+    def undo(self) -> None:
+        """Reverse the last `do_step()`."""
+        if not self.undo_stack:
+            raise RuntimeError("Nothing to undo - enable undo with set_undo_depth() before stepping")
+        self.restore(self.undo_stack.pop())
+
     def reset(self):
+        self.undo_stack.clear()
         for player in self.players:
             player.actions = []
             player.bankroll = self.initial_bankroll
@@ -57,32 +202,45 @@ class PokerGame:
             player.cards = []
         self.done = False
         self.winner = None
+        self.hand_number = 0
+        # Every game starts with the button on seat 0, so a game doesn't depend on where the last one left it
+        self.dealer_idx = 0
         self.start_new_hand()
 
     def generate_deck(self) -> None:
-        """Reset the game's deck to having all 52 cards."""
-        self.deck = [rank + suit for suit in suits for rank in ranks]
+        """Reset the game's deck to a freshly shuffled permutation of all 52 cards."""
+        if self.deck_seed is not None:
+            # A generator of its own for every hand, so nothing drawn from self.rng (or in earlier hands) can shift the deck
+            self.deck = np.random.default_rng([self.deck_seed, self.hand_number]).permutation(FRESH_DECK)
+        else:
+            self.deck = self.rng.permutation(FRESH_DECK)
+        self.deck_idx = 0
 
-    def draw_card(self) -> str:
-        """Draw a random card from the game's deck, remove it, and return it."""
-        return self.deck.pop(self.rng.integers(0, len(self.deck)))
+    def draw_card(self) -> int:
+        """Draw the next card from the game's shuffled deck and return it."""
+        card: int = int(self.deck[self.deck_idx])
+        self.deck_idx += 1
+        return card
 
     def deal_new_cards(self) -> None:
         """Deal two cards to all active players in the game (as a part of the pre-flop round)."""
+        self.hand_ranks = [None] * len(self.players)
         for index, player in enumerate(self.players):
             player.cards = []
             if not self.active_players[index]:
-                log.info(f"Player {player.seat} is not playing this round.")
                 continue
             for _ in range(2):
                 player.cards.append(self.draw_card())
-            log.info(f"Player {player.seat} drew {player.cards}")
+            if self.events.subscribers:
+                self.events.emit(DealEvent(player.seat, tuple(player.cards)))
 
     def deal_cards_to_table(self, num_cards: int) -> None:
         """Deal a variable number of cards to the table."""
         for _ in range(num_cards):
             self.community_cards.append(self.draw_card())
-        log.info(f"Dealer drew {num_cards} card{'s' if num_cards > 1 else ''} to table: {self.community_cards}")
+        self.hand_ranks = [None] * len(self.players)
+        if self.events.subscribers:
+            self.events.emit(DealEvent(None, tuple(self.community_cards[-num_cards:])))
 
     def start_new_hand(self) -> None:
         """
@@ -92,6 +250,10 @@ class PokerGame:
         """
         if len(self.players) < 2 or len(self.players) > 8:
             raise RuntimeError(f"Cannot start a hand with {len(self.players)} players - must be between 2 and 8. Use add_player() to add a new player to the game.")
+        if self.deck_seed is not None:
+            for player in self.players:
+                player.bankroll = self.initial_bankroll
+            self.dealer_idx = self.hand_number % len(self.players)
         if [player.bankroll for player in self.players].count(0) == len(self.players) - 1:
             self.done = True
             self.winner = None
@@ -101,9 +263,11 @@ class PokerGame:
                     break
             if self.winner is None:
                 logging.error("No winner found")
-            log.info(f"Game over! Player {self.winner} won")
+            if self.events.subscribers:
+                self.events.emit(GameOverEvent(self.winner))
             return
-        log.info("Starting new hand...")
+        if self.events.subscribers:
+            self.events.emit(HandStartEvent(self.dealer_idx, tuple(player.bankroll for player in self.players)))
         self.round = Round.PREFLOP
         self.community_cards = []
         self.community_pot = 0
@@ -118,6 +282,7 @@ class PokerGame:
             player.round_contribution = 0
         self.player_pots = [0] * len(self.players)
         self.generate_deck()
+        self.hand_number += 1
         self.deal_new_cards()
         self.start_round()
 
@@ -128,8 +293,6 @@ class PokerGame:
         Determines the winner of the current hand and manages pots and bankrolls accordingly.
         """
         self.close_pots()
-        log.info(f"Final community pot: {self.community_pot}")
-        log.info(f"Final community cards: {self.community_cards}")
         self.showdown()
         # Move dealer one position, but take into account players that have no bankroll
         while True:
@@ -146,7 +309,6 @@ class PokerGame:
         self.checkers = 0
         self.min_call = 0
         if self.round == Round.PREFLOP:
-            log.info("Starting round: Preflop")
             # Only advance past dealer if not playing with 2 players - this way with 2 players the dealer will bet small blind
             if len(self.players) != 2:
                 self.next_player()
@@ -159,7 +321,6 @@ class PokerGame:
             self.current_player_idx = self.dealer_idx
             self.current_player = self.players[self.current_player_idx]
         elif self.round in [Round.FLOP, Round.TURN, Round.RIVER]:
-            log.info(f"Starting round: {'Flop' if self.round == Round.FLOP else ('Turn' if self.round == Round.TURN else 'River')}")
             if self.round == Round.FLOP:
                 self.deal_cards_to_table(3)
             elif self.round in [Round.TURN, Round.RIVER]:
@@ -169,9 +330,9 @@ class PokerGame:
             self.current_player_idx = self.dealer_idx
             self.next_player()
         else:
-            log.info("Starting showdown")
             return
-        log.info(f"Player {self.current_player_idx} will start betting - starting betting round!")
+        if self.events.subscribers:
+            self.events.emit(RoundStartEvent(self.round, self.current_player_idx))
 
     def end_round(self) -> None:
         """
@@ -181,8 +342,9 @@ class PokerGame:
         """
         self.close_pots()
 
+        if self.events.subscribers:
+            self.events.emit(RoundEndEvent(self.round, self.community_pot))
         self.round = Round(self.round.value + 1)
-        log.info("Round over!")
 
     def close_pots(self) -> None:
         """
@@ -206,15 +368,12 @@ class PokerGame:
 
         Will switch rounds if the game's current state allows for it (all players check, one player left to bet, or all players call to same amount).
         """
-        log.debug("next_player called")
         alive: int = self.active_players.count(True)
         if alive < 2:
-            log.info("One player remains in hand, skipping to showdown...")
             self.round = Round.SHOWDOWN
             return
 
         if self.checkers == alive:
-            log.info("All players have checked, moving to next round...")
             self.end_round()
             self.start_round()
             return
@@ -224,11 +383,9 @@ class PokerGame:
             if not self.active_players[index]:
                 continue
             if pot != max(self.player_pots) or pot == 0:
-                log.debug("Not all players have bet the same amount, continuing betting...")
                 cont = False
                 break
         if cont:
-            log.info("All players have bet the same amount, moving to next round...")
             self.end_round()
             self.start_round()
             return
@@ -245,7 +402,6 @@ class PokerGame:
             log.error("No current player - make sure a current player is set before attempting to advance players!")
             log.error("Moving to player 0...")
         self.current_player = self.players[self.current_player_idx]
-        log.info(f"Moved to player {self.current_player_idx}")
 
     def determine_legal_moves(self) -> None:
         """Update the set of legal moves for the current player given the game's state."""
@@ -259,8 +415,25 @@ class PokerGame:
         else:
             log.error("No current player, cannot determine legal moves!")
 
+    def player_hand_rank(self, index: int) -> Optional[tuple[str, int, int]]:
+        """
+        Get `rank_hand()` of a player's hole cards and the board, or None before the flop or if the player wasn't dealt in.
+
+        Ranked at most once per street - the observation, renderer, state dump and showdown all share the result.
+        """
+        if len(self.community_cards) < 3 or not self.players[index].cards:
+            return None
+        rank = self.hand_ranks[index]
+        if rank is None:
+            rank = rank_hand(self.players[index].cards + self.community_cards)
+            self.hand_ranks[index] = rank
+        return rank
+
     def dump_state(self) -> None:
         """Log the game's current state (at debug level). Useful for providing info before a human player's bet."""
+        # Called on every observation, so skip building the messages (and ranking the hand) unless they will be shown
+        if not log.isEnabledFor(logging.DEBUG):
+            return
         log.debug(f"Current legal moves: {self.legal_moves}")
         log.debug(f"Current player: {self.current_player_idx} (dealer = {self.dealer_idx}, sb = {self.small_blind_idx}, bb = {self.big_blind_idx})")
         log.debug(f"Active players: {self.active_players}")
@@ -268,7 +441,7 @@ class PokerGame:
         log.debug(f"Player bankrolls: {[player.bankroll for player in self.players]}")
         log.debug(f"Pots: Round = {self.round_pot} | Community = {self.community_pot} | Min Call = {self.min_call}")
         if self.current_player:
-            log.debug(f"Current player cards: {self.current_player.cards + self.community_cards} | Rank = {rank_hand(self.current_player.cards + self.community_cards) if len(self.current_player.cards + self.community_cards) >= 5 else 'Not enough cards to rank'} | Bankroll = {self.current_player.bankroll}")
+            log.debug(f"Current player cards: {cards_to_str(self.current_player.cards + self.community_cards)} | Rank = {self.player_hand_rank(self.current_player_idx) or 'Not enough cards to rank'} | Bankroll = {self.current_player.bankroll}")
 
     def process_decision(self, action: PlayerAction) -> None:
         """Process a player's decision by updating the game's state based on the requested player action."""
@@ -281,28 +454,26 @@ class PokerGame:
             self.current_player.actions.append(action)
             if action == PlayerAction.SMALL_BLIND:
                 contribution = min(self.small_blind, self.current_player.bankroll)
-                log.info(f"Player bet small blind ({self.small_blind}): contribution = {contribution}")
             elif action == PlayerAction.BIG_BLIND:
                 contribution = min(self.big_blind, self.current_player.bankroll)
-                log.info(f"Player bet big blind ({self.big_blind}): contribution = {contribution}")
             elif action == PlayerAction.FOLD:
                 self.deactivate_current_player()
-                log.info("Player folds")
             elif action == PlayerAction.CHECK_CALL:
                 if self.player_pots[self.current_player_idx] == max(self.player_pots):
                     # CHECK
                     self.checkers += 1
-                    log.info("Player checks: contribution = 0")
                 elif self.current_player and self.current_player.bankroll >= self.min_call - self.player_pots[self.current_player_idx]:
                     # CALL
                     contribution = min(self.min_call - self.player_pots[self.current_player_idx], self.current_player.bankroll)
-                    log.info(f"Player calls ({self.min_call}): contribution = {contribution}")
             elif action == PlayerAction.RAISE:
                 contribution = min((3 * self.big_blind) + self.min_call, self.current_player.bankroll)
-                log.info(f"Player raises (3BB={3*self.big_blind}): contribution = {contribution}")
             self.current_player.bankroll -= contribution
             self.current_player.round_contribution += contribution
-            log.info(f"Player's bankroll is now at {self.current_player.bankroll}")
+            if self.events.subscribers:
+                if action in (PlayerAction.SMALL_BLIND, PlayerAction.BIG_BLIND):
+                    self.events.emit(BlindEvent(self.current_player_idx, action, contribution, self.current_player.bankroll))
+                else:
+                    self.events.emit(ActionEvent(self.current_player_idx, action, contribution, self.current_player.bankroll))
             self.player_pots[self.current_player_idx] += contribution
             self.round_pot += contribution
             if self.player_pots[self.current_player_idx] == max(self.player_pots):
@@ -328,11 +499,12 @@ class PokerGame:
     def deactivate_current_player(self) -> None:
         """Set the current player to be inactive in the current round."""
         self.active_players[self.current_player_idx] = False
-        log.info(f"Player {self.current_player_idx} is now inactive")
 
     def do_step(self, action: Optional[PlayerAction]) -> None:
         if action is None:
             raise RuntimeError("Cannot step game with action None")
+        if self.undo_stack.maxlen:
+            self.undo_stack.append(self.snapshot())
         self.process_decision(action)
         self.next_player()
         if self.round == Round.SHOWDOWN:
@@ -342,10 +514,11 @@ class PokerGame:
     def showdown(self) -> None:
         """Determine the winner of the current round and award them the proper win total."""
         winners: list[int] = self.determine_winners()
-        log.info(f"Player(s) {winners} win(s)!")
         for winner in winners:
             self.players[winner].bankroll += (self.community_pot // len(winners))
-            log.info(f"Player {winner} wins {self.community_pot // len(winners)}, and now has {self.players[winner].bankroll}")
+        if self.events.subscribers:
+            hands = tuple((index, tuple(player.cards)) for index, player in enumerate(self.players) if self.active_players[index])
+            self.events.emit(ShowdownEvent(tuple(winners), self.community_pot // len(winners), tuple(self.community_cards), hands))
 
     def determine_winners(self) -> list[int]:
         """Determine the winner(s) of the current round."""
@@ -356,12 +529,10 @@ class PokerGame:
                 return [self.active_players.index(True)]
             else:
                 raise RuntimeError("Cannot determine a winner from preflop with more than 1 active player!")
-        for index, player in enumerate(self.players):
-            if self.active_players[index]:
-                log.info(f"Player {index}'s cards: {player.cards}")
-                all_cards: list[str] = player.cards.copy()
-                all_cards.extend(self.community_cards)
-                ranks[index] = rank_hand(all_cards)[1]
+        for index in range(len(self.players)):
+            rank = self.player_hand_rank(index) if self.active_players[index] else None
+            if rank is not None:
+                ranks[index] = rank[1]
             else:
                 ranks[index] = 7463
         return [i for i, x in enumerate(ranks) if x == min(ranks)]
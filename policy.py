@@ -0,0 +1,112 @@
+import json
+import logging
+import os
+from typing import Optional, Sequence
+
+import numpy as np
+
+from util import PlayerAction
+
+log = logging.getLogger(__name__)
+
+# A frozen policy is a directory holding:
+# - actions.npy: (num_states, num_actions) int8 array ranking each state's actions from best to worst, or UNSEEN rows for states
+#   that were never visited during training
+# - meta.json: format version, the observation space layout (Discrete starts and sizes) and the fallback for unseen states
+FORMAT_VERSION: int = 1
+ACTIONS_FILE: str = "actions.npy"
+META_FILE: str = "meta.json"
+UNSEEN: int = -1
+
+# What to play in unseen states: check/call when legal (otherwise fold), or a uniformly random legal move like `RandomPlayer`
+FALLBACK_CHECK_CALL: str = "check_call"
+FALLBACK_RANDOM: str = "random"
+
+
+def save_policy(path: str, values: np.ndarray, visited: np.ndarray, starts: Sequence[int], sizes: Sequence[int], fallback: str = FALLBACK_CHECK_CALL, **metadata) -> None:
+    """
+    Freeze a dense Q-table (see `QTable.export_policy()`) into a read-only policy directory.
+
+    Extra keyword arguments (e.g. the env settings the table was trained with) are stored in the metadata.
+    """
+    if fallback not in (FALLBACK_CHECK_CALL, FALLBACK_RANDOM):
+        raise ValueError(f"Unknown fallback {fallback!r}")
+    # Stable sort keeps the lowest action first among ties, like np.argmax
+    ranking = np.argsort(-values, axis=1, kind="stable").astype(np.int8)
+    ranking[~visited] = UNSEEN
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, ACTIONS_FILE), ranking)
+    meta = {'version': FORMAT_VERSION, 'starts': [int(start) for start in starts], 'sizes': [int(size) for size in sizes], 'fallback': fallback, **metadata}
+    with open(os.path.join(path, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+    log.info(f"Saved policy for {int(visited.sum())}/{len(visited)} seen states to {path}")
+
+
+class FrozenPolicy:
+    """
+    A frozen policy loaded with memory-mapping, so every process using the same file shares one physical copy.
+
+    Picking an action is one array index plus a scan of at most `num_actions` entries for the best legal one.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta: dict = json.load(f)
+        if self.meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"Policy {path} has format version {self.meta.get('version')}, expected {FORMAT_VERSION}")
+        self.ranking: np.ndarray = np.load(os.path.join(path, ACTIONS_FILE), mmap_mode='r')
+        self.fallback: str = self.meta['fallback']
+        self._starts: list[int] = self.meta['starts']
+        self._sizes: list[int] = self.meta['sizes']
+        strides: list[int] = [1] * len(self.meta['sizes'])
+        for part in range(len(strides) - 2, -1, -1):
+            strides[part] = strides[part + 1] * self.meta['sizes'][part + 1]
+        self._strides: list[int] = strides
+        # Array copies for the batched path (see `state_indices()`)
+        self._start_array: np.ndarray = np.array(self._starts, dtype=np.int64)
+        self._size_array: np.ndarray = np.array(self._sizes, dtype=np.int64)
+        self._stride_array: np.ndarray = np.array(strides, dtype=np.int64)
+
+    def state_index(self, observation: Sequence[int]) -> int:
+        """Map an observation tuple to its row (the same indexing as `QTable.state_index()`)."""
+        index: int = 0
+        for value, start, size, stride in zip(observation, self._starts, self._sizes, self._strides):
+            if not 0 <= value - start < size:
+                raise ValueError(f"Observation {observation} is outside of the policy's observation space (was it trained for this table size?)")
+            index += (value - start) * stride
+        return index
+
+    def state_indices(self, observations) -> np.ndarray:
+        """Map a batch of observations - an (N, parts) array or a list of observation tuples - to their rows at once."""
+        offsets = np.asarray(observations, dtype=np.int64).reshape(-1, len(self._sizes)) - self._start_array
+        if ((offsets < 0) | (offsets >= self._size_array)).any():
+            raise ValueError("Observation outside of the policy's observation space (was it trained for this table size?)")
+        return offsets @ self._stride_array
+
+    def rankings(self, observations) -> np.ndarray:
+        """The ranked actions (best first) of a batch of observations, one row each. Rows of states never seen start with `UNSEEN`."""
+        return self.ranking[self.state_indices(observations)]
+
+    def seen(self, observation: Sequence[int]) -> bool:
+        return self.ranking[self.state_index(observation), 0] != UNSEEN
+
+    def action(self, observation: Sequence[int], legal_moves: Sequence[PlayerAction], rng: Optional[np.random.Generator] = None) -> PlayerAction:
+        """
+        Get the policy's best legal move for an observation, falling back (see `FALLBACK_*`) for states it has never seen.
+
+        The random fallback draws from `rng` (e.g. the playing agent's stream), or from fresh OS entropy without one.
+        """
+        if len(observation) != len(self._strides):
+            raise ValueError(f"Observation {observation} doesn't match the policy's observation space ({len(self._strides)} parts)")
+        ranking = self.ranking[self.state_index(observation)]
+        if ranking[0] != UNSEEN:
+            for action in ranking:
+                move = PlayerAction(int(action))
+                if move in legal_moves:
+                    return move
+        return self.fallback_action(legal_moves, rng)
+
+    def fallback_action(self, legal_moves: Sequence[PlayerAction], rng: Optional[np.random.Generator] = None) -> PlayerAction:
+        if self.fallback == FALLBACK_RANDOM:
+            return legal_moves[(rng or np.random.default_rng()).integers(len(legal_moves))]
+        return PlayerAction.CHECK_CALL if PlayerAction.CHECK_CALL in legal_moves else PlayerAction.FOLD
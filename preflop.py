@@ -0,0 +1,159 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Sequence
+
+import numpy as np
+
+from equity import estimate_equity
+from util import ColoredFormatter, card_rank, card_suit, ranks
+
+log = logging.getLogger(__name__)
+
+NUM_STARTING_HANDS: int = 169
+MIN_PLAYERS: int = 2
+MAX_PLAYERS: int = 8
+TABLE_PATH: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "preflop_equity.npy")
+
+# Loaded on first lookup - shape (NUM_STARTING_HANDS, MAX_PLAYERS - MIN_PLAYERS + 1)
+_table: Optional[np.ndarray] = None
+
+
+def starting_hand_index(hole_cards: Sequence[int]) -> int:
+    """
+    Map two hole cards to one of the 169 strategically distinct starting hands.
+
+    Hands are laid out on a 13x13 grid: pairs on the diagonal, suited hands at [high][low] and offsuit hands at [low][high].
+    """
+    high: int = max(card_rank(hole_cards[0]), card_rank(hole_cards[1]))
+    low: int = min(card_rank(hole_cards[0]), card_rank(hole_cards[1]))
+    if card_suit(hole_cards[0]) == card_suit(hole_cards[1]):
+        return high * 13 + low
+    return low * 13 + high
+
+
+def representative_cards(index: int) -> tuple[int, int]:
+    """Get a pair of hole cards belonging to the given starting hand index (the inverse of `starting_hand_index`)."""
+    row, col = divmod(index, 13)
+    if row == col:
+        return (row * 4, row * 4 + 1)
+    if row > col:
+        return (row * 4, col * 4)
+    return (col * 4, row * 4 + 1)
+
+
+def starting_hand_name(index: int) -> str:
+    """Get the usual short name of a starting hand index ("AKs", "T9o", "77")."""
+    row, col = divmod(index, 13)
+    if row == col:
+        return ranks[row] * 2
+    if row > col:
+        return ranks[row] + ranks[col] + "s"
+    return ranks[col] + ranks[row] + "o"
+
+
+def get_table() -> np.ndarray:
+    """Get the preflop equity table, loading it from disk the first time it is needed."""
+    global _table
+    if _table is None:
+        if not os.path.exists(TABLE_PATH):
+            raise FileNotFoundError(f"Preflop equity table not found at {TABLE_PATH} - run `python preflop.py generate` to build it.")
+        _table = np.load(TABLE_PATH)
+        log.debug(f"Loaded preflop equity table {_table.shape} from {TABLE_PATH}")
+    return _table
+
+
+def preflop_equity(hole_cards: Sequence[int], num_players: int) -> float:
+    """Look up the equity of two hole cards against `num_players` - 1 random hands before the flop."""
+    if num_players < MIN_PLAYERS or num_players > MAX_PLAYERS:
+        raise ValueError(f"Preflop equity is only tabled for {MIN_PLAYERS}-{MAX_PLAYERS} players, got {num_players}")
+    return float(get_table()[starting_hand_index(hole_cards), num_players - MIN_PLAYERS])
+
+
+def preflop_equity_batch(hole_cards: np.ndarray, num_players: np.ndarray) -> np.ndarray:
+    """`preflop_equity()` of a (n, 2) array of hole cards, each at its own table size."""
+    ranks = hole_cards.astype(np.int64) >> 2
+    high = np.maximum(ranks[:, 0], ranks[:, 1])
+    low = np.minimum(ranks[:, 0], ranks[:, 1])
+    suited = (hole_cards[:, 0] & 3) == (hole_cards[:, 1] & 3)
+    return get_table()[np.where(suited, high * 13 + low, low * 13 + high), np.asarray(num_players) - MIN_PLAYERS]
+
+
+def _simulate_hand(args: tuple[int, int, np.random.SeedSequence]) -> np.ndarray:
+    """Simulate one row of the table (one starting hand against every table size). Runs in a worker process."""
+    index, num_samples, seed = args
+    rng = np.random.default_rng(seed)
+    cards = representative_cards(index)
+    return np.array([estimate_equity(cards, (), num_players - 1, num_samples, rng=rng)[0] for num_players in range(MIN_PLAYERS, MAX_PLAYERS + 1)], dtype=np.float32)
+
+
+def generate_table(num_samples: int, seed: int = 0, workers: Optional[int] = None) -> np.ndarray:
+    """Simulate every starting hand at every table size, spreading the 169 rows across a process pool."""
+    seeds = np.random.SeedSequence(seed).spawn(NUM_STARTING_HANDS)
+    jobs = [(index, num_samples, seeds[index]) for index in range(NUM_STARTING_HANDS)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = list(pool.map(_simulate_hand, jobs, chunksize=4))
+    return np.stack(rows)
+
+
+def save_table(table: np.ndarray, path: str = TABLE_PATH) -> None:
+    global _table
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.save(path, table.astype(np.float32))
+    _table = None
+    log.info(f"Saved preflop equity table to {path}")
+
+
+def verify_table(table: np.ndarray, num_samples: int, num_checks: int, seed: int, tolerance: float = 4.0) -> bool:
+    """
+    Re-simulate `num_checks` random entries of the table with a fresh seed and check they agree within `tolerance` standard errors.
+
+    Also checks the table's shape and that every entry is a valid probability.
+    """
+    expected_shape = (NUM_STARTING_HANDS, MAX_PLAYERS - MIN_PLAYERS + 1)
+    if table.shape != expected_shape:
+        log.error(f"Table has shape {table.shape}, expected {expected_shape}")
+        return False
+    if not np.all((table > 0.0) & (table < 1.0)):
+        log.error("Table has entries outside of (0, 1)")
+        return False
+    rng = np.random.default_rng(seed)
+    ok: bool = True
+    for index, column in zip(rng.integers(0, NUM_STARTING_HANDS, num_checks), rng.integers(0, expected_shape[1], num_checks)):
+        result = estimate_equity(representative_cards(int(index)), (), int(column) + MIN_PLAYERS - 1, num_samples, rng=rng)
+        # The stored entry has its own sampling error, so allow for both
+        error: float = abs(result.equity - float(table[index, column]))
+        if error > tolerance * result.std_error * np.sqrt(2):
+            log.error(f"{starting_hand_name(int(index))} with {int(column) + MIN_PLAYERS} players: table = {table[index, column]:.4f}, simulated = {result.equity:.4f} +/- {result.std_error:.4f}")
+            ok = False
+    return ok
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Generate or verify the preflop equity table.")
+    parser.add_argument("command", choices=["generate", "verify"])
+    parser.add_argument("--samples", type=int, default=50000, help="runouts per table entry")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--checks", type=int, default=50, help="entries re-simulated by verify")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        start = time.perf_counter()
+        save_table(generate_table(args.samples, args.seed, args.workers))
+        log.info(f"Generated table in {time.perf_counter() - start:.1f}s")
+    else:
+        if verify_table(get_table(), args.samples, args.checks, args.seed + 1):
+            log.info("Preflop equity table verified")
+        else:
+            log.error("Preflop equity table failed verification")
+            raise SystemExit(1)
@@ -0,0 +1,378 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from gym_env.encoder import OBS_FLAT
+from gym_env.vector_env import TexasHoldemVectorEnv
+from inference import NUM_ACTIONS, MLPModel, best_legal
+from qtable import QTable
+from replay import ReplayBuffer
+from util import ColoredFormatter, PlayerAction
+
+log = logging.getLogger(__name__)
+
+# A saved network is one .npz file holding the layers (weight0, bias0, weight1, ...) and a JSON `meta` string with the format
+# version, the layer sizes and the env settings the network was trained with
+FORMAT_VERSION: int = 1
+
+
+class QNetwork(MLPModel):
+    """
+    Q-function approximated by an MLP over flat float32 observations (`OBS_FLAT`), trained with minibatch semi-gradient Q-learning.
+
+    With no hidden layers it is a linear model. Every forward pass is batched over a (batch, features) array. `train_batch()`
+    takes one Adam step on the Huber loss of a minibatch's TD errors, bootstrapping from a target network (synced every
+    `target_every` steps) through the best *legal* next action. As a `PolicyModel` it plugs into an `InferenceServer`.
+    """
+
+    def __init__(self, weights: Sequence[np.ndarray], biases: Sequence[np.ndarray], learning_rate: float = 1e-3, target_every: int = 500, **metadata):
+        super().__init__(weights, biases)
+        self.sizes: list[int] = [self.weights[0].shape[0], *(bias.shape[0] for bias in self.biases)]
+        self.learning_rate: float = learning_rate
+        self.target_every: int = target_every
+        # Env settings stored with the weights (see save())
+        self.metadata: dict = metadata
+        self.steps: int = 0
+        self.parameters: list[np.ndarray] = [array for layer in zip(self.weights, self.biases) for array in layer]
+        # Adam moments, one pair per parameter array
+        self.moments: list[np.ndarray] = [np.zeros_like(array) for array in self.parameters]
+        self.squares: list[np.ndarray] = [np.zeros_like(array) for array in self.parameters]
+        self.target: MLPModel = MLPModel([weight.copy() for weight in self.weights], [bias.copy() for bias in self.biases])
+
+    @property
+    def num_features(self) -> int:
+        return self.sizes[0]
+
+    def sync_target(self) -> None:
+        """Copy the current weights into the target network."""
+        for target, parameter in zip((*self.target.weights, *self.target.biases), (*self.weights, *self.biases)):
+            target[:] = parameter
+
+    def forward(self, observations: np.ndarray) -> list[np.ndarray]:
+        """The activations of every layer, from the observations to the Q-values (kept for backpropagation)."""
+        activations = [np.asarray(observations, dtype=np.float32)]
+        for layer, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            hidden = activations[-1] @ weight + bias
+            if layer < len(self.weights) - 1:
+                np.maximum(hidden, 0.0, out=hidden)
+            activations.append(hidden)
+        return activations
+
+    def greedy(self, observations: np.ndarray, legal: np.ndarray) -> np.ndarray:
+        """The best legal action of each observation."""
+        return best_legal(self(observations, legal), legal)
+
+    def targets(self, rewards: np.ndarray, next_observations: np.ndarray, dones: np.ndarray, next_legal: np.ndarray, discount_rate: float) -> np.ndarray:
+        """TD targets r + discount * max over legal a' of Q_target(s', a'), without bootstrapping from terminal (or move-less) states."""
+        next_values = np.where(next_legal, self.target(next_observations, next_legal), -np.inf).max(axis=1)
+        bootstrap = ~np.asarray(dones, dtype=bool) & next_legal.any(axis=1)
+        return np.asarray(rewards, dtype=np.float32) + discount_rate * np.where(bootstrap, next_values, 0.0).astype(np.float32)
+
+    def gradients(self, activations: list[np.ndarray], output_grad: np.ndarray) -> list[np.ndarray]:
+        """Backpropagate d(loss)/d(Q-values) through the layers, returning gradients in the order of `parameters`."""
+        grads: list[np.ndarray] = []
+        grad = output_grad
+        for layer in range(len(self.weights) - 1, -1, -1):
+            grads.append(grad.sum(axis=0))
+            grads.append(activations[layer].T @ grad)
+            if layer > 0:
+                grad = (grad @ self.weights[layer].T) * (activations[layer] > 0.0)
+        return grads[::-1]
+
+    def train_batch(self, observations: np.ndarray, actions: np.ndarray, rewards: np.ndarray, next_observations: np.ndarray, dones: np.ndarray,
+                    next_legal: np.ndarray, discount_rate: float, weights: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Take one gradient step on a minibatch of transitions, optionally importance-weighted (see `ReplayBuffer.sample()`).
+
+        TD errors are clipped to [-1, 1] in the gradient (the Huber loss), and the unclipped errors are returned, e.g. as new
+        replay priorities.
+        """
+        actions = np.asarray(actions, dtype=np.int64)
+        rows = np.arange(len(actions))
+        targets = self.targets(rewards, next_observations, dones, next_legal, discount_rate)
+        activations = self.forward(observations)
+        td_errors = targets - activations[-1][rows, actions]
+        output_grad = np.zeros_like(activations[-1])
+        clipped = np.clip(td_errors, -1.0, 1.0)
+        if weights is not None:
+            clipped *= weights
+        output_grad[rows, actions] = -clipped / len(actions)
+        self.apply_gradients(self.gradients(activations, output_grad))
+        return td_errors
+
+    def apply_gradients(self, grads: list[np.ndarray], beta1: float = 0.9, beta2: float = 0.999, epsilon: float = 1e-8) -> None:
+        """One Adam step (updating the weights in place), syncing the target network every `target_every` steps."""
+        self.steps += 1
+        step_size = self.learning_rate * np.sqrt(1.0 - beta2 ** self.steps) / (1.0 - beta1 ** self.steps)
+        for parameter, grad, moment, square in zip(self.parameters, grads, self.moments, self.squares):
+            moment *= beta1
+            moment += (1.0 - beta1) * grad
+            square *= beta2
+            square += (1.0 - beta2) * np.square(grad)
+            parameter -= step_size * moment / (np.sqrt(square) + epsilon)
+        if self.steps % self.target_every == 0:
+            self.sync_target()
+
+    def save(self, path: str) -> None:
+        """Save the weights to an .npz file (written to a temporary file first, so an interrupted save keeps the last one)."""
+        meta = {'version': FORMAT_VERSION, 'sizes': self.sizes, **self.metadata}
+        layers = {f"{name}{layer}": array for layer, pair in enumerate(zip(self.weights, self.biases)) for name, array in zip(("weight", "bias"), pair)}
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, meta=np.array(json.dumps(meta)), **layers)
+        os.replace(path + ".tmp", path)
+        log.info(f"Saved Q-network {self.sizes} to {path}")
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "QNetwork":
+        """Load weights saved by `save()`. Keyword arguments set the training settings (learning rate, target sync)."""
+        with np.load(path) as data:
+            meta: dict = json.loads(str(data['meta']))
+            if meta.get('version') != FORMAT_VERSION:
+                raise ValueError(f"Q-network {path} has format version {meta.get('version')}, expected {FORMAT_VERSION}")
+            layers = len(meta['sizes']) - 1
+            weights = [data[f"weight{layer}"] for layer in range(layers)]
+            biases = [data[f"bias{layer}"] for layer in range(layers)]
+        metadata = {key: value for key, value in meta.items() if key not in ('version', 'sizes')}
+        return cls(weights, biases, **kwargs, **metadata)
+
+    @classmethod
+    def create(cls, sizes: Sequence[int], rng: np.random.Generator, **kwargs) -> "QNetwork":
+        """A He-initialized network with layers of the given sizes (features first, NUM_ACTIONS last)."""
+        model = MLPModel.random(sizes, rng)
+        return cls(model.weights, model.biases, **kwargs)
+
+
+class TrainingStats(NamedTuple):
+    steps: int  # env steps, each one decision on every table
+    transitions: int
+    updates: int
+    episodes: int
+    episodes_won: int
+    mean_abs_td_error: float  # over the last `log_every` steps
+
+
+def random_legal(legal: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """A uniformly random legal action for each row of a legal move mask (like `RandomPlayer`)."""
+    return np.argmax(rng.random(legal.shape) * legal, axis=1)
+
+
+def train(network: QNetwork, env: TexasHoldemVectorEnv, buffer: ReplayBuffer, steps: int, batch_size: int = 64, updates_per_step: int = 1,
+          discount_rate: float = 0.9, epsilon_start: float = 1.0, epsilon_end: float = 0.05, epsilon_steps: int = 10000, reward_scale: float = 1.0,
+          beta: float = 0.4, seed: int = 0, log_every: int = 1000) -> TrainingStats:
+    """
+    Train on every table of a flat-observation vector env at once: one batched forward pass picks the epsilon-greedy actions of all
+    tables, every real transition goes into the replay buffer, and `updates_per_step` minibatches are learned from after each step.
+
+    Epsilon decays linearly from `epsilon_start` to `epsilon_end` over `epsilon_steps` steps. Rewards are multiplied by `reward_scale`
+    (the game-over payouts are hundreds of chips, which is a poor scale for a network's outputs).
+    """
+    rng = np.random.default_rng(seed)
+    observations, info = env.reset(seed=seed)
+    observations = observations.copy()
+    legal: np.ndarray = info['legal_moves'].copy()
+    restarting = np.zeros(env.num_envs, dtype=bool)
+    transitions = updates = episodes = episodes_won = 0
+    td_total, td_count = 0.0, 0
+    for step in range(steps):
+        epsilon = max(epsilon_end, epsilon_start + (epsilon_end - epsilon_start) * step / max(epsilon_steps, 1))
+        actions = np.where(rng.random(env.num_envs) < epsilon, random_legal(legal, rng), network.greedy(observations, legal))
+        next_observations, rewards, terminated, truncated, info = env.step(actions)
+        next_legal = info['legal_moves']
+
+        # Tables that were restarting ignored their action (see the env's NEXT_STEP autoreset), so they made no transition
+        stepped = ~restarting
+        buffer.add_batch(observations[stepped], actions[stepped], rewards[stepped] * reward_scale, next_observations[stepped], terminated[stepped], next_legal[stepped])
+        transitions += int(stepped.sum())
+        finished = stepped & terminated
+        episodes += int(finished.sum())
+        episodes_won += int((finished & (rewards > 0)).sum())
+
+        if len(buffer) >= batch_size:
+            for _ in range(updates_per_step):
+                batch = buffer.sample(batch_size, rng, beta)
+                td_errors = network.train_batch(batch.observations, batch.actions, batch.rewards, batch.next_observations, batch.dones, batch.next_legal,
+                                                discount_rate, batch.weights if buffer.prioritized else None)
+                buffer.update_priorities(batch.indices, td_errors)
+                td_total += float(np.abs(td_errors).sum())
+                td_count += len(td_errors)
+                updates += 1
+
+        observations[:] = next_observations
+        legal = next_legal.copy()
+        restarting = terminated | truncated
+        if log_every and (step + 1) % log_every == 0:
+            log.info(f"Step {step + 1}: {transitions} transitions, {updates} updates, epsilon {epsilon:.3f}, "
+                     f"won {episodes_won}/{episodes} episodes, |TD error| {td_total / max(td_count, 1):.4f}")
+            td_total, td_count = 0.0, 0
+    return TrainingStats(steps, transitions, updates, episodes, episodes_won, td_total / max(td_count, 1))
+
+
+def evaluate(network: QNetwork, env: TexasHoldemVectorEnv, episodes: int, seed: int = 0) -> float:
+    """Play the greedy policy on every table until `episodes` games have finished, returning the fraction won."""
+    observations, info = env.reset(seed=seed)
+    restarting = np.zeros(env.num_envs, dtype=bool)
+    finished = won = 0
+    while finished < episodes:
+        observations, rewards, terminated, truncated, info = env.step(network.greedy(observations, info['legal_moves']))
+        done = ~restarting & terminated
+        finished += int(done.sum())
+        won += int((done & (rewards > 0)).sum())
+        restarting = terminated | truncated
+    return won / finished
+
+
+def run_checks(seed: int = 0) -> bool:
+    """Check the backpropagated gradients against finite differences and a save/load round trip."""
+    rng = np.random.default_rng(seed)
+    ok: bool = True
+    network = QNetwork.create([12, 16, 8, NUM_ACTIONS], rng)
+    observations = rng.random((32, 12)).astype(np.float32)
+    actions = rng.integers(NUM_ACTIONS, size=32)
+    targets = rng.normal(0.0, 0.5, 32).astype(np.float32)
+
+    def loss() -> float:
+        q = network.forward(observations)[-1][np.arange(32), actions].astype(np.float64)
+        return float(0.5 * np.mean(np.square(targets - q)))
+
+    activations = network.forward(observations)
+    output_grad = np.zeros_like(activations[-1])
+    output_grad[np.arange(32), actions] = -(targets - activations[-1][np.arange(32), actions]) / 32
+    grads = network.gradients(activations, output_grad)
+    for array, grad in zip(network.parameters, grads):
+        for index in rng.choice(array.size, size=min(5, array.size), replace=False):
+            flat = array.reshape(-1)
+            original = flat[index]
+            flat[index] = original + 1e-2
+            up = loss()
+            flat[index] = original - 1e-2
+            down = loss()
+            flat[index] = original
+            numeric = (up - down) / 2e-2
+            if abs(numeric - grad.reshape(-1)[index]) > 1e-3 + 1e-2 * abs(numeric):
+                log.error(f"Gradient mismatch for a {array.shape} parameter: backprop {grad.reshape(-1)[index]:.6f}, numeric {numeric:.6f}")
+                ok = False
+
+    legal = rng.random((32, NUM_ACTIONS)) < 0.6
+    legal[:, PlayerAction.FOLD.value] = True
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "network.npz")
+        network.metadata['num_players'] = 2
+        network.save(path)
+        loaded = QNetwork.load(path)
+    if not np.array_equal(loaded(observations, legal), network(observations, legal)) or loaded.metadata != network.metadata:
+        log.error("Loaded network differs from the saved one")
+        ok = False
+    if not np.all(legal[np.arange(32), network.greedy(observations, legal)]):
+        log.error("Greedy actions include illegal moves")
+        ok = False
+    return ok
+
+
+def run_benchmark(num_features: int, hidden: Sequence[int], batch_size: int, seconds: float, seed: int = 0) -> None:
+    """Compare the transitions learned from per second by `QNetwork.train_batch()` and by the tabular `QTable` updates."""
+    rng = np.random.default_rng(seed)
+    network = QNetwork.create([num_features, *hidden, NUM_ACTIONS], rng)
+    observations = rng.random((batch_size, num_features)).astype(np.float32)
+    next_observations = rng.random((batch_size, num_features)).astype(np.float32)
+    actions = rng.integers(NUM_ACTIONS, size=batch_size)
+    rewards = rng.normal(size=batch_size).astype(np.float32)
+    dones = rng.random(batch_size) < 0.1
+    next_legal = np.ones((batch_size, NUM_ACTIONS), dtype=bool)
+
+    space = TexasHoldemVectorEnv(1, 100, 2, 5, 4).single_observation_space
+    table = QTable(space, NUM_ACTIONS)  # type: ignore
+    states = np.array([[int(part.sample()) for part in space.spaces] for _ in range(batch_size)])  # type: ignore
+    indices = table.state_indices(states)
+
+    def rate(step) -> float:
+        done, start = 0, time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            done += step()
+        return done / (time.perf_counter() - start)
+
+    def network_step() -> int:
+        network.train_batch(observations, actions, rewards, next_observations, dones, next_legal, 0.9)
+        return batch_size
+
+    def table_step() -> int:
+        for state, action, reward, next_state in zip(states, actions, rewards, states[::-1]):
+            table.update(state, int(action), float(reward), next_state, 0.1, 0.9)
+        return batch_size
+
+    def table_batch_step() -> int:
+        table.update_batch(indices, actions, rewards, indices[::-1], 0.1, 0.9, dones)
+        return batch_size
+
+    log.info(f"QNetwork {network.sizes}: {rate(network_step):.0f} transitions/s in minibatches of {batch_size}")
+    log.info(f"QTable: {rate(table_step):.0f} transitions/s one update at a time, {rate(table_batch_step):.0f} transitions/s in batches of {batch_size}")
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+    # The batched game logs every finished game at INFO
+    logging.getLogger("batched_poker").setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="Train a Q-network agent against random agents on a vector env.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    train_parser = subparsers.add_parser("train", help="train a Q-network (or keep training a saved one) and save its weights")
+    train_parser.add_argument("--steps", type=int, default=20000, help="env steps (each one decision on every table)")
+    train_parser.add_argument("--envs", type=int, default=64, help="tables played in lockstep")
+    train_parser.add_argument("--players", type=int, default=4)
+    train_parser.add_argument("--equity-samples", type=int, default=0, help="runouts for the equity feature (0 = no equity feature)")
+    train_parser.add_argument("--hidden", type=int, nargs="*", default=[64, 64], help="hidden layer sizes (none = a linear model)")
+    train_parser.add_argument("--learning-rate", type=float, default=1e-3)
+    train_parser.add_argument("--discount-rate", type=float, default=0.9)
+    train_parser.add_argument("--batch-size", type=int, default=64)
+    train_parser.add_argument("--updates-per-step", type=int, default=1)
+    train_parser.add_argument("--target-every", type=int, default=500, help="updates between target network syncs")
+    train_parser.add_argument("--epsilon-steps", type=int, default=10000, help="steps over which exploration decays")
+    train_parser.add_argument("--replay-capacity", type=int, default=200000)
+    train_parser.add_argument("--prioritized", action="store_true", help="sample the replay buffer in proportion to TD error")
+    train_parser.add_argument("--eval-episodes", type=int, default=1000, help="greedy games played after training (0 = none)")
+    train_parser.add_argument("--out", default="q_network.npz", help="file the weights are saved to (and resumed from if it exists)")
+    train_parser.add_argument("--seed", type=int, default=0)
+    bench_parser = subparsers.add_parser("bench", help="check the network and compare its update throughput with the Q-table's")
+    bench_parser.add_argument("--features", type=int, default=200, help="features per observation")
+    bench_parser.add_argument("--hidden", type=int, nargs="*", default=[64, 64])
+    bench_parser.add_argument("--batch-size", type=int, default=64)
+    bench_parser.add_argument("--seconds", type=float, default=2.0, help="time spent measuring each rate")
+    bench_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        if not run_checks(seed=args.seed):
+            raise SystemExit(1)
+        log.info("Q-network checks passed")
+        run_benchmark(args.features, args.hidden, args.batch_size, args.seconds, args.seed)
+    else:
+        env = TexasHoldemVectorEnv(args.envs, 100, 2, 5, args.players, observation_mode=OBS_FLAT, equity_samples=args.equity_samples)
+        settings = {'initial_bankroll': 100, 'small_blind': 2, 'big_blind': 5, 'num_players': args.players, 'equity_samples': args.equity_samples}
+        if os.path.exists(args.out):
+            network = QNetwork.load(args.out, learning_rate=args.learning_rate, target_every=args.target_every)
+            if network.metadata != settings:
+                raise SystemExit(f"{args.out} was trained with {network.metadata}, not {settings}")
+            log.info(f"Resuming from {args.out}")
+        else:
+            sizes = [env.single_observation_space.shape[0], *args.hidden, NUM_ACTIONS]  # type: ignore
+            network = QNetwork.create(sizes, np.random.default_rng(args.seed), learning_rate=args.learning_rate, target_every=args.target_every, **settings)
+        buffer = ReplayBuffer.for_space(env.single_observation_space, args.replay_capacity, prioritized=args.prioritized)
+        start = time.perf_counter()
+        stats = train(network, env, buffer, args.steps, args.batch_size, args.updates_per_step, args.discount_rate, epsilon_steps=args.epsilon_steps,
+                      reward_scale=1.0 / (100 * args.players), seed=args.seed)
+        elapsed = time.perf_counter() - start
+        log.info(f"Trained on {stats.transitions} transitions with {stats.updates} updates in {elapsed:.1f}s ({stats.transitions / elapsed:.0f} transitions/s)")
+        network.save(args.out)
+        if args.eval_episodes > 0:
+            win_rate = evaluate(network, env, args.eval_episodes, seed=args.seed + 1)
+            log.info(f"Greedy policy won {100 * win_rate:.1f}% of {args.eval_episodes} games against {args.players - 1} random agents")
@@ -0,0 +1,262 @@
+import argparse
+import logging
+import time
+from collections import defaultdict
+from typing import Iterable, Optional, Sequence
+
+import numpy as np
+from gymnasium import spaces
+
+from agents.player import Player
+from agents.random_player import RandomPlayer
+from gym_env.env import TexasHoldemEnv
+from policy import FALLBACK_CHECK_CALL, save_policy
+from rng_streams import EpisodeSeeds
+from util import ColoredFormatter, PlayerAction
+
+log = logging.getLogger(__name__)
+
+
+def legal_mask(legal_moves: Iterable[PlayerAction], num_actions: int) -> np.ndarray:
+    """Convert a list of legal moves (like `info['legal_moves']`) to a boolean mask over the action space."""
+    mask = np.zeros(num_actions, dtype=bool)
+    for move in legal_moves:
+        mask[move.value] = True
+    return mask
+
+
+class ObservationIndexer:
+    """
+    Maps observations from a space made of bounded `Discrete` parts (like `TexasHoldemEnv.observation_space`) to flat state
+    indices in [0, num_states), by mixed-radix index arithmetic.
+    """
+
+    def __init__(self, observation_space: spaces.Tuple):
+        parts: Sequence[spaces.Space] = observation_space.spaces
+        if not all(isinstance(part, spaces.Discrete) for part in parts):
+            raise ValueError(f"Observations can only be indexed in a space of Discrete parts, got {observation_space}")
+        self.starts: np.ndarray = np.array([int(part.start) for part in parts], dtype=np.int64)  # type: ignore
+        self.sizes: np.ndarray = np.array([int(part.n) for part in parts], dtype=np.int64)  # type: ignore
+        # Row-major strides - the last part varies fastest
+        self.strides: np.ndarray = np.concatenate((np.cumprod(self.sizes[::-1])[::-1][1:], [1])).astype(np.int64)
+        self.num_states: int = int(np.prod(self.sizes))
+        # Plain-int copies for the scalar path, which is faster than going through NumPy for one observation
+        self._starts: list[int] = self.starts.tolist()
+        self._strides: list[int] = self.strides.tolist()
+
+    def state_index(self, observation: Sequence[int]) -> int:
+        """Map one observation tuple to its state index."""
+        if isinstance(observation, np.ndarray):
+            observation = observation.tolist()  # Python ints do the index arithmetic much faster than NumPy scalars
+        index: int = 0
+        for value, start, stride in zip(observation, self._starts, self._strides):
+            index += (value - start) * stride
+        return index
+
+    def state_indices(self, observations) -> np.ndarray:
+        """Map a batch of observations - an (N, parts) array, a list of observation tuples or a tuple of per-part arrays - to state indices."""
+        if isinstance(observations, tuple):
+            observations = np.stack([np.asarray(part) for part in observations], axis=1)
+        offsets = np.asarray(observations, dtype=np.int64).reshape(-1, len(self.sizes)) - self.starts
+        if ((offsets < 0) | (offsets >= self.sizes)).any():
+            raise ValueError("Observation outside of the observation space")
+        return offsets @ self.strides
+
+
+class QTable(ObservationIndexer):
+    """
+    Dense Q-table keeping one contiguous (num_states, num_actions) array of values.
+
+    Lookups and updates need no hashing and batches of transitions can be applied at once. Rows that were ever updated are tracked
+    in `visited`, which plays the role of `state in qtable` for the dict-based table this replaces.
+    """
+
+    def __init__(self, observation_space: spaces.Tuple, num_actions: int, dtype: type = np.float64):
+        super().__init__(observation_space)
+        self.num_actions: int = num_actions
+        self.values: np.ndarray = np.zeros((self.num_states, num_actions), dtype=dtype)
+        self.visited: np.ndarray = np.zeros(self.num_states, dtype=bool)
+
+    def greedy(self, observation: Sequence[int], legal: Optional[np.ndarray] = None) -> int:
+        """Get the best action for an observation, only considering actions allowed by the `legal` mask (if given)."""
+        row = self.values[self.state_index(observation)]
+        if legal is None:
+            return int(np.argmax(row))
+        return int(np.argmax(np.where(legal, row, -np.inf)))
+
+    def greedy_batch(self, states: np.ndarray, legal: Optional[np.ndarray] = None) -> np.ndarray:
+        """Get the best action for each row index in `states`, masked by an (N, num_actions) `legal` array (if given)."""
+        rows = self.values[states]
+        if legal is None:
+            return np.argmax(rows, axis=1)
+        return np.argmax(np.where(legal, rows, -np.inf), axis=1)
+
+    def greedy_policy(self) -> np.ndarray:
+        """Get the unmasked greedy action of every state, e.g. to ship to rollout workers."""
+        return np.argmax(self.values, axis=1).astype(np.int8)
+
+    def update(self, observation: Sequence[int], action: int, reward: float, next_observation: Sequence[int], learning_rate: float, discount_rate: float) -> None:
+        """
+        Apply one Q-learning update, exactly like `qtable[s][a] += lr * (r + discount * max(qtable[s']) - qtable[s][a])` on a dict table.
+
+        This is still one lookup and one store per transition, only modestly faster than the dict loop - learners that can
+        collect transitions first should apply them with `update_batch()`, which is an order of magnitude faster per transition.
+        """
+        state: int = self.state_index(observation)
+        next_state: int = self.state_index(next_observation)
+        values = self.values
+        # Plain floats: NumPy's reductions and scalar arithmetic cost more than the update itself on a row of a few actions
+        current: float = float(values[state, action])
+        values[state, action] = current + learning_rate * (reward + discount_rate * max(values[next_state].tolist()) - current)
+        self.visited[state] = True
+        self.visited[next_state] = True
+
+    def update_batch(self, states: np.ndarray, actions: np.ndarray, rewards: np.ndarray, next_states: np.ndarray, learning_rate: float, discount_rate: float, dones: Optional[np.ndarray] = None,
+                     weights: Optional[np.ndarray] = None) -> None:
+        """
+        Apply the Q-learning updates of a batch of transitions (given as row indices) at once.
+
+        TD targets are bootstrapped from the values at the start of the batch. A (state, action) pair that appears k times gets
+        the same result as k sequential updates towards its targets, in batch order: (1 - lr)^k * q + sum(lr * (1 - lr)^(k - j) * target_j).
+        With `dones`, terminal transitions don't bootstrap from their next state. With `weights` (e.g. the importance-sampling
+        weights of a prioritized replay batch), each transition's update uses the learning rate `lr * weight` instead.
+        """
+        states = np.asarray(states, dtype=np.int64)
+        actions = np.asarray(actions, dtype=np.int64)
+        next_targets = self.values[next_states].max(axis=1)
+        if dones is not None:
+            next_targets = np.where(dones, 0.0, next_targets)
+        targets = np.asarray(rewards, dtype=np.float64) + discount_rate * next_targets
+
+        flat = states * self.num_actions + actions
+        pairs, inverse, counts = np.unique(flat, return_inverse=True, return_counts=True)
+        # Position of each transition among the updates to its pair, in batch order
+        order = np.argsort(inverse, kind="stable")
+        occurrence = np.empty(len(flat), dtype=np.int64)
+        occurrence[order] = np.arange(len(flat)) - np.repeat(np.cumsum(counts) - counts, counts)
+        values = self.values.reshape(-1)
+        if weights is None:
+            keep = 1.0 - learning_rate
+            update_weights = learning_rate * keep ** (counts[inverse] - 1 - occurrence)
+            values[pairs] = keep ** counts * values[pairs] + np.bincount(inverse, weights=update_weights * targets, minlength=len(pairs))
+        else:
+            # No closed form with a rate per transition: apply the j-th update of every pair together, for j = 0, 1, ... - each
+            # round touches a pair at most once, so it is exactly the sequential update
+            rates = learning_rate * np.asarray(weights, dtype=np.float64)
+            for level in range(int(counts.max(initial=0))):
+                at = occurrence == level
+                pair = flat[at]
+                values[pair] += rates[at] * (targets[at] - values[pair])
+        self.visited[states] = True
+        self.visited[next_states] = True
+
+    def td_errors(self, states: np.ndarray, actions: np.ndarray, rewards: np.ndarray, next_states: np.ndarray, discount_rate: float, dones: Optional[np.ndarray] = None) -> np.ndarray:
+        """TD errors of a batch of transitions (given as row indices) under the current values, e.g. as replay priorities."""
+        next_targets = self.values[next_states].max(axis=1)
+        if dones is not None:
+            next_targets = np.where(dones, 0.0, next_targets)
+        return np.asarray(rewards, dtype=np.float64) + discount_rate * next_targets - self.values[states, actions]
+
+    def export_policy(self, path: str, fallback: str = FALLBACK_CHECK_CALL, **metadata) -> None:
+        """Freeze the table's greedy policy into a compact read-only file for `FrozenPolicy`/`QPlayer` (see `policy.save_policy()`)."""
+        save_policy(path, self.values, self.visited, self._starts, self.sizes.tolist(), fallback, **metadata)
+
+
+def collect_transitions(num_episodes: int, num_players: int, seed: int, max_steps: int = 200) -> tuple[TexasHoldemEnv, list[tuple]]:
+    """Play random legal moves against random opponents, returning the env and every (state, action, reward, next state) transition."""
+    env = TexasHoldemEnv(100, 2, 5, [Player("Learner", False)] + [RandomPlayer() for _ in range(num_players - 1)])
+    transitions: list[tuple] = []
+    for episode in range(num_episodes):
+        seeds = EpisodeSeeds(seed, 0, episode)
+        exploration = seeds.exploration()
+        state, info = seeds.reset(env)
+        for _ in range(max_steps):
+            action: int = info['legal_moves'][exploration.integers(len(info['legal_moves']))].value
+            new_state, reward, done, truncated, info = env.step(PlayerAction(action))
+            transitions.append((state, action, float(reward), new_state))
+            state = new_state
+            if done or truncated:
+                break
+    return env, transitions
+
+
+def run_parity_check(num_episodes: int = 200, num_players: int = 4, batch_size: int = 256, seed: int = 0) -> None:
+    """
+    Check `QTable` against the dict-based Q-learning loop from `training.py` on the same transitions, raising on a mismatch.
+
+    Sequential `update()` must match the dict loop. `update_batch()` must match the dict loop applied to each batch with targets
+    frozen at the start of the batch (the only way batched updates are allowed to differ).
+    """
+    learning_rate, discount_rate = 0.1, 0.1
+    env, transitions = collect_transitions(num_episodes, num_players, seed)
+    action_size: int = env.action_space.n  # type: ignore
+
+    start = time.perf_counter()
+    qtable: defaultdict = defaultdict(lambda: np.zeros(action_size))
+    for state, action, reward, new_state in transitions:
+        qtable[state][action] = qtable[state][action] + learning_rate * (reward + discount_rate * np.max(qtable[new_state]) - qtable[state][action])
+    dict_time = time.perf_counter() - start
+
+    dense = QTable(env.observation_space, action_size)
+    start = time.perf_counter()
+    for state, action, reward, new_state in transitions:
+        dense.update(state, action, reward, new_state, learning_rate, discount_rate)
+    dense_time = time.perf_counter() - start
+    for state, values in qtable.items():
+        if not np.allclose(dense.values[dense.state_index(state)], values, rtol=0, atol=1e-9):
+            raise AssertionError(f"QTable.update() differs from the dict loop for state {state}: {dense.values[dense.state_index(state)]} != {values}")
+    if dense.visited.sum() != len(qtable):
+        raise AssertionError(f"QTable visited {dense.visited.sum()} states, the dict loop {len(qtable)}")
+
+    frozen: defaultdict = defaultdict(lambda: np.zeros(action_size))
+    batched = QTable(env.observation_space, action_size)
+    # The same batches again with a learning rate scaled per transition, as prioritized replay does
+    weighted_frozen: defaultdict = defaultdict(lambda: np.zeros(action_size))
+    weighted = QTable(env.observation_space, action_size)
+    weights = np.random.default_rng(seed).random(len(transitions))
+    states = batched.state_indices([t[0] for t in transitions])
+    actions = np.array([t[1] for t in transitions])
+    rewards = np.array([t[2] for t in transitions])
+    next_states = batched.state_indices([t[3] for t in transitions])
+    batch_time = 0.0
+    for begin in range(0, len(transitions), batch_size):
+        batch = transitions[begin:begin + batch_size]
+        targets = [reward + discount_rate * np.max(frozen[new_state]) for _, _, reward, new_state in batch]
+        for (state, action, _, _), target in zip(batch, targets):
+            frozen[state][action] = frozen[state][action] + learning_rate * (target - frozen[state][action])
+        start = time.perf_counter()
+        end = begin + batch_size
+        batched.update_batch(states[begin:end], actions[begin:end], rewards[begin:end], next_states[begin:end], learning_rate, discount_rate)
+        batch_time += time.perf_counter() - start
+
+        targets = [reward + discount_rate * np.max(weighted_frozen[new_state]) for _, _, reward, new_state in batch]
+        for (state, action, _, _), target, weight in zip(batch, targets, weights[begin:end]):
+            weighted_frozen[state][action] = weighted_frozen[state][action] + learning_rate * weight * (target - weighted_frozen[state][action])
+        weighted.update_batch(states[begin:end], actions[begin:end], rewards[begin:end], next_states[begin:end], learning_rate, discount_rate, weights=weights[begin:end])
+    for name, table, expected in (("update_batch()", batched, frozen), ("update_batch(weights=...)", weighted, weighted_frozen)):
+        for state, values in expected.items():
+            if not np.allclose(table.values[table.state_index(state)], values, rtol=0, atol=1e-9):
+                raise AssertionError(f"QTable.{name} differs from the frozen-target dict loop for state {state}: {table.values[table.state_index(state)]} != {values}")
+
+    log.error(f"{len(transitions)} transitions, {len(qtable)} states: dict loop {dict_time * 1e6 / len(transitions):.2f} us, "
+              f"QTable.update {dense_time * 1e6 / len(transitions):.2f} us, QTable.update_batch {batch_time * 1e6 / len(transitions):.2f} us per transition "
+              f"(batch max diff from sequential: {np.abs(batched.values - dense.values).max():.2e})")
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.ERROR)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.ERROR)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Check the dense QTable against the dict-based Q-learning loop.")
+    parser.add_argument("--episodes", type=int, default=200)
+    parser.add_argument("--players", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for num_players in args.players:
+        run_parity_check(args.episodes, num_players, args.batch_size, args.seed)
@@ -0,0 +1,330 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+from gymnasium import spaces
+
+from util import ColoredFormatter, PlayerAction
+
+log = logging.getLogger(__name__)
+
+NUM_ACTIONS: int = len(PlayerAction) - 2  # The blinds are never chosen by agents
+# Added to |TD error| so no transition's priority drops to 0 and it can still be sampled
+PRIORITY_EPSILON: float = 1e-3
+
+
+class SumTree:
+    """
+    Binary tree over `capacity` leaf priorities whose inner nodes hold the sum (and the minimum) of their children.
+
+    Leaves live at [size, 2 * size) of flat arrays, with node i's children at 2i and 2i + 1. Updating k leaves and drawing k
+    samples are both O(k log n), done one tree level at a time for the whole batch.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity: int = capacity
+        self.depth: int = max(int(np.ceil(np.log2(capacity))), 0)
+        self.size: int = 1 << self.depth
+        self.sums: np.ndarray = np.zeros(2 * self.size, dtype=np.float64)
+        # Empty leaves hold +inf, so they never count as the smallest priority
+        self.mins: np.ndarray = np.full(2 * self.size, np.inf, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        return float(self.sums[1])
+
+    @property
+    def min(self) -> float:
+        return float(self.mins[1])
+
+    def get(self, indices: np.ndarray) -> np.ndarray:
+        return self.sums[self.size + np.asarray(indices)]
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray) -> None:
+        """Set the priorities of leaves `indices` (the last one wins for repeated indices) and fix up their ancestors."""
+        nodes = self.size + np.asarray(indices, dtype=np.int64)
+        self.sums[nodes] = priorities
+        self.mins[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes >> 1)
+            self.sums[nodes] = self.sums[2 * nodes] + self.sums[2 * nodes + 1]
+            self.mins[nodes] = np.minimum(self.mins[2 * nodes], self.mins[2 * nodes + 1])
+
+    def find(self, targets: np.ndarray) -> np.ndarray:
+        """For each target in [0, total), the leaf whose span of the running sum of priorities contains it."""
+        nodes = np.ones(len(targets), dtype=np.int64)
+        targets = np.array(targets, dtype=np.float64)
+        for _ in range(self.depth):
+            left = self.sums[2 * nodes]
+            right = targets >= left
+            targets -= np.where(right, left, 0.0)
+            nodes = 2 * nodes + right
+        # Rounding can walk off into an empty leaf at the very end of the range, so step back onto the last real one
+        return np.minimum(nodes - self.size, self.capacity - 1)
+
+
+class ReplayBatch(NamedTuple):
+    indices: np.ndarray  # Buffer slots, for update_priorities()
+    observations: np.ndarray
+    actions: np.ndarray
+    rewards: np.ndarray
+    next_observations: np.ndarray
+    dones: np.ndarray
+    next_legal: np.ndarray  # (batch, NUM_ACTIONS) legal moves in the next state
+    weights: np.ndarray  # Importance-sampling weights (all 1 for uniform sampling)
+
+
+class ReplayBuffer:
+    """
+    Fixed-capacity ring buffer of transitions stored in preallocated NumPy columns, overwriting the oldest once full.
+
+    Minibatches are sampled uniformly, or with `prioritized` in proportion to priority ** alpha through a `SumTree` (prioritized
+    experience replay, Schaul et al. 2016). New transitions get the highest priority seen so far, so each is likely to be replayed
+    at least once before `update_priorities()` sets its priority from its TD error.
+    """
+
+    def __init__(self, capacity: int, observation_shape: tuple[int, ...], observation_dtype: type = np.float32, prioritized: bool = False, alpha: float = 0.6):
+        if capacity < 1:
+            raise ValueError(f"Capacity must be at least 1, got {capacity}")
+        self.capacity: int = capacity
+        self.observations: np.ndarray = np.zeros((capacity, *observation_shape), dtype=observation_dtype)
+        self.actions: np.ndarray = np.zeros(capacity, dtype=np.int8)
+        self.rewards: np.ndarray = np.zeros(capacity, dtype=np.float32)
+        self.next_observations: np.ndarray = np.zeros((capacity, *observation_shape), dtype=observation_dtype)
+        self.dones: np.ndarray = np.zeros(capacity, dtype=bool)
+        self.next_legal: np.ndarray = np.zeros((capacity, NUM_ACTIONS), dtype=bool)
+        # Next slot to write, and the number of slots holding transitions
+        self.head: int = 0
+        self.size: int = 0
+        self.inserted: int = 0
+        self.prioritized: bool = prioritized
+        self.alpha: float = alpha
+        self.tree: Optional[SumTree] = SumTree(capacity) if prioritized else None
+        self.max_priority: float = 1.0
+        # Slots written by add() since the tree was last brought up to date - one tree update per batch is far cheaper than one per insert
+        self._unprioritized: list[int] = []
+
+    @classmethod
+    def for_space(cls, observation_space: spaces.Space, capacity: int, **kwargs) -> "ReplayBuffer":
+        """A buffer for an env's observations: tuples of `Discrete` parts (`OBS_TUPLE`) are stored as int32 rows, `Box` observations as they are."""
+        if isinstance(observation_space, spaces.Tuple):
+            return cls(capacity, (len(observation_space.spaces),), np.int32, **kwargs)
+        if isinstance(observation_space, spaces.Box):
+            return cls(capacity, observation_space.shape, observation_space.dtype.type, **kwargs)
+        raise ValueError(f"Can't store observations from {observation_space}")
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(self, observation, action: int, reward: float, next_observation, done: bool, next_legal: np.ndarray) -> None:
+        """Store one transition."""
+        slot = self.head
+        self.observations[slot] = observation
+        self.actions[slot] = action
+        self.rewards[slot] = reward
+        self.next_observations[slot] = next_observation
+        self.dones[slot] = done
+        self.next_legal[slot] = next_legal
+        if self.tree is not None:
+            self._unprioritized.append(slot)
+        self.head = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.inserted += 1
+
+    def add_batch(self, observations, actions, rewards, next_observations, dones, next_legal) -> None:
+        """Store a batch of transitions (each argument has one row per transition) with one write per column."""
+        count = len(actions)
+        if count > self.capacity:
+            # Only the newest `capacity` would survive anyway
+            skip = count - self.capacity
+            self.head = (self.head + skip) % self.capacity
+            self.inserted += skip
+            observations, actions, rewards, next_observations, dones, next_legal = (
+                np.asarray(column)[skip:] for column in (observations, actions, rewards, next_observations, dones, next_legal))
+            count = self.capacity
+        slots = (self.head + np.arange(count)) % self.capacity
+        self.observations[slots] = observations
+        self.actions[slots] = actions
+        self.rewards[slots] = rewards
+        self.next_observations[slots] = next_observations
+        self.dones[slots] = dones
+        self.next_legal[slots] = next_legal
+        if self.tree is not None:
+            self._flush()
+            self.tree.update(slots, np.full(count, self.max_priority ** self.alpha))
+        self.head = (self.head + count) % self.capacity
+        self.size = min(self.size + count, self.capacity)
+        self.inserted += count
+
+    def _flush(self) -> None:
+        """Give the slots written by add() the highest priority seen so far."""
+        if self.tree is not None and self._unprioritized:
+            self.tree.update(np.array(self._unprioritized), np.full(len(self._unprioritized), self.max_priority ** self.alpha))
+            self._unprioritized = []
+
+    def sample(self, batch_size: int, rng: np.random.Generator, beta: float = 0.4) -> ReplayBatch:
+        """
+        Sample a minibatch (with replacement).
+
+        Prioritized sampling splits the total priority into `batch_size` equal segments and draws one transition from each, and
+        weights transitions by (size * P(i)) ** -beta, normalized by the largest possible weight.
+        """
+        if self.size == 0:
+            raise ValueError("Can't sample from an empty replay buffer")
+        if self.tree is None:
+            indices = rng.integers(self.size, size=batch_size)
+            weights = np.ones(batch_size, dtype=np.float32)
+        else:
+            self._flush()
+            total = self.tree.total
+            indices = self.tree.find((np.arange(batch_size) + rng.random(batch_size)) * (total / batch_size))
+            probabilities = self.tree.get(indices) / total
+            weights = ((self.size * probabilities) ** -beta / (self.size * self.tree.min / total) ** -beta).astype(np.float32)
+        return ReplayBatch(indices, self.observations[indices], self.actions[indices], self.rewards[indices], self.next_observations[indices],
+                           self.dones[indices], self.next_legal[indices], weights)
+
+    def update_priorities(self, indices: np.ndarray, td_errors: np.ndarray) -> None:
+        """Set the priorities of sampled transitions from their new TD errors."""
+        if self.tree is None:
+            return
+        self._flush()
+        priorities = np.abs(np.asarray(td_errors, dtype=np.float64)) + PRIORITY_EPSILON
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities ** self.alpha)
+
+    def save(self, path: str) -> None:
+        """Snapshot the buffer to an .npz file (written to a temporary file first, so an interrupted save keeps the last snapshot)."""
+        self._flush()
+        columns = {name: getattr(self, name)[:self.size] for name in ("observations", "actions", "rewards", "next_observations", "dones", "next_legal")}
+        priorities = self.tree.get(np.arange(self.size)) if self.tree is not None else np.zeros(0)
+        with open(path + ".tmp", "wb") as f:
+            np.savez(f, **columns, priorities=priorities, state=np.array([self.capacity, self.head, self.size, self.inserted, self.prioritized]),
+                     params=np.array([self.alpha, self.max_priority]))
+        os.replace(path + ".tmp", path)
+        log.info(f"Saved {self.size} transitions to {path}")
+
+    @classmethod
+    def load(cls, path: str) -> "ReplayBuffer":
+        with np.load(path) as data:
+            capacity, head, size, inserted, prioritized = (int(value) for value in data['state'])
+            alpha, max_priority = (float(value) for value in data['params'])
+            observations = data['observations']
+            buffer = cls(capacity, observations.shape[1:], observations.dtype.type, bool(prioritized), alpha)
+            for name in ("observations", "actions", "rewards", "next_observations", "dones", "next_legal"):
+                getattr(buffer, name)[:size] = data[name]
+            if buffer.tree is not None and size:
+                buffer.tree.update(np.arange(size), data['priorities'])
+        buffer.head, buffer.size, buffer.inserted, buffer.max_priority = head, size, inserted, max_priority
+        return buffer
+
+
+def run_checks(capacity: int = 1000, seed: int = 0) -> bool:
+    """Check the sum tree against NumPy sums, prioritized sampling frequencies against the priorities, and a save/load round trip."""
+    rng = np.random.default_rng(seed)
+    ok: bool = True
+    tree = SumTree(capacity)
+    priorities = np.zeros(capacity)
+    assigned = np.zeros(capacity, dtype=bool)
+    for _ in range(50):
+        indices = rng.integers(capacity, size=rng.integers(1, 100))
+        values = rng.random(len(indices)) * 10.0
+        tree.update(indices, values)
+        priorities[indices] = values  # Fancy assignment keeps the last value for repeated indices, like the tree
+        assigned[indices] = True
+    if not np.isclose(tree.total, priorities.sum()) or tree.min != priorities[assigned].min():
+        log.error(f"Sum tree total {tree.total} / min {tree.min}, expected {priorities.sum()} / {priorities[assigned].min()}")
+        ok = False
+    targets = rng.random(10000) * tree.total
+    expected = np.searchsorted(np.cumsum(priorities), targets, side="right")
+    if not np.array_equal(tree.find(targets), np.minimum(expected, capacity - 1)):
+        log.error("Sum tree find() disagrees with a search of the running sums")
+        ok = False
+
+    buffer = ReplayBuffer(capacity, (4,), np.float32, prioritized=True, alpha=1.0)
+    count = capacity + capacity // 3
+    buffer.add_batch(rng.random((count, 4)), rng.integers(NUM_ACTIONS, size=count), rng.random(count), rng.random((count, 4)), rng.random(count) < 0.1,
+                     rng.random((count, NUM_ACTIONS)) < 0.5)
+    if len(buffer) != capacity or buffer.head != count % capacity:
+        log.error(f"Buffer holds {len(buffer)} transitions with head {buffer.head} after {count} inserts")
+        ok = False
+    td_errors = rng.random(capacity) * 5.0
+    buffer.update_priorities(np.arange(capacity), td_errors)
+    draws = buffer.sample(200000, rng).indices
+    frequencies = np.bincount(draws, minlength=capacity) / len(draws)
+    expected_frequencies = (td_errors + PRIORITY_EPSILON) / (td_errors + PRIORITY_EPSILON).sum()
+    error = np.abs(frequencies - expected_frequencies).max()
+    if error > 5.0 * np.sqrt(expected_frequencies.max() / len(draws)):
+        log.error(f"Prioritized sampling frequencies are off by up to {error:.5f}")
+        ok = False
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "replay.npz")
+        buffer.save(path)
+        loaded = ReplayBuffer.load(path)
+    same = all(np.array_equal(getattr(buffer, name), getattr(loaded, name)) for name in ("observations", "actions", "rewards", "next_observations", "dones", "next_legal"))
+    if not same or loaded.head != buffer.head or not np.allclose(loaded.tree.sums, buffer.tree.sums):  # type: ignore
+        log.error("Loaded snapshot differs from the saved buffer")
+        ok = False
+    return ok
+
+
+def run_benchmark(capacity: int, observation_size: int, batch_size: int, insert_batch: int, seconds: float, prioritized: bool, seed: int = 0) -> None:
+    """Measure insert, sample and priority update rates of a buffer of float32 observations."""
+    rng = np.random.default_rng(seed)
+    buffer = ReplayBuffer(capacity, (observation_size,), np.float32, prioritized=prioritized)
+    observations = rng.random((insert_batch, observation_size), dtype=np.float32)
+    actions = rng.integers(NUM_ACTIONS, size=insert_batch)
+    rewards = rng.random(insert_batch)
+    dones = rng.random(insert_batch) < 0.05
+    legal = rng.random((insert_batch, NUM_ACTIONS)) < 0.7
+
+    def rate(step) -> float:
+        done, start = 0, time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            done += step()
+        return done / (time.perf_counter() - start) * 60.0
+
+    def insert_one() -> int:
+        buffer.add(observations[0], 1, 0.5, observations[1], False, legal[0])
+        return 1
+
+    def insert_batch_() -> int:
+        buffer.add_batch(observations, actions, rewards, observations, dones, legal)
+        return insert_batch
+
+    def sample() -> int:
+        batch = buffer.sample(batch_size, rng)
+        buffer.update_priorities(batch.indices, rng.random(batch_size))
+        return batch_size
+
+    kind = "prioritized" if prioritized else "uniform"
+    log.info(f"{kind}: {rate(insert_one) / 1e6:.2f}M single inserts/min, {rate(insert_batch_) / 1e6:.1f}M inserts/min in batches of {insert_batch}")
+    log.info(f"{kind}: {rate(sample) / 1e6:.1f}M samples/min{' (with priority updates)' if prioritized else ''} in batches of {batch_size} from {len(buffer)} transitions")
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Check and benchmark the replay buffer.")
+    parser.add_argument("--capacity", type=int, default=1000000)
+    parser.add_argument("--observation-size", type=int, default=200, help="float32 features per observation in the benchmark")
+    parser.add_argument("--batch-size", type=int, default=256, help="sampled minibatch size")
+    parser.add_argument("--insert-batch", type=int, default=256, help="transitions per add_batch() call")
+    parser.add_argument("--seconds", type=float, default=2.0, help="time spent measuring each rate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if not run_checks(seed=args.seed):
+        raise SystemExit(1)
+    log.info("Replay buffer checks passed")
+    for prioritized in (False, True):
+        run_benchmark(args.capacity, args.observation_size, args.batch_size, args.insert_batch, args.seconds, prioritized, args.seed)
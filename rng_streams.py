@@ -0,0 +1,73 @@
+import logging
+from typing import TYPE_CHECKING, Iterable
+
+import numpy as np
+
+from agents.player import Player
+
+if TYPE_CHECKING:
+    import gymnasium as gym
+
+log = logging.getLogger(__name__)
+
+# Kinds of stream within an episode. Each kind (and each agent's seat) gets an independent stream, so adding draws to one
+# consumer - an agent that samples more, a change in exploration - never shifts the random sequence of another.
+DECK_STREAM: int = 0
+EXPLORATION_STREAM: int = 1
+AGENT_STREAM: int = 2
+
+
+class EpisodeSeeds:
+    """
+    The random streams of one episode, keyed by (run seed, shard, episode).
+
+    Every stream is a `np.random.SeedSequence` with the run seed as entropy and (shard, episode, kind[, seat]) as its spawn key,
+    so an episode's streams depend on its key alone: any episode can be regenerated on its own, and a run split into shards plays
+    exactly the episodes that one process playing every (shard, episode) key in turn would. The spawn key is the sequence's
+    position in the spawn tree, so `SeedSequence(run_seed).spawn(n)[shard]` is the parent of every stream of that shard.
+    """
+
+    def __init__(self, run_seed: int, shard: int, episode: int):
+        if min(run_seed, shard, episode) < 0:
+            raise ValueError(f"Seeds, shards and episodes must be non-negative, got ({run_seed}, {shard}, {episode})")
+        self.run_seed: int = run_seed
+        self.shard: int = shard
+        self.episode: int = episode
+
+    def __repr__(self) -> str:
+        return f"EpisodeSeeds({self.run_seed}, {self.shard}, {self.episode})"
+
+    def sequence(self, kind: int, *index: int) -> np.random.SeedSequence:
+        return np.random.SeedSequence(self.run_seed, spawn_key=(self.shard, self.episode, kind, *index))
+
+    def generator(self, kind: int, *index: int) -> np.random.Generator:
+        return np.random.default_rng(self.sequence(kind, *index))
+
+    def deck(self) -> np.random.Generator:
+        """The deck's stream, for `PokerGame.set_rng()`."""
+        return self.generator(DECK_STREAM)
+
+    @property
+    def deck_seed(self) -> int:
+        """The deck's stream as an int seed, for `env.reset(seed=...)` (which also derives the env's equity and duplicate streams from it)."""
+        return int(self.sequence(DECK_STREAM).generate_state(1, np.uint64)[0])
+
+    def exploration(self) -> np.random.Generator:
+        """The learner's stream, for epsilon-greedy exploration."""
+        return self.generator(EXPLORATION_STREAM)
+
+    def agent(self, seat: int) -> np.random.Generator:
+        """The stream of the agent in `seat`."""
+        return self.generator(AGENT_STREAM, seat)
+
+    def seed_players(self, players: Iterable[Player]) -> None:
+        """Give every player the stream of its seat."""
+        for player in players:
+            player.set_rng(self.agent(player.seat))
+
+    def reset(self, env: "gym.Env") -> tuple:
+        """Reset a `TexasHoldemEnv` (or a wrapper of one) with the deck's stream and seed its players, returning what `reset()` returns."""
+        result = env.reset(seed=self.deck_seed)
+        # After the reset, which would otherwise give the players streams derived from the deck's seed - no player acts before the first step
+        self.seed_players(env.unwrapped.game.players)  # type: ignore
+        return result
@@ -0,0 +1,227 @@
+import argparse
+import logging
+import multiprocessing as mp
+import os
+import signal
+import time
+import traceback
+from multiprocessing.connection import Connection
+from typing import Any, Iterator, NamedTuple, Optional
+
+import numpy as np
+
+from agents.player import Player
+from agents.q import QPlayer
+from agents.random_player import RandomPlayer
+from gym_env.env import TexasHoldemEnv
+from hand_history import HandHistoryWriter
+from qtable import ObservationIndexer
+from rng_streams import EpisodeSeeds
+from util import ColoredFormatter, PlayerAction
+
+log = logging.getLogger(__name__)
+
+
+class Transition(NamedTuple):
+    state: Any
+    action: int
+    reward: float
+    next_state: Any
+    done: bool
+
+
+class RolloutBatch(NamedTuple):
+    worker_id: int  # also the shard the batch's episodes are keyed by
+    first_episode: int  # episode number (within the shard) of the batch's first episode
+    transitions: list[Transition]
+    episodes: int
+    episodes_won: int
+
+
+def make_env(initial_bankroll: int, small_blind: int, big_blind: int, player_types: list[type[Player]], **kwargs) -> TexasHoldemEnv:
+    """Build a headless env with a fresh instance of each player type (the learner should be the only non-autoplay type)."""
+    return TexasHoldemEnv(initial_bankroll, small_blind, big_blind, [player_type() for player_type in player_types], **kwargs)
+
+
+def run_episode(env: TexasHoldemEnv, indexer: ObservationIndexer, policy: np.ndarray, epsilon: float, max_steps: int, seeds: EpisodeSeeds) -> tuple[list[Transition], bool]:
+    """
+    Play one episode with an epsilon-greedy policy snapshot (the greedy action of each state index, see `QTable.greedy_policy()`),
+    returning its transitions and whether it was won.
+
+    The deck, every agent and the exploration draw from the episode's own streams, so the episode only depends on `seeds`.
+    """
+    exploration = seeds.exploration()
+    state, info = seeds.reset(env)
+    transitions: list[Transition] = []
+    for _ in range(max_steps):
+        if exploration.random() < epsilon:
+            action: int = info['legal_moves'][exploration.integers(len(info['legal_moves']))].value
+        else:
+            action = int(policy[indexer.state_index(state)])
+        new_state, reward, done, truncated, info = env.step(PlayerAction(action))
+        transitions.append(Transition(state, action, float(reward), new_state, bool(done)))
+        state = new_state
+        if done or truncated:
+            return transitions, float(reward) > 0.0
+    return transitions, False
+
+
+def _worker_loop(worker_id: int, seed: int, env_kwargs: dict, max_steps: int, history_dir: Optional[str], conn: Connection) -> None:
+    """
+    Worker process: build an env once, then play batches of episodes on request until told to stop (sent `None`). The worker
+    plays shard `worker_id` of the run, numbering its episodes from 0.
+
+    With a `history_dir`, every hand the worker plays is recorded to its own hand-history shard in that directory.
+    """
+    # The learner owns shutdown - a Ctrl+C in the terminal shouldn't kill workers mid-batch
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.getLogger().setLevel(logging.ERROR)
+    env = make_env(**env_kwargs)
+    indexer = ObservationIndexer(env.observation_space)
+    writer: Optional[HandHistoryWriter] = None
+    if history_dir is not None:
+        writer = HandHistoryWriter(os.path.join(history_dir, f"worker-{worker_id}"), env.game.small_blind, env.game.big_blind)
+        writer.attach(env.game)
+    episodes: int = 0
+    try:
+        while True:
+            task = conn.recv()
+            if task is None:
+                break
+            policy, epsilon, num_episodes = task
+            transitions: list[Transition] = []
+            won: int = 0
+            for episode in range(episodes, episodes + num_episodes):
+                played, episode_won = run_episode(env, indexer, policy, epsilon, max_steps, EpisodeSeeds(seed, worker_id, episode))
+                transitions.extend(played)
+                won += episode_won
+            conn.send(RolloutBatch(worker_id, episodes, transitions, num_episodes, won))
+            episodes += num_episodes
+    except Exception:
+        conn.send(traceback.format_exc())
+    finally:
+        if writer is not None:
+            writer.close()
+        env.close()
+        conn.close()
+
+
+class RolloutPool:
+    """
+    A pool of worker processes that play self-play episodes for a learner.
+
+    Each worker owns its env and plays one shard of the run: worker i's episodes are keyed (seed, i, 0), (seed, i, 1), ... (see
+    `rng_streams.EpisodeSeeds`), so any episode can be regenerated on its own with `run_episode()`, and the run doesn't depend on
+    how the workers are scheduled. Batches are returned in worker order as they complete, letting the learner apply one batch while
+    the others are still playing.
+    Pass `history_dir` to record every hand to one hand-history shard per worker (merge them with `hand_history.merge_shards()`).
+    """
+
+    def __init__(self, num_workers: int, env_kwargs: dict, seed: int = 0, episodes_per_batch: int = 10, max_steps: int = 200, history_dir: Optional[str] = None):
+        self.num_workers: int = num_workers
+        self.episodes_per_batch: int = episodes_per_batch
+        self.workers: list[mp.process.BaseProcess] = []
+        self.conns: list[Connection] = []
+        ctx = mp.get_context("spawn")
+        for worker_id in range(num_workers):
+            conn, child_conn = ctx.Pipe()
+            worker = ctx.Process(target=_worker_loop, args=(worker_id, seed, env_kwargs, max_steps, history_dir, child_conn), daemon=True)
+            worker.start()
+            child_conn.close()
+            self.workers.append(worker)
+            self.conns.append(conn)
+        log.info(f"Started {num_workers} rollout workers")
+
+    def run_batch(self, policy: np.ndarray, epsilon: float, episodes_per_batch: Optional[int] = None) -> Iterator[RolloutBatch]:
+        """Send the same policy snapshot to every worker and yield their batches in worker order."""
+        num_episodes: int = self.episodes_per_batch if episodes_per_batch is None else episodes_per_batch
+        for conn in self.conns:
+            conn.send((policy, epsilon, num_episodes))
+        for conn in self.conns:
+            result = conn.recv()
+            if isinstance(result, str):
+                self.close()
+                raise RuntimeError(f"Rollout worker failed:\n{result}")
+            yield result
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Ask every worker to finish and wait for them, terminating any that don't exit within `timeout` seconds."""
+        for conn in self.conns:
+            try:
+                conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in self.workers:
+            worker.join(timeout)
+            if worker.is_alive():
+                log.warning(f"Rollout worker {worker.pid} did not exit, terminating it")
+                worker.terminate()
+                worker.join()
+        for conn in self.conns:
+            conn.close()
+        self.workers = []
+        self.conns = []
+
+    def __enter__(self) -> "RolloutPool":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def run_shard_check(env_kwargs: dict, num_workers: int, num_batches: int, episodes_per_batch: int, epsilon: float = 0.5, max_steps: int = 200, seed: int = 0) -> bool:
+    """
+    Check that a sharded run is reproducible bit for bit: play rollouts of a fixed random policy snapshot on a pool, then replay
+    every (shard, episode) key one after another in this process and compare every transition.
+    """
+    env = make_env(**env_kwargs)
+    indexer = ObservationIndexer(env.observation_space)
+    policy = np.random.default_rng(seed).integers(env.action_space.n, size=indexer.num_states).astype(np.int8)  # type: ignore
+    start = time.perf_counter()
+    batches: list[RolloutBatch] = []
+    with RolloutPool(num_workers, env_kwargs, seed=seed, episodes_per_batch=episodes_per_batch, max_steps=max_steps) as pool:
+        for _ in range(num_batches):
+            batches.extend(pool.run_batch(policy, epsilon))
+    parallel_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mismatches: int = 0
+    for batch in batches:
+        transitions: list[Transition] = []
+        won: int = 0
+        for episode in range(batch.first_episode, batch.first_episode + batch.episodes):
+            played, episode_won = run_episode(env, indexer, policy, epsilon, max_steps, EpisodeSeeds(seed, batch.worker_id, episode))
+            transitions.extend(played)
+            won += episode_won
+        if transitions != batch.transitions or won != batch.episodes_won:
+            log.error(f"Shard {batch.worker_id} episodes {batch.first_episode}-{batch.first_episode + batch.episodes - 1} differ when replayed")
+            mismatches += 1
+    env.close()
+    episodes = sum(batch.episodes for batch in batches)
+    log.info(f"{episodes} episodes on {num_workers} workers in {parallel_time:.2f}s, replayed serially in {time.perf_counter() - start:.2f}s")
+    return mismatches == 0
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+    logging.getLogger("agents").setLevel(logging.WARNING)
+    # The random policy snapshot picks illegal moves, which the env warns about
+    logging.getLogger("gym_env").setLevel(logging.ERROR)
+
+    parser = argparse.ArgumentParser(description="Check that sharded rollouts replay bit for bit in a single process.")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--batches", type=int, default=2, help="batches each worker plays")
+    parser.add_argument("--episodes-per-batch", type=int, default=10)
+    parser.add_argument("--players", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    env_kwargs = {'initial_bankroll': 100, 'small_blind': 2, 'big_blind': 5, 'player_types': [QPlayer] + [RandomPlayer] * (args.players - 1)}
+    if not run_shard_check(env_kwargs, args.workers, args.batches, args.episodes_per_batch, seed=args.seed):
+        raise SystemExit(1)
+    log.info("Sharded rollouts match their serial replay")
@@ -0,0 +1,391 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import deque
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from agents.player import Player
+from league import AgentFactory, parse_agent
+from poker import PokerGame
+from rng_streams import EpisodeSeeds
+from util import ColoredFormatter, PlayerAction
+
+log = logging.getLogger(__name__)
+
+# Protocol: every message is one JSON object per line, in both directions.
+#   client -> server  {"type": "join", "seats": k}              ask for k seats (at any tables), default 1
+#   server -> client  {"type": "seated", "table": t, "seat": s}  a table with one of the client's seats is starting
+#   server -> client  {"type": "act", "id": n, "table": t, "seat": s, "legal": [...], "round": r, "cards": [...], "board": [...],
+#                      "bankrolls": [...], "pots": [...], "min_call": c, "community_pot": p}
+#   client -> server  {"type": "action", "id": n, "action": a}   answer to decision n (a PlayerAction value)
+#   server -> client  {"type": "end", "table": t, "seat": s, "winner": w, "hands": h}
+# Decisions that aren't answered within the timeout, answered with an illegal action or asked of a closed connection get the
+# default action: check/call when legal, otherwise fold.
+DEFAULT_PORT: int = 8765
+PERCENTILES: tuple[float, ...] = (50.0, 90.0, 99.0, 99.9)
+
+
+def default_action(legal_moves: list[PlayerAction]) -> PlayerAction:
+    return PlayerAction.CHECK_CALL if PlayerAction.CHECK_CALL in legal_moves else PlayerAction.FOLD
+
+
+def latency_summary(latencies: list[float]) -> str:
+    """Describe latencies (in seconds) by their percentiles, in milliseconds."""
+    if not latencies:
+        return "no samples"
+    samples = np.array(latencies) * 1000.0
+    parts = [f"p{percentile:g} {value:.2f}" for percentile, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES))]
+    return f"{len(samples)} samples: {', '.join(parts)}, max {samples.max():.2f} ms"
+
+
+class ServerStats:
+    def __init__(self):
+        self.tables_started: int = 0
+        self.tables_finished: int = 0
+        self.decisions: int = 0
+        self.timeouts: int = 0
+        self.illegal: int = 0
+        # Seconds from sending a decision request to receiving its answer
+        self.latencies: list[float] = []
+
+    def describe(self) -> str:
+        return (f"{self.tables_finished}/{self.tables_started} tables finished, {self.decisions} remote decisions "
+                f"({self.timeouts} timed out, {self.illegal} illegal), answered in {latency_summary(self.latencies)}")
+
+
+class Connection:
+    """One agent connection, which can hold any number of seats. Answers are matched to their decision requests by id."""
+
+    def __init__(self, server: "TableServer", reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.server: "TableServer" = server
+        self.reader: asyncio.StreamReader = reader
+        self.writer: asyncio.StreamWriter = writer
+        self.pending: dict[int, asyncio.Future] = {}
+        self.closed: bool = False
+
+    async def send(self, message: dict) -> None:
+        if self.closed:
+            return
+        try:
+            self.writer.write(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+            await self.writer.drain()
+        except ConnectionError:
+            self.close()
+
+    async def decide(self, request: dict, legal_moves: list[PlayerAction], timeout: float) -> PlayerAction:
+        """Ask for a decision, falling back to the default action on a timeout, an illegal answer or a lost connection."""
+        stats = self.server.stats
+        stats.decisions += 1
+        if self.closed:
+            return default_action(legal_moves)
+        decision_id = self.server.next_decision_id()
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.pending[decision_id] = future
+        start = time.perf_counter()
+        try:
+            await self.send({'type': "act", 'id': decision_id, **request})
+            answer = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            stats.timeouts += 1
+            return default_action(legal_moves)
+        finally:
+            self.pending.pop(decision_id, None)
+        stats.latencies.append(time.perf_counter() - start)
+        try:
+            action = PlayerAction(answer)
+        except ValueError:
+            action = None
+        if action not in legal_moves:
+            stats.illegal += 1
+            return default_action(legal_moves)
+        return action
+
+    async def serve(self) -> None:
+        """Read messages until the client disconnects."""
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                try:
+                    message = json.loads(line)
+                    kind = message['type']
+                except (ValueError, KeyError, TypeError):
+                    log.warning(f"Ignoring malformed message {line[:80]!r}")
+                    continue
+                if kind == "join":
+                    self.server.join(self, int(message.get('seats', 1)))
+                elif kind == "action":
+                    future = self.pending.get(message.get('id'))
+                    if future is not None and not future.done():
+                        future.set_result(message.get('action'))
+                else:
+                    log.warning(f"Ignoring message of unknown type {kind!r}")
+        except ConnectionError:
+            pass
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        # Anything still waiting on this connection gets the default action straight away
+        for future in self.pending.values():
+            if not future.done():
+                future.set_result(None)
+        self.server.leave(self)
+        self.writer.close()
+
+
+class Seat(NamedTuple):
+    connection: Connection
+    table: int
+    seat: int
+
+
+class TableServer:
+    """
+    Hosts any number of concurrent `PokerGame` tables in one asyncio event loop.
+
+    Seats requested by clients are queued in a lobby, and a table starts as soon as enough of them are waiting. Each table is a
+    coroutine stepping its game directly - remote seats are awaited with a per-decision timeout, and server-side `bots` (autoplay
+    agents that don't need observations, like `RandomPlayer`) fill the seats after the remote ones. A game ends when one player
+    has every chip or after `max_hands` hands.
+    """
+
+    def __init__(self, remote_seats: int = 2, bots: Optional[list[AgentFactory]] = None, initial_bankroll: int = 100, small_blind: int = 2,
+                 big_blind: int = 5, decision_timeout: float = 5.0, max_hands: int = 100, seed: int = 0):
+        if remote_seats < 1:
+            raise ValueError("Tables need at least one remote seat (tables of bots only would never yield to the event loop)")
+        self.remote_seats: int = remote_seats
+        self.bots: list[AgentFactory] = bots or []
+        if not 2 <= remote_seats + len(self.bots) <= 8:
+            raise ValueError(f"Tables need 2-8 players, got {remote_seats} remote seats and {len(self.bots)} bots")
+        self.initial_bankroll: int = initial_bankroll
+        self.small_blind: int = small_blind
+        self.big_blind: int = big_blind
+        self.decision_timeout: float = decision_timeout
+        self.max_hands: int = max_hands
+        # Table t is keyed (seed, 0, t) (see `rng_streams.EpisodeSeeds`), for its deck and its bots
+        self.seed: int = seed
+        self.lobby: deque[Connection] = deque()
+        self.tables: dict[int, asyncio.Task] = {}
+        self.stats: ServerStats = ServerStats()
+        self._next_table: int = 0
+        self._next_decision: int = 0
+
+    def next_decision_id(self) -> int:
+        self._next_decision += 1
+        return self._next_decision
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        await Connection(self, reader, writer).serve()
+
+    def join(self, connection: Connection, seats: int) -> None:
+        self.lobby.extend([connection] * seats)
+        while len(self.lobby) >= self.remote_seats:
+            connections = [self.lobby.popleft() for _ in range(self.remote_seats)]
+            table = self._next_table
+            self._next_table += 1
+            self.stats.tables_started += 1
+            self.tables[table] = asyncio.create_task(self.play_table(table, connections))
+
+    def leave(self, connection: Connection) -> None:
+        """Drop a closed connection's seats from the lobby (seats at running tables play on with default actions)."""
+        self.lobby = deque(waiting for waiting in self.lobby if waiting is not connection)
+
+    async def play_table(self, table: int, connections: list[Connection]) -> None:
+        try:
+            seats = [Seat(connection, table, index) for index, connection in enumerate(connections)]
+            game = PokerGame(self.initial_bankroll, self.small_blind, self.big_blind)
+            players = [Player(f"Remote {index}", False) for index in range(len(seats))] + [factory() for factory in self.bots]
+            for index, player in enumerate(players):
+                player.bankroll = self.initial_bankroll
+                player.seat = index
+                game.players.append(player)
+                player.join(game)
+            seeds = EpisodeSeeds(self.seed, 0, table)
+            seeds.seed_players(players)
+            game.set_rng(seeds.deck())
+            game.reset()
+            for seat in seats:
+                await seat.connection.send({'type': "seated", 'table': table, 'seat': seat.seat})
+            while not game.done and game.hand_number <= self.max_hands:
+                game.determine_legal_moves()
+                index = game.current_player_idx
+                player = game.players[index]
+                if player.autoplay:
+                    action = player.action(game.legal_moves, None, {'legal_moves': game.legal_moves})
+                else:
+                    action = await seats[index].connection.decide(self.decision_request(game, seats[index]), game.legal_moves, self.decision_timeout)
+                game.do_step(action)
+            for seat in seats:
+                await seat.connection.send({'type': "end", 'table': table, 'seat': seat.seat, 'winner': game.winner, 'hands': min(game.hand_number, self.max_hands)})
+            self.stats.tables_finished += 1
+        except Exception:
+            log.exception(f"Table {table} failed")
+        finally:
+            del self.tables[table]
+
+    def decision_request(self, game: PokerGame, seat: Seat) -> dict:
+        """Everything the seat's player may see when deciding."""
+        return {
+            'table': seat.table,
+            'seat': seat.seat,
+            'legal': [move.value for move in game.legal_moves],
+            'round': game.round.value,
+            'cards': game.players[seat.seat].cards,
+            'board': game.community_cards,
+            'bankrolls': [player.bankroll for player in game.players],
+            'pots': game.player_pots,
+            'min_call': game.min_call,
+            'community_pot': game.community_pot,
+        }
+
+
+async def start_server(server: TableServer, host: str = "127.0.0.1", port: int = DEFAULT_PORT, path: Optional[str] = None) -> asyncio.AbstractServer:
+    """Listen on a Unix socket at `path`, or on TCP `host`:`port` when no path is given."""
+    if path is not None:
+        return await asyncio.start_unix_server(server.handle, path)
+    return await asyncio.start_server(server.handle, host, port)
+
+
+async def open_connection(host: str = "127.0.0.1", port: int = DEFAULT_PORT, path: Optional[str] = None) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    if path is not None:
+        return await asyncio.open_unix_connection(path)
+    return await asyncio.open_connection(host, port)
+
+
+class LoadResult(NamedTuple):
+    tables: int
+    decisions: int
+    elapsed: float
+    # Seconds from answering a decision to receiving the next decision request of the same table
+    latencies: list[float]
+
+
+async def run_load(num_seats: int, connections: int = 4, think_time: float = 0.0, seed: int = 0,
+                   host: str = "127.0.0.1", port: int = DEFAULT_PORT, path: Optional[str] = None) -> LoadResult:
+    """
+    Stand-in client for load testing: take `num_seats` seats over `connections` connections and play random legal moves until every
+    table they sit at has finished, timing how long the server takes to come back with each table's next decision.
+    """
+    rng = random.Random(seed)
+    # Per table: when its last decision was answered
+    answered: dict[int, float] = {}
+    latencies: list[float] = []
+    tables: set[int] = set()
+    decisions: int = 0
+
+    async def play(seats: int) -> None:
+        reader, writer = await open_connection(host, port, path)
+        # Answers are sent from their own tasks, so seats sharing a connection think at the same time instead of queueing
+        write_lock = asyncio.Lock()
+        pending: set[asyncio.Task] = set()
+
+        async def send(message: dict) -> None:
+            async with write_lock:
+                writer.write(json.dumps(message).encode() + b"\n")
+                await writer.drain()
+
+        async def answer(message: dict) -> None:
+            nonlocal decisions
+            if think_time > 0.0:
+                await asyncio.sleep(think_time)
+            await send({'type': "action", 'id': message['id'], 'action': rng.choice(message['legal'])})
+            answered[message['table']] = time.perf_counter()
+            decisions += 1
+
+        await send({'type': "join", 'seats': seats})
+        ended: int = 0
+        while ended < seats:
+            line = await reader.readline()
+            if not line:
+                raise ConnectionError("Server closed the connection")
+            message = json.loads(line)
+            if message['type'] == "act":
+                last = answered.pop(message['table'], None)
+                if last is not None:
+                    latencies.append(time.perf_counter() - last)
+                task = asyncio.create_task(answer(message))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            elif message['type'] == "seated":
+                tables.add(message['table'])
+            elif message['type'] == "end":
+                answered.pop(message['table'], None)
+                ended += 1
+        for task in list(pending):
+            task.cancel()
+        writer.close()
+        await writer.wait_closed()
+
+    start = time.perf_counter()
+    shares = [num_seats // connections + (index < num_seats % connections) for index in range(connections)]
+    await asyncio.gather(*(play(share) for share in shares if share > 0))
+    return LoadResult(len(tables), decisions, time.perf_counter() - start, latencies)
+
+
+async def run_benchmark(server: TableServer, num_tables: int, connections: int, think_time: float, seed: int, path: Optional[str]) -> None:
+    """Run a server and a load client filling `num_tables` tables in the same event loop."""
+    listener = await start_server(server, port=0, path=path)
+    port = listener.sockets[0].getsockname()[1] if path is None else DEFAULT_PORT
+    async with listener:
+        result = await run_load(num_tables * server.remote_seats, connections, think_time, seed, port=port, path=path)
+    log.info(f"Played {result.tables} tables, {result.decisions} decisions in {result.elapsed:.1f}s ({result.decisions / result.elapsed:.0f} decisions/s)")
+    log.info(f"Client: next decision after {latency_summary(result.latencies)}")
+    log.info(f"Server: {server.stats.describe()}")
+
+
+if __name__ == "__main__":
+    log = logging.getLogger()
+    log.setLevel(logging.INFO)
+    ch = logging.StreamHandler()
+    ch.setLevel(logging.INFO)
+    ch.setFormatter(ColoredFormatter())
+    log.addHandler(ch)
+
+    parser = argparse.ArgumentParser(description="Host many concurrent poker tables in one asyncio event loop, or load test a server.")
+    parser.add_argument("command", choices=["serve", "load", "bench"], help="run a server, a load client against one, or both in one process")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--path", default=None, help="Unix socket path (instead of TCP)")
+    parser.add_argument("--remote-seats", type=int, default=2, help="seats per table played by clients")
+    parser.add_argument("--bot", dest="bots", action="append", default=None, help='server-side agent filling a seat after the remote ones, as "module:Class[:argument]" (repeatable)')
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds a client has for each decision")
+    parser.add_argument("--max-hands", type=int, default=100, help="hands before a game is stopped")
+    parser.add_argument("--tables", type=int, default=1000, help="tables the load client fills")
+    parser.add_argument("--connections", type=int, default=4, help="connections the load client spreads its seats over")
+    parser.add_argument("--think", type=float, default=0.0, help="seconds the load client waits before each answer")
+    parser.add_argument("--report-every", type=float, default=10.0, help="seconds between the server's statistics reports")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bots = [parse_agent(f"bot={spec}")[1] for spec in args.bots or []]
+    if args.command == "load":
+        result = asyncio.run(run_load(args.tables * args.remote_seats, args.connections, args.think, args.seed, args.host, args.port, args.path))
+        log.info(f"Played {result.tables} tables, {result.decisions} decisions in {result.elapsed:.1f}s ({result.decisions / result.elapsed:.0f} decisions/s)")
+        log.info(f"Next decision after {latency_summary(result.latencies)}")
+    else:
+        server = TableServer(args.remote_seats, bots, decision_timeout=args.timeout, max_hands=args.max_hands, seed=args.seed)
+        if args.command == "bench":
+            asyncio.run(run_benchmark(server, args.tables, args.connections, args.think, args.seed, args.path))
+        else:
+            async def serve() -> None:
+                listener = await start_server(server, args.host, args.port, args.path)
+                log.info(f"Serving tables on {args.path or f'{args.host}:{args.port}'}")
+                async with listener:
+                    while True:
+                        await asyncio.sleep(args.report_every)
+                        if server.stats.tables_started:
+                            log.info(f"{len(server.tables)} tables running, {server.stats.describe()}")
+            try:
+                asyncio.run(serve())
+            except KeyboardInterrupt:
+                log.info(server.stats.describe())
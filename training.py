@@ -1,19 +1,35 @@
+import argparse
 import logging
 import time
 import gymnasium as gym
 from util import ColoredFormatter
+from events import log_event
 from agents.random_player import RandomPlayer
 from agents.q import QPlayer
 from agents.human_player import HumanPlayer
 from gym_env.env import TexasHoldemEnv  # noqa: F401
 
 import numpy as np
-import random
-from collections import defaultdict
 from util import PlayerAction
+from rollout import RolloutPool
+from rng_streams import EpisodeSeeds
+from qtable import QTable, legal_mask
+from replay import ReplayBuffer
+from policy import FALLBACK_RANDOM, FrozenPolicy
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a Q-learning agent against random agents.")
+    parser.add_argument("--workers", type=int, default=0, help="rollout worker processes (0 = train serially in this process)")
+    parser.add_argument("--episodes-per-batch", type=int, default=10, help="episodes each worker plays per policy snapshot")
+    parser.add_argument("--seed", type=int, default=0, help="run seed: episodes are reproducible from (seed, worker, episode)")
+    parser.add_argument("--policy-out", default="q_policy", help="directory the trained policy is frozen to")
+    parser.add_argument("--history-dir", default=None, help="record every hand played by the rollout workers to shards in this directory")
+    parser.add_argument("--replay-capacity", type=int, default=0, help="learn from minibatches sampled from a replay buffer of this many transitions (0 = learn from each transition once)")
+    parser.add_argument("--replay-batch", type=int, default=64, help="replay minibatch size")
+    parser.add_argument("--prioritized", action="store_true", help="sample the replay buffer in proportion to TD error")
+    args = parser.parse_args()
+
     log = logging.getLogger()
     log.setLevel(logging.ERROR)
     ch = logging.StreamHandler()
@@ -24,7 +40,7 @@ if __name__ == "__main__":
     env = gym.make('TexasHoldem-v0', render_mode="human", initial_bankroll=100, small_blind=2, big_blind=5, players=[QPlayer(), RandomPlayer(), RandomPlayer(), RandomPlayer()])
 
     action_size = env.action_space.n  # type: ignore
-    qtable = defaultdict(lambda: np.zeros(action_size))
+    qtable = QTable(env.observation_space, action_size)  # type: ignore
 
     learning_rate = 0.1
     discount_rate = 0.1
@@ -36,40 +52,87 @@ if __name__ == "__main__":
 
     episodes_won = 0
 
-    for episode in range(num_episodes):
-        state, info = env.reset()
-        done = False
-
-        log.error("Starting episode " + str(episode))
-        for s in range(max_steps):
-            if random.uniform(0, 1) < epsilon:
-                action = random.choice(info['legal_moves']).value
-            else:
-                action = np.argmax(qtable[state])  # type: ignore
-
-            log.info("Chosen action is " + str(PlayerAction(action)))
-
-            new_state, reward, done, truncated, info = env.step(PlayerAction(action))
-
-            qtable[state][action] = qtable[state][action] + learning_rate * (float(reward) + discount_rate * np.max(qtable[new_state]) - qtable[state][action])
-
-            state = new_state
-
-            if done or truncated:
-                if float(reward) > 0.0:
-                    episodes_won += 1
-                break
-
-        epsilon = np.exp(-decay_rate * episode)
+    buffer = ReplayBuffer.for_space(env.observation_space, args.replay_capacity, prioritized=args.prioritized) if args.replay_capacity > 0 else None
+    replay_rng = np.random.default_rng(args.seed)
+
+    def replay(updates: int) -> None:
+        """Apply `updates` minibatch updates sampled from the replay buffer, refreshing the priorities of the sampled transitions."""
+        assert buffer is not None
+        if len(buffer) < args.replay_batch:
+            return
+        for _ in range(updates):
+            batch = buffer.sample(args.replay_batch, replay_rng)
+            states, next_states = qtable.state_indices(batch.observations), qtable.state_indices(batch.next_observations)
+            qtable.update_batch(states, batch.actions, batch.rewards, next_states, learning_rate, discount_rate, batch.dones, batch.weights)
+            buffer.update_priorities(batch.indices, qtable.td_errors(states, batch.actions, batch.rewards, next_states, discount_rate, batch.dones))
+
+    if args.workers > 0:
+        env_kwargs = {'initial_bankroll': 100, 'small_blind': 2, 'big_blind': 5, 'player_types': [QPlayer, RandomPlayer, RandomPlayer, RandomPlayer]}
+        episodes_done = 0
+        with RolloutPool(args.workers, env_kwargs, seed=args.seed, episodes_per_batch=args.episodes_per_batch, max_steps=max_steps, history_dir=args.history_dir) as pool:
+            while episodes_done < num_episodes:
+                log.error(f"Starting episodes {episodes_done}-{episodes_done + args.workers * args.episodes_per_batch - 1}")
+                # Workers only need the greedy action for each state
+                policy = qtable.greedy_policy()
+                for batch in pool.run_batch(policy, epsilon):
+                    if batch.transitions and buffer is not None:
+                        states, actions, rewards, new_states, dones = zip(*batch.transitions)
+                        # Rollouts don't report legal moves, and the tabular update doesn't need them
+                        buffer.add_batch(list(states), actions, rewards, list(new_states), dones, np.ones((len(actions), action_size), dtype=bool))
+                        replay(max(len(actions) // args.replay_batch, 1))
+                    elif batch.transitions:
+                        states, actions, rewards, new_states, _ = zip(*batch.transitions)
+                        qtable.update_batch(qtable.state_indices(list(states)), np.array(actions), np.array(rewards), qtable.state_indices(list(new_states)), learning_rate, discount_rate)
+                    episodes_won += batch.episodes_won
+                    episodes_done += batch.episodes
+                epsilon = np.exp(-decay_rate * episodes_done)
+        num_episodes = episodes_done
+    else:
+        for episode in range(num_episodes):
+            # A serial run is a single shard (0), so any of its episodes can be regenerated from (seed, 0, episode)
+            seeds = EpisodeSeeds(args.seed, 0, episode)
+            exploration = seeds.exploration()
+            state, info = seeds.reset(env)
+            done = False
+
+            log.error("Starting episode " + str(episode))
+            for s in range(max_steps):
+                if exploration.random() < epsilon:
+                    action = info['legal_moves'][exploration.integers(len(info['legal_moves']))].value
+                else:
+                    action = qtable.greedy(state)
+
+                log.info("Chosen action is " + str(PlayerAction(action)))
+
+                new_state, reward, done, truncated, info = env.step(PlayerAction(action))
+
+                if buffer is not None:
+                    buffer.add(state, action, float(reward), new_state, bool(done), legal_mask(info['legal_moves'], action_size))
+                    replay(1)
+                else:
+                    qtable.update(state, action, float(reward), new_state, learning_rate, discount_rate)
+
+                state = new_state
+
+                if done or truncated:
+                    if float(reward) > 0.0:
+                        episodes_won += 1
+                    break
+
+            epsilon = np.exp(-decay_rate * episode)
 
     log.error("Training finished!")
     log.error(f"Agent won: {episodes_won}/{num_episodes} episodes")
+    # Unseen states play a random legal move, like during training
+    qtable.export_policy(args.policy_out, FALLBACK_RANDOM, initial_bankroll=100, small_blind=2, big_blind=5, num_players=4)
+    policy = FrozenPolicy(args.policy_out)
     log.error("Press enter to play against the q-learning agent")
     input()
 
     env.close()
 
     env = gym.make('TexasHoldem-v0', render_mode="human", initial_bankroll=100, small_blind=2, big_blind=5, players=[HumanPlayer(), QPlayer(), RandomPlayer(), RandomPlayer()])
+    env.unwrapped.game.events.subscribe(log_event)  # type: ignore
 
     log.setLevel(logging.DEBUG)
     ch.setLevel(logging.DEBUG)
@@ -81,14 +144,7 @@ if __name__ == "__main__":
     log.error("Trained agent is now playing...")
 
     for s in range(max_steps):
-        if state in qtable:
-            action = np.argmax(qtable[state])
-            if PlayerAction(action) not in info['legal_moves']:
-                new_action = random.choice(info['legal_moves']).value
-                # log.error(f"Q-value {PlayerAction(action)} not legal for round, choosing {PlayerAction(new_action)} instead...")
-                action = new_action
-        else:
-            action = random.choice(info['legal_moves']).value
+        action = policy.action(state, info['legal_moves']).value
         # log.error(f"Legal moves are {info['legal_moves']}")
         # log.error("Chosen action is " + str(PlayerAction(action)))
         new_state, reward, done, truncated, info = env.step(PlayerAction(action))
@@ -1,6 +1,9 @@
 import logging
+import threading
+from collections import OrderedDict
 from phevaluator import evaluate_cards
 from enum import Enum
+from typing import Iterable, NamedTuple, Sequence
 
 
 class ColoredFormatter(logging.Formatter):
@@ -47,6 +50,37 @@ class Round(Enum):
     SHOWDOWN = 4
 
 
+# Cards are stored as ints 0-51 using the same layout as phevaluator (rank * 4 + suit),
+# so they can be passed straight to the evaluator. Strings are only built for logging/rendering.
+card_suits: str = "cdhs"
+DECK_SIZE: int = 52
+
+
+def card_to_int(card: str) -> int:
+    """Convert a card string ("Ah") to its int encoding (0-51)."""
+    return ranks.index(card[0]) * 4 + card_suits.index(card[1])
+
+
+def card_to_str(card: int) -> str:
+    """Convert a card int (0-51) to its string representation ("Ah")."""
+    return ranks[card >> 2] + card_suits[card & 3]
+
+
+def cards_to_str(cards: Iterable[int]) -> list[str]:
+    """Convert a collection of card ints to a list of card strings. Meant for logging and rendering only."""
+    return [card_to_str(int(card)) for card in cards]
+
+
+def card_rank(card: int) -> int:
+    """Get a card int's rank index (0 = 2, 12 = A)."""
+    return card >> 2
+
+
+def card_suit(card: int) -> int:
+    """Get a card int's suit index (into `card_suits`)."""
+    return card & 3
+
+
 def get_rank(card: str) -> str:
     return card[0]
 
@@ -70,10 +104,8 @@ def get_rank_int(card: str) -> int:
     return rank_from_str(get_rank(card))
 
 
-# TODO: Write card pretty conversions
-
-
-def rank_hand(hand: list[str]) -> tuple[str, int, int]:
+def rank_hand_uncached(hand: Sequence[int]) -> tuple[str, int, int]:
+    """Rank a hand of 5-7 card ints with phevaluator, returning (rank name, phevaluator rank (lower is stronger), rank index (1 = high card ... 10 = royal flush))."""
     r: int = evaluate_cards(*hand)
     rank = "Unknown Rank"
     rank_index = 0
@@ -111,4 +143,77 @@ def rank_hand(hand: list[str]) -> tuple[str, int, int]:
         pass
     return (rank, r, rank_index)
 
-# TODO: Write Monte-Carlo equity simulation
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class HandRankCache:
+    """
+    Bounded LRU cache of `rank_hand_uncached()` results.
+
+    Hands are keyed on the bitmask of their cards, so the same set of cards hits the cache in any order.
+    Use `info()` to check the hit rate when tuning `maxsize`. Safe to share between threads (e.g. envs played in threads).
+    """
+
+    def __init__(self, maxsize: int = 1 << 16):
+        self.maxsize: int = maxsize
+        self.entries: OrderedDict[int, tuple[str, int, int]] = OrderedDict()
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        # Reordering and evicting entries isn't atomic - a miss is evaluated outside the lock, so threads only wait on bookkeeping
+        self._lock: threading.Lock = threading.Lock()
+
+    def rank(self, hand: Sequence[int]) -> tuple[str, int, int]:
+        """Rank a hand, evaluating it only if its card set isn't cached."""
+        key: int = 0
+        for card in hand:
+            key |= 1 << card
+        with self._lock:
+            result = self.entries.get(key)
+            if result is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return result
+            self.misses += 1
+        result = rank_hand_uncached(hand)
+        with self._lock:
+            self.entries[key] = result
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return result
+
+    def resize(self, maxsize: int) -> None:
+        """Change the cache's size, evicting the least recently used entries if it shrinks."""
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self.entries) > maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Empty the cache and reset its counters."""
+        with self._lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, self.maxsize, len(self.entries))
+
+
+# Shared by every game, observation and renderer in the process
+hand_rank_cache: HandRankCache = HandRankCache()
+
+
+def rank_hand(hand: Sequence[int]) -> tuple[str, int, int]:
+    """Rank a hand of 5-7 card ints (see `rank_hand_uncached()`), going through the shared `hand_rank_cache`."""
+    return hand_rank_cache.rank(hand)